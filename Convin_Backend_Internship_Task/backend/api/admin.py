@@ -1,3 +1,185 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min, QuerySet
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .models import BalanceSheet, CustomUser, Expense, ExpenseSplit
+from .search import match_expenses
+
+
+def estimated_rows(model, using):
+
+    """
+    Return the planner's row estimate for `model`'s table, summed over its
+    partitions, or None when the database keeps none (not PostgreSQL, or the
+    table was never analyzed).
+    """
+
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        # A partitioned table keeps no estimate of its own, a plain one has no partition tree.
+        cursor.execute(
+            'SELECT SUM(GREATEST(c.reltuples, 0)) FROM pg_class c WHERE c.oid = to_regclass(%s) '
+            'OR c.oid IN (SELECT relid FROM pg_partition_tree(to_regclass(%s)) WHERE isleaf)',
+            [model._meta.db_table, model._meta.db_table],
+        )
+        estimate = cursor.fetchone()[0]
+    return int(estimate) if estimate else None
+
+
+class EstimatedCountPaginator(Paginator):
+
+    """
+    Paginator that never counts a whole table.
+
+    Rows are counted up to ADMIN_EXACT_COUNT_LIMIT, with the count limited in
+    SQL. Past that, an unfiltered list reports the planner's estimate and a
+    filtered one reports the limit, so deep pages of a filtered list are only
+    reachable by narrowing the filter.
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        rows = self.object_list.order_by()[:limit].count()
+        if rows < limit or self.object_list.query.where:
+            return rows
+        return max(estimated_rows(self.object_list.model, self.object_list.db) or 0, rows)
+
+
+class ProbedDatesQuerySet(QuerySet):
+
+    """
+    QuerySet whose datetimes() probes each year, month or day with an EXISTS
+    over a created_at range instead of truncating every row, so the admin's
+    date hierarchy is served by the created_at indexes and month partitions.
+    """
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        if kind not in ('year', 'month', 'day'):
+            return super().datetimes(field_name, kind, order, tzinfo)
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds['first'] is None:
+            return []
+        tzinfo = tzinfo or timezone.get_current_timezone()
+        start = _truncate(timezone.localtime(bounds['first'], tzinfo), kind)
+        last = timezone.localtime(bounds['last'], tzinfo)
+        found = []
+        while start <= last:
+            end = _following(start, kind)
+            if self.filter(**{f'{field_name}__gte': start, f'{field_name}__lt': end}).exists():
+                found.append(start)
+            start = end
+        return found if order == 'ASC' else found[::-1]
+
+
+def _truncate(moment, kind):
+    return datetime(
+        moment.year,
+        moment.month if kind != 'year' else 1,
+        moment.day if kind == 'day' else 1,
+        tzinfo=moment.tzinfo,
+    )
+
+
+def _following(start, kind):
+    if kind == 'year':
+        return start.replace(year=start.year + 1)
+    if kind == 'month':
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    following = start.date() + timedelta(days=1)
+    return datetime(following.year, following.month, following.day, tzinfo=start.tzinfo)
+
+
+def _users_by_email(email):
+    # Served by the Lower('email') index.
+    return CustomUser.objects.annotate(email_lower=Lower('email')).filter(email_lower=email.lower()).values('id')
+
+
+class LedgerAdmin(admin.ModelAdmin):
+
+    """
+    Read-only change lists for the ledger tables.
+
+    Ledger rows are written through the API, which keeps the balance sheet
+    copies, settlement counters and statements in step, so the admin only
+    views them. Foreign keys are joined in the list query and shown read-only
+    as links, counts go through EstimatedCountPaginator, only indexed columns
+    are sortable, and search_rows only searches through indexes. Lists
+    read the default database; with ledger sharding, other shards are not shown.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    sortable_by = ['id', 'created_at']
+    ordering = ['-id']
+    # Only used to show the search box: get_search_results does the searching.
+    search_fields = ['id']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return ProbedDatesQuerySet(self.model, query=queryset.query.chain(), using=queryset._db)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return self.search_rows(queryset, term), False
+
+    def search_rows(self, queryset, term):
+        # Digits match the expense, an email its participant, anything else the
+        # text of the ADMIN_EXACT_COUNT_LIMIT best matching expenses.
+        if term.isdigit():
+            return queryset.filter(expense_id=int(term))
+        if '@' in term:
+            return queryset.filter(user_id__in=_users_by_email(term))
+        expenses = match_expenses(Expense.objects.using(queryset.db), term)
+        return queryset.filter(expense_id__in=list(expenses.values_list('id', flat=True)[:settings.ADMIN_EXACT_COUNT_LIMIT]))
+
+
+@admin.register(Expense)
+class ExpenseAdmin(LedgerAdmin):
+    list_display = ['id', 'title', 'owner', 'amount', 'split_method', 'status', 'created_at']
+    list_select_related = ['owner']
+    date_hierarchy = 'created_at'
+    search_help_text = 'Expense id, owner email, or words from the title and description.'
+
+    def search_rows(self, queryset, term):
+        if term.isdigit():
+            return queryset.filter(id=int(term))
+        if '@' in term:
+            return queryset.filter(owner_id__in=_users_by_email(term))
+        return match_expenses(queryset, term)
+
+
+@admin.register(ExpenseSplit)
+class ExpenseSplitAdmin(LedgerAdmin):
+    list_display = ['id', 'expense', 'user', 'owner', 'split_amount', 'created_at']
+    list_select_related = ['expense', 'user', 'owner']
+    # No date hierarchy: created_at is only indexed after user or owner here.
+    search_help_text = 'Expense id, participant email, or words from the expense title and description.'
+
 
-# Register your models here.
+@admin.register(BalanceSheet)
+class BalanceSheetAdmin(LedgerAdmin):
+    list_display = ['id', 'expense_id', 'title', 'user', 'owner', 'split_amount', 'amount', 'created_at']
+    list_select_related = ['user', 'owner']
+    date_hierarchy = 'created_at'
+    search_help_text = 'Expense id, participant email, or words from the expense title and description.'
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.models.signals import post_migrate
+        from . import dbstats, search, sharding, slowqueries
+        dbstats.connect_signals()
+        sharding.connect_signals()
+        if settings.SLOW_QUERY_LOG:
+            slowqueries.connect_signals()
+        post_migrate.connect(search.restore_search_triggers, sender=self)
+        post_migrate.connect(sharding.prepare_shards, sender=self)
@@ -0,0 +1,240 @@
+import gzip
+import hashlib
+import heapq
+import json
+import os
+from array import array
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import BalanceSheet, ExpenseSplit, LedgerArchive, LedgerArchiveUser
+from .partitioning import month_start
+
+
+# Columns written for each archived row, in file order.
+ARCHIVE_COLUMNS = {
+    'expensesplit': ('id', 'expense_id', 'user_id', 'owner_id', 'split_amount_cents', 'created_at'),
+    'balancesheet': (
+        'id', 'expense_id', 'user_id', 'owner_id', 'split_amount_cents', 'amount_cents', 'title', 'description', 'created_at'
+    ),
+}
+ARCHIVE_MODELS = {'expensesplit': ExpenseSplit, 'balancesheet': BalanceSheet}
+
+
+def archive_before(cutoff, batch_size=10000, using=DEFAULT_DB_ALIAS):
+
+    """
+    Move ExpenseSplit and BalanceSheet rows created before `cutoff` into archive files.
+
+    Rows are archived one calendar month at a time, each month in its own
+    transaction: the files are written and listed in LedgerArchive, then the
+    rows are deleted from the hot table. `using` is the ledger shard to archive.
+    Returns the new LedgerArchive entries.
+    """
+
+    archives = []
+    for table, model in ARCHIVE_MODELS.items():
+        while True:
+            oldest = model.objects.using(using).filter(created_at__lt=cutoff).aggregate(oldest=Min('created_at'))['oldest']
+            if oldest is None:
+                break
+            end = min(month_start(oldest, 1), cutoff)
+            archives.extend(archive_range(table, month_start(oldest), end, batch_size, using))
+    return archives
+
+
+def archive_range(table, start, end, batch_size=10000, using=DEFAULT_DB_ALIAS):
+
+    """
+    Archive the rows of `table` with start <= created_at < end into new files.
+
+    Rows go to one file per LEDGER_ARCHIVE_BUCKETS bucket of their user_id, and
+    every user appearing in a file, as participant or owner, is listed in
+    LedgerArchiveUser. Returns the LedgerArchive entries, one per file.
+    """
+
+    model = ARCHIVE_MODELS[table]
+    columns = ARCHIVE_COLUMNS[table]
+    user, owner = columns.index('user_id'), columns.index('owner_id')
+    prefix = f'{using}-' if using != DEFAULT_DB_ALIAS else ''
+    name = f'{prefix}{timezone.now():%Y%m%dT%H%M%S%f}'
+    directory = os.path.join(table, f'{start:%Y-%m}')
+    os.makedirs(os.path.join(settings.LEDGER_ARCHIVE_DIR, directory), exist_ok=True)
+
+    parts = {}
+    listed = False
+    try:
+        with transaction.atomic(using=using):
+            with transaction.atomic():
+                rows = model.objects.using(using).filter(created_at__gte=start, created_at__lt=end).order_by('created_at', 'id')
+                try:
+                    for row in rows.values_list(*columns).iterator(chunk_size=batch_size):
+                        bucket = row[user] % settings.LEDGER_ARCHIVE_BUCKETS
+                        part = parts.get(bucket)
+                        if part is None:
+                            relative_path = os.path.join(directory, f'{name}-b{bucket:03d}.jsonl.gz')
+                            path = os.path.join(settings.LEDGER_ARCHIVE_DIR, relative_path)
+                            part = parts[bucket] = {
+                                'relative_path': relative_path,
+                                'path': path,
+                                'file': gzip.open(path + '.tmp', 'xt', encoding='utf-8'),
+                                'ids': array('q'),
+                                'users': set(),
+                            }
+                            part['file'].write(json.dumps({'columns': columns}) + '\n')
+                        part['file'].write(json.dumps(row, default=_encode) + '\n')
+                        part['ids'].append(row[0])
+                        part['users'].update((row[user], row[owner]))
+                finally:
+                    for part in parts.values():
+                        part['file'].close()
+
+                for part in parts.values():
+                    digest = hashlib.sha256()
+                    with open(part['path'] + '.tmp', 'rb') as written:
+                        os.fsync(written.fileno())
+                        for block in iter(lambda: written.read(1 << 20), b''):
+                            digest.update(block)
+                    os.replace(part['path'] + '.tmp', part['path'])
+                    part['sha256'] = digest.hexdigest()
+
+                # Delete exactly the rows that were written, once the files are durable.
+                entries = []
+                for bucket, part in sorted(parts.items()):
+                    ids = part['ids']
+                    for offset in range(0, len(ids), batch_size):
+                        model.objects.using(using).filter(id__in=ids[offset:offset + batch_size].tolist()).delete()
+                    entry = LedgerArchive.objects.create(
+                        table=table,
+                        path=part['relative_path'],
+                        period_start=start,
+                        period_end=end,
+                        row_count=len(ids),
+                        sha256=part['sha256'],
+                    )
+                    LedgerArchiveUser.objects.bulk_create(
+                        [LedgerArchiveUser(archive=entry, user_id=user_id) for user_id in sorted(part['users'] - {None})],
+                        batch_size=batch_size,
+                    )
+                    entries.append(entry)
+            # On a shard other than 'default' the manifest has committed before the
+            # deletes: should they fail, rows are duplicated in reads, never lost.
+            listed = using != DEFAULT_DB_ALIAS
+        return entries
+    except BaseException:
+        # Nothing was deleted, so the partial or orphaned files are not needed.
+        for part in parts.values():
+            for leftover in (part['path'] + '.tmp',) + (() if listed else (part['path'],)):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        raise
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Cannot archive {type(value).__name__}')
+
+
+def archived_rows(table, fields, start=None, end=None, involving=None, **equals):
+
+    """
+    Yield archived rows of `table` as tuples of `fields`, oldest first.
+
+    Only archives overlapping [start, end) are opened, so a date range that lies
+    entirely within the hot tables costs a single manifest query. `equals`
+    filters rows on column values, e.g. user_id=3, and `involving` keeps the
+    rows a user is the participant or the owner of. Either way, only the files
+    listing that user in LedgerArchiveUser are opened.
+    """
+
+    columns = ARCHIVE_COLUMNS[table]
+    archives = LedgerArchive.objects.filter(table=table)
+    if start is not None:
+        archives = archives.filter(period_end__gt=start)
+    if end is not None:
+        archives = archives.filter(period_start__lt=end)
+    for user_id in (equals.get('user_id'), equals.get('owner_id'), involving):
+        if user_id is not None:
+            archives = archives.filter(users__user_id=user_id)
+
+    positions = [columns.index(field) for field in fields]
+    created = columns.index('created_at')
+    user, owner = columns.index('user_id'), columns.index('owner_id')
+    filters = [(columns.index(column), value) for column, value in equals.items()]
+
+    def read(entry):
+        with gzip.open(os.path.join(settings.LEDGER_ARCHIVE_DIR, entry.path), 'rt', encoding='utf-8') as archive:
+            next(archive)  # header
+            for line in archive:
+                row = json.loads(line)
+                if any(row[index] != value for index, value in filters):
+                    continue
+                if involving is not None and involving not in (row[user], row[owner]):
+                    continue
+                row[created] = created_at = datetime.fromisoformat(row[created])
+                if (start is not None and created_at < start) or (end is not None and created_at >= end):
+                    continue
+                yield row
+
+    # The files of one period hold different users' rows; merge them back into creation order.
+    entries = archives.order_by('period_start', 'id').iterator()
+    for _, period in groupby(entries, key=lambda entry: entry.period_start):
+        for row in heapq.merge(*(read(entry) for entry in period), key=lambda row: (row[created], row[0])):
+            yield tuple(row[index] for index in positions)
+
+
+def archived_splits(expenses):
+
+    """
+    Return {expense_id: [(user_id, split_amount_cents), ...]} for the expenses of
+    the `expenses` queryset whose splits were archived, each list in id order.
+
+    Only the periods holding such expenses are read, and when they all have one
+    owner, only the files listing that owner.
+    """
+
+    periods = list(LedgerArchive.objects.filter(table='expensesplit').values_list('period_start', 'period_end').distinct())
+    if not periods:
+        return {}
+    in_archive = Q()
+    for start, end in periods:
+        in_archive |= Q(created_at__gte=start, created_at__lt=end)
+
+    wanted = {}
+    for expense_id, owner_id, created_at in expenses.filter(in_archive).order_by().values_list('id', 'owner_id', 'created_at'):
+        period = next((start, end) for start, end in periods if start <= created_at < end)
+        wanted.setdefault(period, {})[expense_id] = owner_id
+
+    splits = {}
+    for (start, end), owners in sorted(wanted.items()):
+        owner_ids = set(owners.values())
+        equals = {'owner_id': owner_ids.pop()} if len(owner_ids) == 1 else {}
+        for expense_id, user_id, cents in archived_rows('expensesplit', ('expense_id', 'user_id', 'split_amount_cents'), start, end, **equals):
+            if expense_id in owners:
+                splits.setdefault(expense_id, []).append((user_id, cents))
+    return splits
+
+
+def is_archived(created_at):
+
+    """
+    Return whether rows created at `created_at` fall in an archived period.
+    """
+
+    return LedgerArchive.objects.filter(period_start__lte=created_at, period_end__gt=created_at).exists()
+
+
+def archive_cutoff(days=None):
+
+    """
+    Return the cutoff for rows older than `days` (default LEDGER_ARCHIVE_AFTER_DAYS).
+    """
+
+    days = settings.LEDGER_ARCHIVE_AFTER_DAYS if days is None else days
+    return timezone.now() - timedelta(days=days)
@@ -0,0 +1,132 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from .models import CustomUser
+from .sharding import replicate_users
+from .serializers import BulkCustomUserSerializer
+
+
+def _init_worker():
+    # Spawned (non-forked) workers start without a configured Django.
+    if not apps.ready:
+        django.setup()
+
+
+class BulkRegistration:
+
+    """
+    Validate, hash and insert users in batches.
+
+    Rows are validated with CustomUserSerializer's rules. Email and mobile
+    uniqueness is checked against the file itself and against the database with
+    one query per batch. Passwords are hashed across a process pool, since PBKDF2
+    dominates the cost of registering a user.
+    """
+
+    def __init__(self, workers=1, batch_size=1000):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.created = 0
+        self.errors = []
+        self.conflicts = []
+        self._seen_emails = set()
+        self._seen_mobiles = set()
+        self._pool = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def register(self, rows):
+
+        """
+        Register users from an iterable of (line_number, row_dict) pairs.
+        """
+
+        batch = []
+        for line, row in rows:
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                self._register_batch(batch)
+                batch = []
+        if batch:
+            self._register_batch(batch)
+
+    def hash_passwords(self, passwords):
+        if self._pool is None:
+            return [make_password(password) for password in passwords]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self._pool.map(make_password, passwords, chunksize=chunksize))
+
+    def _register_batch(self, batch):
+        valid = []
+        for line, row in batch:
+            serializer = BulkCustomUserSerializer(data=row)
+            if not serializer.is_valid():
+                self.errors.append((line, serializer.errors))
+                continue
+            data = serializer.validated_data
+            data['email'] = CustomUser.objects.normalize_email(data['email'])
+            if data['email'] in self._seen_emails:
+                self.conflicts.append((line, 'email', data['email']))
+            elif data['mobile'] in self._seen_mobiles:
+                self.conflicts.append((line, 'mobile', data['mobile']))
+            else:
+                self._seen_emails.add(data['email'])
+                self._seen_mobiles.add(data['mobile'])
+                valid.append((line, data))
+
+        if not valid:
+            return
+
+        taken = CustomUser.objects.filter(
+            Q(email__in=[data['email'] for _, data in valid]) | Q(mobile__in=[data['mobile'] for _, data in valid])
+        ).values_list('email', 'mobile')
+        taken_emails = {email for email, _ in taken}
+        taken_mobiles = {mobile for _, mobile in taken}
+
+        pending = []
+        for line, data in valid:
+            if data['email'] in taken_emails:
+                self.conflicts.append((line, 'email', data['email']))
+            elif data['mobile'] in taken_mobiles:
+                self.conflicts.append((line, 'mobile', data['mobile']))
+            else:
+                pending.append((line, data))
+
+        if not pending:
+            return
+
+        hashes = self.hash_passwords([data['password'] for _, data in pending])
+        users = [
+            (line, CustomUser(email=data['email'], name=data['name'], mobile=data['mobile'], password=password_hash))
+            for (line, data), password_hash in zip(pending, hashes)
+        ]
+
+        try:
+            with transaction.atomic():
+                CustomUser.objects.bulk_create([user for _, user in users])
+            # bulk_create sends no post_save, so copy the users to the ledger shards here.
+            replicate_users([user for _, user in users])
+            self.created += len(users)
+        except IntegrityError:
+            # Someone registered one of these users since the check above;
+            # insert row by row so only the clashing rows are rejected.
+            for line, user in users:
+                try:
+                    with transaction.atomic():
+                        user.save()
+                    self.created += 1
+                except IntegrityError:
+                    self.conflicts.append((line, 'email/mobile', user.email))
@@ -0,0 +1,84 @@
+import threading
+
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+_lock = threading.Lock()
+_counters = {'requests': 0, 'connections_opened': {}}
+
+
+def _on_request_started(sender, **kwargs):
+    with _lock:
+        _counters['requests'] += 1
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    with _lock:
+        opened = _counters['connections_opened']
+        opened[connection.alias] = opened.get(connection.alias, 0) + 1
+
+
+def connect_signals():
+
+    """
+    Start counting requests and newly opened database connections.
+    """
+
+    request_started.connect(_on_request_started, dispatch_uid='api.dbstats.request_started')
+    connection_created.connect(_on_connection_created, dispatch_uid='api.dbstats.connection_created')
+
+
+def pool_stats(connection):
+
+    """
+    Return wait time and saturation figures for a pooled connection, or None.
+    """
+
+    pool = getattr(connection, 'pool', None)
+    if pool is None:
+        return None
+
+    stats = pool.get_stats()
+    max_size = stats.get('pool_max') or 1
+    in_use = stats.get('pool_size', 0) - stats.get('pool_available', 0)
+    queued = stats.get('requests_queued', 0)
+    return {
+        'min_size': stats.get('pool_min'),
+        'max_size': stats.get('pool_max'),
+        'size': stats.get('pool_size'),
+        'available': stats.get('pool_available'),
+        'in_use': in_use,
+        'saturation': round(in_use / max_size, 3),
+        'requests_waiting': stats.get('requests_waiting', 0),
+        'requests_queued': queued,
+        'requests_errors': stats.get('requests_errors', 0),
+        'wait_ms_total': stats.get('requests_wait_ms', 0),
+        'wait_ms_avg': round(stats.get('requests_wait_ms', 0) / queued, 3) if queued else 0.0,
+    }
+
+
+def connection_stats():
+
+    """
+    Collect per-alias connection settings, reuse counters and pool metrics.
+    """
+
+    with _lock:
+        requests = _counters['requests']
+        opened = dict(_counters['connections_opened'])
+
+    databases = {}
+    for alias in connections:
+        connection = connections[alias]
+        alias_opened = opened.get(alias, 0)
+        databases[alias] = {
+            'vendor': connection.vendor,
+            'conn_max_age': connection.settings_dict.get('CONN_MAX_AGE'),
+            'health_checks': connection.settings_dict.get('CONN_HEALTH_CHECKS'),
+            'connections_opened': alias_opened,
+            'reuse_ratio': round(1 - alias_opened / requests, 3) if requests and alias_opened <= requests else 0.0,
+            'pool': pool_stats(connection),
+        }
+    return {'requests': requests, 'databases': databases}
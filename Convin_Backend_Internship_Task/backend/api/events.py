@@ -0,0 +1,137 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .money import format_cents
+
+
+class Subscription:
+
+    """
+    A bounded per-connection event queue bound to the event loop that created it.
+    """
+
+    def __init__(self, maxsize):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def offer(self, event):
+        # Runs on self.loop. A slow consumer loses its oldest events, not the newest.
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessBroker:
+
+    """
+    Pub/sub for balance events within a single process.
+
+    Subscribers are asyncio queues, so idle connections cost no threads. publish()
+    is thread-safe and may be called from synchronous request or worker code.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self.queue_size)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[user_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def publish(self, user_id, event):
+        if user_id not in self._subscriptions:
+            return
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # The subscriber's loop has already shut down.
+                self.unsubscribe(user_id, subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+
+    """
+    Return the process-wide broker configured by BALANCE_EVENTS_BACKEND.
+    """
+
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.BALANCE_EVENTS_BACKEND)()
+    return _broker
+
+
+def publish_balance_changes(expense, splits):
+
+    """
+    Notify every participant of an expense, and its owner, about the new splits.
+    """
+
+    broker = get_broker()
+    for user_id, split_cents in splits:
+        broker.publish(user_id, {
+            'type': 'balance_changed',
+            'role': 'participant',
+            'expense_id': expense.id,
+            'owner_id': expense.owner_id,
+            'title': expense.title,
+            'split_amount': format_cents(split_cents),
+            'amount': format_cents(expense.amount_cents),
+        })
+    broker.publish(expense.owner_id, {
+        'type': 'balance_changed',
+        'role': 'owner',
+        'expense_id': expense.id,
+        'owner_id': expense.owner_id,
+        'title': expense.title,
+        'participants': len(splits),
+        'amount': format_cents(expense.amount_cents),
+    })
+
+
+def publish_settlement(settlement):
+
+    """
+    Notify both sides of a settlement.
+    """
+
+    broker = get_broker()
+    for user_id, role in ((settlement.payer_id, 'payer'), (settlement.payee_id, 'payee')):
+        broker.publish(user_id, {
+            'type': 'balance_changed',
+            'role': role,
+            'settlement_id': settlement.id,
+            'payer_id': settlement.payer_id,
+            'payee_id': settlement.payee_id,
+            'amount': format_cents(settlement.amount_cents),
+        })
@@ -0,0 +1,178 @@
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from django.conf import settings
+
+from .money import format_cents
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+logger = logging.getLogger(__name__)
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+# BalanceSheet columns read for NDJSON rows, and the key each is written under.
+NDJSON_COLUMNS = (
+    ('id', 'id'),
+    ('expense_id', 'expense_id'),
+    ('user_id', 'user_id'),
+    ('owner_id', 'owner_id'),
+    ('split_amount_cents', 'split_amount'),
+    ('amount_cents', 'amount'),
+    ('title', 'title'),
+    ('description', 'description'),
+    ('created_at', 'created_at'),
+)
+_CENTS = {'split_amount_cents', 'amount_cents'}
+
+_tracing_lock = threading.Lock()
+_tracing = {'profiles': 0, 'started': False}
+
+
+def _dumps(obj):
+    if orjson is not None:
+        encoded = orjson.dumps(obj)
+    else:
+        encoded = json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+    # Line-oriented readers such as str.splitlines() also break on these two.
+    return encoded.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def ndjson_rows(rows):
+
+    """
+    Encode tuples of NDJSON_COLUMNS as one JSON object per line.
+
+    IDs stay integers, money is an exact two-place decimal string and timestamps
+    are ISO 8601 strings.
+    """
+
+    keys = [key for _, key in NDJSON_COLUMNS]
+    cents = [index for index, (column, _) in enumerate(NDJSON_COLUMNS) if column in _CENTS]
+    created = [column for column, _ in NDJSON_COLUMNS].index('created_at')
+    for row in rows:
+        values = list(row)
+        for index in cents:
+            values[index] = format_cents(values[index])
+        if isinstance(values[created], datetime):
+            values[created] = values[created].isoformat()
+        yield _dumps(dict(zip(keys, values))) + b'\n'
+
+
+def buffered(chunks, size=None):
+
+    """
+    Join small byte strings into chunks of about `size` bytes (EXPORT_BUFFER_BYTES).
+
+    The generator is only advanced when the server is ready to send more, so a
+    slow client slows down the database reads instead of growing a buffer.
+    """
+
+    size = settings.EXPORT_BUFFER_BYTES if size is None else size
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= size:
+            yield b''.join(pending)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield b''.join(pending)
+
+
+def profile_memory(chunks, name):
+
+    """
+    Return `chunks`, traced with tracemalloc when EXPORT_MEMORY_PROFILE is set.
+
+    `chunks` yields one chunk per exported row. When the stream ends, or the
+    client goes away, the profile is logged on this module's logger with the
+    report in the record's `export_profile` attribute: rows, peak traced memory
+    above the starting point and per row, the net blocks still allocated per
+    row at the highest sample, and the top allocation sites at that moment.
+    Memory is sampled every EXPORT_MEMORY_SAMPLE_ROWS rows. tracemalloc is
+    process-wide, so exports profiled at the same time see each other's memory.
+    """
+
+    if not settings.EXPORT_MEMORY_PROFILE:
+        return chunks
+    return _profiled(chunks, name)
+
+
+def _start_tracing():
+    with _tracing_lock:
+        _tracing['profiles'] += 1
+        if _tracing['profiles'] == 1 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing['started'] = True
+
+
+def _stop_tracing():
+    with _tracing_lock:
+        _tracing['profiles'] -= 1
+        if _tracing['profiles'] == 0 and _tracing['started']:
+            tracemalloc.stop()
+            _tracing['started'] = False
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ])
+
+
+def _profiled(chunks, name):
+    _start_tracing()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        before = _snapshot()
+    except BaseException:
+        _stop_tracing()
+        raise
+    highest, highest_snapshot = baseline, None
+    rows = 0
+    started = time.perf_counter()
+    try:
+        for chunk in chunks:
+            rows += 1
+            if rows % settings.EXPORT_MEMORY_SAMPLE_ROWS == 0:
+                current, _ = tracemalloc.get_traced_memory()
+                if current > highest:
+                    highest, highest_snapshot = current, _snapshot()
+            yield chunk
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        sites = (highest_snapshot or _snapshot()).compare_to(before, 'lineno')
+        _stop_tracing()
+        grown = [stat for stat in sites if stat.size_diff > 0]
+        peak_bytes = max(peak - baseline, 0)
+        report = {
+            'export': name,
+            'rows': rows,
+            'seconds': round(time.perf_counter() - started, 3),
+            'peak_bytes': peak_bytes,
+            'peak_bytes_per_row': round(peak_bytes / rows, 1) if rows else None,
+            'blocks_per_row': round(sum(stat.count_diff for stat in grown) / rows, 3) if rows else None,
+            'top_sites': [
+                {'site': str(stat.traceback), 'bytes': stat.size_diff, 'blocks': stat.count_diff}
+                for stat in grown[:settings.EXPORT_MEMORY_TOP]
+            ],
+        }
+        logger.info(
+            'Export %s: %d rows, peak %.1f KiB (%s bytes/row), top site %s',
+            name, rows, peak_bytes / 1024, report['peak_bytes_per_row'],
+            report['top_sites'][0]['site'] if report['top_sites'] else '-',
+            extra={'export_profile': report},
+        )
@@ -0,0 +1,70 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def request_fingerprint(request):
+
+    """
+    Hash the parsed request payload independently of key order.
+    """
+
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def idempotent_response(request, key, handler):
+
+    """
+    Run `handler` once per (user, key) and replay its response for retries.
+
+    The key row is inserted in the same transaction as the work it guards. A
+    concurrent duplicate blocks on the unique index entry until the first request
+    commits and then replays its stored response, so no table lock is needed.
+    Failed requests roll the key back and can be retried.
+    """
+
+    if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+        return Response({'error': 'Idempotency-Key is too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+    fingerprint = request_fingerprint(request)
+    now = timezone.now()
+
+    with transaction.atomic():
+        # Expired keys are free to be reused.
+        IdempotencyKey.objects.filter(user=request.user, key=key, expires_at__lte=now).delete()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=request.user,
+                    key=key,
+                    request_hash=fingerprint,
+                    expires_at=now + settings.IDEMPOTENCY_KEY_TTL,
+                )
+        except IntegrityError:
+            record = IdempotencyKey.objects.get(user=request.user, key=key)
+            if record.request_hash != fingerprint:
+                return Response(
+                    {'error': 'Idempotency-Key was already used with a different request'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            response = Response(record.response_body, status=record.status_code)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        response = handler()
+        record.status_code = response.status_code
+        record.response_body = response.data
+        record.save(update_fields=['status_code', 'response_body'])
+
+    return response
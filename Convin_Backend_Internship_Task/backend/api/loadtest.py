@@ -0,0 +1,465 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+
+class Histogram:
+
+    """
+    HDR-style latency histogram over integer microseconds.
+
+    Values are bucketed log-linearly: each value keeps its top significant_bits
+    bits, so it is known to a relative precision of 2 ** (1 - significant_bits)
+    (three significant digits with the default of 11) in memory that grows with
+    the number of distinct buckets hit, not the number of samples.
+    """
+
+    def __init__(self, significant_bits=11):
+        self.bits = significant_bits
+        self.counts = {}
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def _index(self, value):
+        shift = max(value.bit_length() - self.bits, 0)
+        return shift, value >> shift
+
+    def record(self, value, count=1):
+        value = max(int(value), 0)
+        key = self._index(value)
+        self.counts[key] = self.counts.get(key, 0) + count
+        self.total += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.sum / self.total if self.total else 0
+
+    def percentile(self, percent):
+
+        """
+        Return the value at `percent` (0-100), as the top of its bucket, capped at max.
+        """
+
+        if not self.total:
+            return 0
+        rank = max(1, -(-self.total * percent // 100))
+        seen = 0
+        for shift, sub_bucket in sorted(self.counts):
+            seen += self.counts[(shift, sub_bucket)]
+            if seen >= rank:
+                return min(((sub_bucket + 1) << shift) - 1, self.max)
+        return self.max
+
+    def distribution(self, percents=(50, 75, 90, 95, 99, 99.9, 99.99, 100)):
+        return [(percent, self.percentile(percent)) for percent in percents]
+
+
+class HTTPClient:
+
+    """
+    Minimal asyncio HTTP/1.1 client with one keep-alive connection.
+
+    Handles Content-Length, chunked and read-until-close bodies, which covers
+    runserver, gunicorn and uvicorn. Standard library only, so the load test has
+    no extra dependencies.
+    """
+
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        if parts.scheme != 'http':
+            raise ValueError('Only http:// targets are supported.')
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+
+        """
+        Send one request and return (status, headers, body bytes).
+        """
+
+        return await asyncio.wait_for(self._request(method, path, body, headers or {}), self.timeout)
+
+    async def _request(self, method, path, body, headers):
+        payload = b'' if body is None else json.dumps(body).encode()
+        lines = [
+            f'{method} {self.prefix}{path} HTTP/1.1',
+            f'Host: {self.host}:{self.port}',
+            'Connection: keep-alive',
+            f'Content-Length: {len(payload)}',
+        ]
+        if body is not None:
+            lines.append('Content-Type: application/json')
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        raw = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + payload
+
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+                fresh = True
+            else:
+                fresh = False
+            try:
+                self.writer.write(raw)
+                await self.writer.drain()
+                return await self._read_response()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self.close()
+                # A reused keep-alive connection may have been closed by the server.
+                if fresh or attempt:
+                    raise
+
+    async def _read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed before the response.')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)
+            content = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            content = await self.reader.readexactly(int(response_headers['content-length']))
+        else:
+            content = await self.reader.read()
+            await self.close()
+            return status, response_headers, content
+
+        if response_headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, response_headers, content
+
+
+# Named routes of backend/urls.py that default_routes() leaves out.
+EXCLUDED_URL_NAMES = frozenset({'balance-events', 'db-stats', 'slow-queries'})
+
+
+class Route:
+
+    """
+    One weighted entry of the request mix.
+
+    `build(session)` returns (method, path, json body or None); `ok` lists the
+    status codes counted as success. `after(session, body)`, if given, is called
+    with the response body of every successful request.
+    """
+
+    def __init__(self, name, weight, build, ok=(200,), after=None):
+        self.name = name
+        self.weight = weight
+        self.build = build
+        self.ok = frozenset(ok)
+        self.after = after
+
+
+def _splits(session, method):
+    users = random.sample(session.user_ids, min(len(session.user_ids), 3))
+    body = {'amount': '90.00', 'title': f'Load test {method}', 'description': 'Load test', 'split_method': method}
+    if method == 'exact':
+        cents = [9000 // len(users)] * len(users)
+        cents[0] += 9000 - sum(cents)
+        body['exact_splits'] = [{'user': user, 'split_amount': f'{c // 100}.{c % 100:02d}'} for user, c in zip(users, cents)]
+    elif method == 'percentage':
+        shares = [100 // len(users)] * len(users)
+        shares[0] += 100 - sum(shares)
+        body['percentage_splits'] = [{'user': user, 'percentage': share} for user, share in zip(users, shares)]
+    return 'POST', '/api/create-expense/', body
+
+
+def _created(session, body):
+    # Only this session's token may edit or delete the expense.
+    session.expense_ids.append(json.loads(body)['id'])
+
+
+def _edit(session):
+    if not session.expense_ids:
+        return 'GET', '/api/user/current-user-expenses/', None
+    body = {'amount': '120.00', 'title': 'Load test edit', 'description': 'Load test', 'split_method': 'equal'}
+    return 'PUT', f'/api/expenses/{random.choice(session.expense_ids)}/', body
+
+
+def _delete(session):
+    if not session.expense_ids:
+        return 'GET', '/api/user/current-user-expenses/', None
+    # Popped, so no other worker of the session deletes it again.
+    return 'DELETE', f'/api/expenses/{session.expense_ids.pop(random.randrange(len(session.expense_ids)))}/', None
+
+
+def _settle(session):
+    others = [user_id for user_id in session.user_ids if user_id != session.user_id]
+    if not others:
+        return 'GET', '/api/settlements/', None
+    return 'POST', '/api/settlements/', {'payee': random.choice(others), 'amount': '1.00', 'note': 'Load test'}
+
+
+def default_routes():
+
+    """
+    The default mix over the routes in backend/urls.py.
+
+    Left out: the routes named in EXCLUDED_URL_NAMES, that is the balance event
+    stream (long-lived by design) and the admin-only db-stats and slow-queries
+    views, as well as the admin site and the browsable-API login. Expenses are
+    edited and deleted among those the session created with exact or
+    percentage splits.
+    """
+
+    return [
+        Route('register', 1, lambda s: ('POST', '/api/user/register/', s.new_user()), ok=(201,)),
+        Route('token', 1, lambda s: ('POST', '/api/token/', {'email': s.email, 'password': s.password})),
+        Route('token-refresh', 1, lambda s: ('POST', '/api/token/refresh/', {'refresh': s.refresh})),
+        Route('user-list', 4, lambda s: ('GET', '/api/users/?fields=id,name', None)),
+        Route('get-user-by-email', 4, lambda s: ('POST', '/api/user/getbyemail/', {'email': s.email})),
+        Route('bulk-user-lookup', 2, lambda s: ('POST', '/api/users/lookup/', {'emails': s.emails[:20]})),
+        Route('create-expense-equal', 1, lambda s: _splits(s, 'equal'), ok=(201,)),
+        Route('create-expense-exact', 3, lambda s: _splits(s, 'exact'), ok=(201,), after=_created),
+        Route('create-expense-percentage', 3, lambda s: _splits(s, 'percentage'), ok=(201,), after=_created),
+        # Another worker of the session may have deleted the expense meanwhile.
+        Route('expense-edit', 2, _edit, ok=(200, 404)),
+        Route('expense-delete', 1, _delete, ok=(200, 204)),
+        Route('current-user-expenses', 6, lambda s: ('GET', '/api/user/current-user-expenses/', None)),
+        Route('get-all-expenses', 2, lambda s: ('GET', '/api/get-all-expenses/?fields=id,title,amount', None)),
+        Route('get-expenses-by-user', 4, lambda s: ('GET', f'/api/user/{random.choice(s.user_ids)}/expenses/', None)),
+        Route('expense-search', 3, lambda s: ('GET', '/api/expenses/search/?' + urlencode({'q': 'load test'}), None)),
+        Route('balance-summary', 4, lambda s: ('GET', '/api/summary/', None)),
+        Route('statement', 2, lambda s: ('GET', f'/api/statements/{s.today[:4]}/{int(s.today[5:7])}/', None)),
+        Route('settle', 2, _settle, ok=(200, 201)),
+        Route('settlements', 2, lambda s: ('GET', '/api/settlements/', None)),
+        Route('balance-sheet-csv', 2, lambda s: ('GET', '/api/balance-sheet/', None)),
+        Route('balance-sheet-ndjson', 1, lambda s: ('GET', '/api/balance-sheet/?export_format=ndjson', None)),
+        Route('overall-balance-sheet-csv', 1, lambda s: ('GET', '/api/overall-balance-sheet/?start=' + s.today, None)),
+    ]
+
+
+class Session:
+
+    """
+    A registered load-test user with its tokens, plus the ids of all such users.
+    """
+
+    def __init__(self, run_id, index, password):
+        self.run_id = run_id
+        self.email = f'load-{run_id}-{index}@example.com'
+        self.password = password
+        self.mobile = f'+1{uuid.uuid4().int % 10 ** 10:010d}'
+        self.user_id = None
+        self.access = None
+        self.refresh = None
+        self.user_ids = []
+        self.emails = []
+        self.expense_ids = []
+        self.today = time.strftime('%Y-%m-%d', time.gmtime())
+
+    def new_user(self):
+        suffix = uuid.uuid4().hex[:12]
+        return {
+            'email': f'load-{self.run_id}-{suffix}@example.com',
+            'name': 'Load Test',
+            'mobile': f'+1{int(suffix, 16) % 10 ** 10:010d}',
+            'password': self.password,
+        }
+
+
+class LoadTest:
+
+    """
+    Drive a weighted route mix against a running server.
+
+    Closed loop (`concurrency` workers issuing back-to-back requests) or open
+    loop (`rps` requests started per second, independent of response times).
+    In open-loop mode latency is measured from each request's scheduled start,
+    so a stalled server shows up in the percentiles instead of silently lowering
+    the request rate (coordinated omission).
+    """
+
+    def __init__(self, base_url, routes=None, users=5, concurrency=10, rps=None, duration=10.0, warmup=0.0, timeout=30.0):
+        self.base_url = base_url
+        self.routes = [route for route in (routes or default_routes()) if route.weight > 0]
+        self.users = users
+        self.concurrency = concurrency
+        self.rps = rps
+        self.duration = duration
+        self.warmup = warmup
+        self.timeout = timeout
+        self.histograms = {route.name: Histogram() for route in self.routes}
+        self.errors = {route.name: {} for route in self.routes}
+        self.elapsed = 0.0
+
+    async def setup(self):
+        run_id = uuid.uuid4().hex[:8]
+        password = uuid.uuid4().hex
+        sessions = [Session(run_id, index, password) for index in range(self.users)]
+        client = HTTPClient(self.base_url, self.timeout)
+        try:
+            for session in sessions:
+                status, _, body = await client.request('POST', '/api/user/register/', {
+                    'email': session.email, 'name': 'Load Test', 'mobile': session.mobile, 'password': password,
+                })
+                if status != 201:
+                    raise RuntimeError(f'Registering {session.email} failed with {status}: {body[:200]!r}')
+                session.user_id = json.loads(body)['id']
+                status, _, body = await client.request('POST', '/api/token/', {'email': session.email, 'password': password})
+                if status != 200:
+                    raise RuntimeError(f'Authenticating {session.email} failed with {status}: {body[:200]!r}')
+                tokens = json.loads(body)
+                session.access, session.refresh = tokens['access'], tokens['refresh']
+        finally:
+            await client.close()
+        for session in sessions:
+            session.user_ids = [other.user_id for other in sessions]
+            session.emails = [other.email for other in sessions]
+        return sessions
+
+    def pick(self):
+        return random.choices(self.routes, weights=[route.weight for route in self.routes])[0]
+
+    async def issue(self, client, session, route, scheduled, measure_from):
+        method, path, body = route.build(session)
+        try:
+            status, _, content = await client.request(method, path, body, {'Authorization': f'Bearer {session.access}'})
+            outcome = None if status in route.ok else str(status)
+            if outcome is None and route.after is not None:
+                route.after(session, content)
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+        except (OSError, ValueError, asyncio.IncompleteReadError) as exc:
+            outcome = type(exc).__name__
+            await client.close()
+        if scheduled >= measure_from:
+            self.histograms[route.name].record((time.perf_counter() - scheduled) * 1_000_000)
+            if outcome is not None:
+                self.errors[route.name][outcome] = self.errors[route.name].get(outcome, 0) + 1
+
+    async def closed_loop(self, sessions, measure_from, deadline):
+        async def worker(index):
+            client = HTTPClient(self.base_url, self.timeout)
+            session = sessions[index % len(sessions)]
+            try:
+                while time.perf_counter() < deadline:
+                    await self.issue(client, session, self.pick(), time.perf_counter(), measure_from)
+            finally:
+                await client.close()
+
+        await asyncio.gather(*(worker(index) for index in range(self.concurrency)))
+
+    async def open_loop(self, sessions, measure_from, deadline):
+        idle = asyncio.Queue()
+        for _ in range(self.concurrency):
+            idle.put_nowait(HTTPClient(self.base_url, self.timeout))
+        tasks = set()
+        interval = 1 / self.rps
+        scheduled = time.perf_counter()
+        index = 0
+
+        async def send(route, session, at):
+            client = await idle.get()
+            try:
+                await self.issue(client, session, route, at, measure_from)
+            finally:
+                idle.put_nowait(client)
+
+        while scheduled < deadline:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(send(self.pick(), sessions[index % len(sessions)], scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            index += 1
+            scheduled += interval
+        await asyncio.gather(*tasks)
+        while not idle.empty():
+            await idle.get_nowait().close()
+
+    async def run(self):
+        sessions = await self.setup()
+        started = time.perf_counter()
+        measure_from = started + self.warmup
+        deadline = measure_from + self.duration
+        if self.rps:
+            await self.open_loop(sessions, measure_from, deadline)
+        else:
+            await self.closed_loop(sessions, measure_from, deadline)
+        self.elapsed = max(time.perf_counter() - measure_from, 1e-9)
+        return self.report()
+
+    def report(self):
+
+        """
+        Return per-route and overall results as plain data (latencies in ms).
+        """
+
+        overall = Histogram()
+        routes = {}
+        for name, histogram in self.histograms.items():
+            overall.merge(histogram)
+            routes[name] = self._summarize(histogram, self.errors[name])
+        all_errors = {}
+        for errors in self.errors.values():
+            for outcome, count in errors.items():
+                all_errors[outcome] = all_errors.get(outcome, 0) + count
+        return {
+            'mode': f'{self.rps} rps' if self.rps else f'{self.concurrency} concurrent',
+            'duration_s': round(self.elapsed, 3),
+            'overall': self._summarize(overall, all_errors),
+            'routes': routes,
+            'distribution': [(percent, round(value / 1000, 3)) for percent, value in overall.distribution()],
+        }
+
+    def _summarize(self, histogram, errors):
+        failed = sum(errors.values())
+        return {
+            'requests': histogram.total,
+            'throughput_rps': round(histogram.total / self.elapsed, 2) if self.elapsed else 0,
+            'error_rate': round(failed / histogram.total, 4) if histogram.total else 0,
+            'errors': errors,
+            'mean_ms': round(histogram.mean() / 1000, 3),
+            'p50_ms': round(histogram.percentile(50) / 1000, 3),
+            'p90_ms': round(histogram.percentile(90) / 1000, 3),
+            'p99_ms': round(histogram.percentile(99) / 1000, 3),
+            'p999_ms': round(histogram.percentile(99.9) / 1000, 3),
+            'max_ms': round(histogram.max / 1000, 3),
+        }
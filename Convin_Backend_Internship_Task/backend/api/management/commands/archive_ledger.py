@@ -0,0 +1,34 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from api.archive import archive_before, archive_cutoff
+from api.sharding import ledger_shards
+
+
+class Command(BaseCommand):
+    help = 'Move ExpenseSplit and BalanceSheet rows older than a cutoff into compressed archive files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Archive rows created before this date (YYYY-MM-DD).')
+        parser.add_argument('--older-than-days', type=int, default=None,
+                            help='Archive rows older than this many days (defaults to LEDGER_ARCHIVE_AFTER_DAYS).')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options['before']:
+            day = parse_date(options['before'])
+            if day is None:
+                raise CommandError('--before expects a date in YYYY-MM-DD format.')
+            cutoff = timezone.make_aware(datetime.combine(day, time.min))
+        else:
+            cutoff = archive_cutoff(options['older_than_days'])
+
+        archives = []
+        for using in ledger_shards():
+            archives.extend(archive_before(cutoff, batch_size=options['batch_size'], using=using))
+        for archive in archives:
+            self.stdout.write(f'{archive.path}: {archive.row_count} row(s)')
+        self.stdout.write(f'Archived {sum(archive.row_count for archive in archives)} row(s) created before {cutoff:%Y-%m-%d %H:%M}.')
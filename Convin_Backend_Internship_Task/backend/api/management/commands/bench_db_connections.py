@@ -0,0 +1,72 @@
+import io
+import json
+import logging
+import statistics
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request latency of GetUserByEmailView with and without persistent connections.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests to issue per mode.')
+        parser.add_argument('--max-age', type=int, default=60, help='CONN_MAX_AGE used for the persistent run.')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        original_max_age = connection.settings_dict.get('CONN_MAX_AGE', 0)
+        handler = WSGIHandler()
+        # The lookup is for a missing user, so keep the 404 warnings out of the output.
+        request_logger = logging.getLogger('django.request')
+        original_level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+
+        try:
+            for label, max_age in (('fresh connection', 0), ('persistent connection', options['max_age'])):
+                # Django reads CONN_MAX_AGE when it opens a connection, so start each run from a closed one.
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = max_age
+                timings = self.run(handler, options['requests'])
+                self.report(label, timings)
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = original_max_age
+            request_logger.setLevel(original_level)
+
+    def run(self, handler, count):
+        body = json.dumps({'email': 'bench-missing-user@example.invalid'}).encode()
+        timings = []
+        for _ in range(count):
+            environ = {
+                'REQUEST_METHOD': 'POST',
+                'PATH_INFO': '/api/user/getbyemail/',
+                'SERVER_NAME': 'localhost',
+                'SERVER_PORT': '80',
+                'HTTP_HOST': 'localhost',
+                'CONTENT_TYPE': 'application/json',
+                'CONTENT_LENGTH': str(len(body)),
+                'wsgi.input': io.BytesIO(body),
+                'wsgi.url_scheme': 'http',
+                'wsgi.errors': io.StringIO(),
+            }
+            started = time.perf_counter()
+            # Going through the WSGI handler fires request_started/request_finished,
+            # which is where Django closes connections that are not persistent.
+            response = handler(environ, lambda status, headers: None)
+            b''.join(response)
+            response.close()
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def report(self, label, timings):
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f'{label:<22} mean={statistics.mean(timings):.3f}ms '
+            f'p50={statistics.median(timings):.3f}ms p95={p95:.3f}ms'
+        )
@@ -0,0 +1,71 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api.models import CustomUser, Expense, ExpenseSplit
+from api.readplans import read_plan_for
+from api.renderers import FastJSONRenderer
+from api.serializers import CustomUserListSerializer, ExpenseCreateSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare CPU time of serializer-based and read-plan list rendering on seeded data (rolled back afterwards).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expenses', type=int, default=5000)
+        parser.add_argument('--splits', type=int, default=4, help='Splits per expense.')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options['expenses'], options['splits'])
+                self.compare('GetAllExpensesView', ExpenseCreateSerializer, Expense.objects.all(), options['repeat'])
+                self.compare('UserListView', CustomUserListSerializer, CustomUser.objects.all(), options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, expenses, splits):
+        users = CustomUser.objects.bulk_create([
+            CustomUser(email=f'bench{i}@example.invalid', name=f'Bench User {i}', mobile=f'+9100000{i:05d}', password='!')
+            for i in range(max(splits, 1) * 10)
+        ])
+        owner = users[0]
+        created = Expense.objects.bulk_create([
+            Expense(owner=owner, amount=Decimal('100.00'), title=f'Expense {i}', description='Benchmark', split_method='equal')
+            for i in range(expenses)
+        ])
+        ExpenseSplit.objects.bulk_create([
+            ExpenseSplit(expense=expense, user=users[(index + n) % len(users)], split_amount=Decimal('100.00') / splits)
+            for index, expense in enumerate(created)
+            for n in range(splits)
+        ], batch_size=5000)
+
+    def compare(self, label, serializer_class, queryset, repeat):
+        def serializer_path():
+            return JSONRenderer().render(serializer_class(queryset.all(), many=True).data)
+
+        def plan_path():
+            return FastJSONRenderer().render(read_plan_for(serializer_class).rows(queryset.all()))
+
+        assert serializer_path() == plan_path()
+        slow = self.measure(serializer_path, repeat)
+        fast = self.measure(plan_path, repeat)
+        self.stdout.write(f'{label:<20} serializer={slow * 1000:.1f}ms read-plan={fast * 1000:.1f}ms speedup={slow / fast:.1f}x')
+
+    def measure(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.process_time()
+            func()
+            elapsed = time.process_time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,41 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.models import BalanceSheet, Settlement, Statement
+from api.partitioning import month_start
+from api.sharding import ledger_shards
+from api.statements import build_statement, period_bounds
+
+
+class Command(BaseCommand):
+    help = 'Build the monthly statements of every user active in a month (by default the previous one).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', help='Month to build, as YYYY-MM.')
+
+    def handle(self, *args, **options):
+        if options['period']:
+            try:
+                period = datetime.strptime(options['period'], '%Y-%m').replace(tzinfo=dt_timezone.utc)
+            except ValueError:
+                raise CommandError('--period expects a month in YYYY-MM format.')
+        else:
+            period = month_start(timezone.now(), -1)
+        start, end = period_bounds(period)
+
+        users = set()
+        for using in ledger_shards():
+            rows = BalanceSheet.objects.using(using).filter(created_at__gte=start, created_at__lt=end)
+            users.update(rows.values_list('user_id', flat=True).distinct())
+            users.update(rows.values_list('owner_id', flat=True).distinct())
+        settlements = Settlement.objects.filter(created_at__gte=start, created_at__lt=end)
+        users.update(settlements.values_list('payer_id', flat=True).distinct())
+        users.update(settlements.values_list('payee_id', flat=True).distinct())
+        users -= set(Statement.objects.filter(period=start.date(), closed=True).values_list('user_id', flat=True))
+
+        now = timezone.now()
+        for user_id in sorted(users):
+            build_statement(user_id, start, now)
+        self.stdout.write(f'Built {len(users)} statement(s) for {start:%Y-%m}.')
@@ -0,0 +1,50 @@
+import csv
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bulkusers import BulkRegistration
+
+
+class Command(BaseCommand):
+    help = 'Register users from a CSV or JSON Lines file with email, name, mobile and password columns.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a header row, or a .jsonl file with one object per line.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes used for password hashing.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist')
+
+        started = time.monotonic()
+        with open(path, newline='', encoding='utf-8') as source:
+            rows = self.read_jsonl(source) if path.endswith(('.jsonl', '.ndjson')) else self.read_csv(source)
+            with BulkRegistration(workers=options['workers'], batch_size=options['batch_size']) as registration:
+                registration.register(rows)
+
+        for line, errors in registration.errors:
+            self.stderr.write(f'line {line}: invalid {json.dumps(errors)}')
+        for line, field, value in registration.conflicts:
+            self.stderr.write(f'line {line}: {field} {value} is already registered')
+        self.stdout.write(
+            f'Created {registration.created} user(s), {len(registration.errors)} invalid, '
+            f'{len(registration.conflicts)} conflicting in {time.monotonic() - started:.1f}s.'
+        )
+
+    def read_csv(self, source):
+        # Line numbers count the header as line 1.
+        for line, row in enumerate(csv.DictReader(source), start=2):
+            yield line, row
+
+    def read_jsonl(self, source):
+        for line, text in enumerate(source, start=1):
+            if text.strip():
+                try:
+                    yield line, json.loads(text)
+                except ValueError:
+                    raise CommandError(f'line {line}: not valid JSON')
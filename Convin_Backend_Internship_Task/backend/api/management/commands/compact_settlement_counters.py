@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.settlements import compact_counters
+
+
+class Command(BaseCommand):
+    help = 'Fold the settlement counter slots of every pair of users into a single row.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        removed = compact_counters(batch_size=options['batch_size'])
+        self.stdout.write(f'Removed {removed} settlement counter row(s).')
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS, NotSupportedError
+from django.utils import timezone
+
+from api.partitioning import LEDGER_TABLES, create_month_partitions, month_start, partition_scheme
+
+
+class Command(BaseCommand):
+    help = 'Create upcoming monthly partitions of the ledger tables. Run it from cron, e.g. daily.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=settings.LEDGER_PARTITION_MONTHS_AHEAD)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        now = timezone.now()
+        try:
+            for table in LEDGER_TABLES:
+                if partition_scheme(connection, table) != 'month':
+                    self.stdout.write(f'{table} is not partitioned by month; skipping.')
+                    continue
+                created = create_month_partitions(connection, table, now, month_start(now, options['months_ahead']))
+                self.stdout.write(f'{table}: created {len(created)} partition(s){": " if created else "."}{", ".join(created)}')
+        except NotSupportedError as exc:
+            raise CommandError(str(exc))
@@ -0,0 +1,86 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.loadtest import LoadTest, default_routes
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive a weighted mix of the API routes against a running server and report latency '
+        'percentiles, throughput and error rates.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the server under test.')
+        parser.add_argument('--concurrency', type=int, default=10, help='Concurrent connections (the in-flight cap with --rps).')
+        parser.add_argument('--rps', type=float, help='Open-loop request rate; without it, workers send back to back.')
+        parser.add_argument('--duration', type=float, default=10.0, help='Measured seconds.')
+        parser.add_argument('--warmup', type=float, default=2.0, help='Seconds of traffic before measuring.')
+        parser.add_argument('--users', type=int, default=5, help='Users registered and authenticated up front.')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout in seconds.')
+        parser.add_argument('--mix', help='JSON object of route name to weight, overriding the default weights (0 disables).')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+        parser.add_argument('--max-p99-ms', type=float, help='Fail if the overall p99 latency is above this.')
+        parser.add_argument('--max-error-rate', type=float, help='Fail if the overall error rate is above this (0-1).')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['users'] < 1:
+            raise CommandError('--concurrency and --users must be at least 1.')
+        routes = default_routes()
+        if options['mix']:
+            try:
+                weights = json.loads(options['mix'])
+            except ValueError as exc:
+                raise CommandError(f'--mix is not valid JSON: {exc}')
+            unknown = set(weights) - {route.name for route in routes}
+            if unknown:
+                raise CommandError(f'Unknown routes in --mix: {", ".join(sorted(unknown))}')
+            for route in routes:
+                route.weight = weights.get(route.name, route.weight)
+
+        test = LoadTest(
+            options['url'],
+            routes=routes,
+            users=options['users'],
+            concurrency=options['concurrency'],
+            rps=options['rps'],
+            duration=options['duration'],
+            warmup=options['warmup'],
+            timeout=options['timeout'],
+        )
+        try:
+            report = asyncio.run(test.run())
+        except (OSError, RuntimeError, ValueError) as exc:
+            raise CommandError(f'Load test could not run against {options["url"]}: {exc}')
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+        overall = report['overall']
+        if options['max_p99_ms'] is not None and overall['p99_ms'] > options['max_p99_ms']:
+            raise CommandError(f'p99 latency {overall["p99_ms"]}ms is above {options["max_p99_ms"]}ms.')
+        if options['max_error_rate'] is not None and overall['error_rate'] > options['max_error_rate']:
+            raise CommandError(f'Error rate {overall["error_rate"]} is above {options["max_error_rate"]}.')
+
+    def print_report(self, report):
+        self.stdout.write(f'{report["mode"]} for {report["duration_s"]}s')
+        header = f'{"route":<28}{"reqs":>8}{"rps":>9}{"err%":>7}{"p50":>9}{"p90":>9}{"p99":>9}{"p99.9":>9}{"max":>9}'
+        self.stdout.write(header)
+        rows = sorted(report['routes'].items()) + [('overall', report['overall'])]
+        for name, stats in rows:
+            if not stats['requests']:
+                continue
+            self.stdout.write(
+                f'{name:<28}{stats["requests"]:>8}{stats["throughput_rps"]:>9.1f}{stats["error_rate"] * 100:>7.2f}'
+                f'{stats["p50_ms"]:>9.2f}{stats["p90_ms"]:>9.2f}{stats["p99_ms"]:>9.2f}{stats["p999_ms"]:>9.2f}{stats["max_ms"]:>9.2f}'
+            )
+        errors = report['overall']['errors']
+        if errors:
+            self.stdout.write('errors: ' + ', '.join(f'{outcome}={count}' for outcome, count in sorted(errors.items())))
+        self.stdout.write('latency distribution (ms):')
+        for percent, value in report['distribution']:
+            self.stdout.write(f'  {percent:>7}%  {value:.3f}')
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS, NotSupportedError
+
+from api.partitioning import LEDGER_TABLES, PARTITION_KEYS, partition_scheme, partition_table
+
+
+class Command(BaseCommand):
+    help = 'Convert the ExpenseSplit and BalanceSheet tables to PostgreSQL partitioned tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--by', choices=sorted(PARTITION_KEYS), default=settings.LEDGER_PARTITIONING or 'month',
+                            help='Partition by month of created_at or by hash of user_id.')
+        parser.add_argument('--partitions', type=int, default=settings.LEDGER_HASH_PARTITIONS,
+                            help='Number of hash partitions when partitioning by user.')
+        parser.add_argument('--months-ahead', type=int, default=settings.LEDGER_PARTITION_MONTHS_AHEAD,
+                            help='Future monthly partitions to create when partitioning by month.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        try:
+            for table in LEDGER_TABLES:
+                scheme = partition_scheme(connection, table)
+                if scheme is not None:
+                    self.stdout.write(f'{table} is already partitioned by {scheme}.')
+                    continue
+                partition_table(
+                    connection, table, options['by'],
+                    hash_partitions=options['partitions'],
+                    months_ahead=options['months_ahead'],
+                )
+                self.stdout.write(f'Partitioned {table} by {options["by"]}.')
+        except NotSupportedError as exc:
+            raise CommandError(str(exc))
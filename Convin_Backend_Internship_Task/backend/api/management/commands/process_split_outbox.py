@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.outbox import process_pending_outbox
+
+
+class Command(BaseCommand):
+    help = 'Expand pending split outbox entries into ExpenseSplit and BalanceSheet rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows per batch (defaults to SPLIT_BATCH_SIZE).')
+        parser.add_argument('--limit', type=int, default=None, help='Maximum entries to handle per pass.')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new entries.')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep between idle polls.')
+
+    def handle(self, *args, **options):
+        while True:
+            handled = process_pending_outbox(batch_size=options['batch_size'], limit=options['limit'])
+            if handled:
+                self.stdout.write(f'Materialized {handled} expense(s).')
+            if not options['loop']:
+                break
+            if not handled:
+                time.sleep(options['interval'])
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from api.models import LedgerShardBucket
+from api.sharding import ledger_shards, move_bucket, pin_buckets, plan_rebalance
+
+
+class Command(BaseCommand):
+    help = (
+        'Move owner buckets between ledger shards: finish interrupted moves, then either move the '
+        'given --bucket(s) --to a shard or even out the buckets across LEDGER_SHARDS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bucket', type=int, action='append', help='Bucket to move (repeatable); requires --to.')
+        parser.add_argument('--to', help='Target shard alias for --bucket.')
+        parser.add_argument('--wait', type=float, default=None,
+                            help='Seconds to wait for cached shard maps to expire (defaults to LEDGER_SHARD_MAP_TTL).')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Print the moves without making them.')
+
+    def handle(self, *args, **options):
+        shards = ledger_shards()
+        if shards == [DEFAULT_DB_ALIAS]:
+            raise CommandError('Sharding is off: LEDGER_SHARDS lists no shards besides default.')
+        if bool(options['bucket']) != bool(options['to']):
+            raise CommandError('--bucket and --to go together.')
+        if options['to'] and options['to'] not in shards:
+            raise CommandError(f'{options["to"]} is not in LEDGER_SHARDS.')
+        wait = settings.LEDGER_SHARD_MAP_TTL if options['wait'] is None else options['wait']
+
+        pin_buckets()
+        buckets = LedgerShardBucket.objects.using(DEFAULT_DB_ALIAS)
+        # Interrupted moves come first: finish copying to moving_to, or drain the old shard.
+        moves = {bucket: target for bucket, target in buckets.exclude(moving_to='').values_list('bucket', 'moving_to')}
+        moves.update(
+            (bucket, alias) for bucket, alias in buckets.exclude(draining_from='').values_list('bucket', 'alias')
+            if bucket not in moves
+        )
+        if options['bucket']:
+            for bucket in options['bucket']:
+                if not 0 <= bucket < settings.LEDGER_SHARD_BUCKETS:
+                    raise CommandError(f'Bucket {bucket} is outside 0-{settings.LEDGER_SHARD_BUCKETS - 1}.')
+                moves.setdefault(bucket, options['to'])
+        else:
+            for bucket, target in plan_rebalance().items():
+                moves.setdefault(bucket, target)
+
+        if not moves:
+            self.stdout.write('Buckets are balanced; nothing to move.')
+            return
+        for bucket, target in sorted(moves.items()):
+            if options['dry_run']:
+                self.stdout.write(f'Would move bucket {bucket} to {target}.')
+            else:
+                move_bucket(bucket, target, wait, options['batch_size'], log=self.stdout.write)
+        if not options['dry_run']:
+            self.stdout.write(f'Moved {len(moves)} bucket(s).')
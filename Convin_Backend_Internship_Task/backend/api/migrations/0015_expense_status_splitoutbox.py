@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_rename_expense_id_balancesheet_expense'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('complete', 'Complete')], default='complete', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='SplitOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.JSONField()),
+                ('cursor', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('expense', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='api.expense')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['created_at'], name='splitoutbox_pending_idx')],
+            },
+        ),
+    ]
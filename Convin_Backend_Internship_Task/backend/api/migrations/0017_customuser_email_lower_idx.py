@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:35
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='customuser_email_lower_idx'),
+        ),
+    ]
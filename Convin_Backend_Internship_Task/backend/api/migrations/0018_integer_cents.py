@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:38
+
+from django.db import migrations, models
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Round
+
+
+def to_cents(field):
+    return Cast(Round(F(field) * 100), BigIntegerField())
+
+
+def backfill_cents(apps, schema_editor):
+    Expense = apps.get_model('api', 'Expense')
+    ExpenseSplit = apps.get_model('api', 'ExpenseSplit')
+    BalanceSheet = apps.get_model('api', 'BalanceSheet')
+    Expense.objects.update(amount_cents=to_cents('amount'))
+    ExpenseSplit.objects.update(split_amount_cents=to_cents('split_amount'))
+    BalanceSheet.objects.update(split_amount_cents=to_cents('split_amount'), amount_cents=to_cents('amount'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_customuser_email_lower_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='balancesheet',
+            name='amount_cents',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='balancesheet',
+            name='split_amount_cents',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='amount_cents',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='expensesplit',
+            name='split_amount_cents',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_cents, migrations.RunPython.noop),
+    ]
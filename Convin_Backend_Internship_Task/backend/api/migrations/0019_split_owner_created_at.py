@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_expense_columns(apps, schema_editor):
+    Expense = apps.get_model('api', 'Expense')
+    ExpenseSplit = apps.get_model('api', 'ExpenseSplit')
+    expense = Expense.objects.filter(pk=OuterRef('expense_id'))
+    ExpenseSplit.objects.update(
+        owner_id=Subquery(expense.values('owner_id')[:1]),
+        created_at=Subquery(expense.values('created_at')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_integer_cents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='expensesplit',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='expensesplit',
+            name='owner',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(copy_expense_columns, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='expensesplit',
+            index=models.Index(fields=['user', 'created_at', 'owner', 'split_amount_cents'], name='expensesplit_user_summary_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expensesplit',
+            index=models.Index(fields=['owner', 'created_at', 'user', 'split_amount_cents'], name='expensesplit_owner_summary_idx'),
+        ),
+    ]
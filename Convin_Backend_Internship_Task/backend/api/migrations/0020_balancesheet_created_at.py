@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:51
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_expense_created_at(apps, schema_editor):
+    Expense = apps.get_model('api', 'Expense')
+    BalanceSheet = apps.get_model('api', 'BalanceSheet')
+    expense = Expense.objects.filter(pk=OuterRef('expense_id'))
+    BalanceSheet.objects.update(created_at=Subquery(expense.values('created_at')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_split_owner_created_at'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='expensesplit',
+            options={'ordering': ['id']},
+        ),
+        migrations.AddField(
+            model_name='balancesheet',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(copy_expense_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='balancesheet',
+            index=models.Index(fields=['user', 'created_at'], name='balancesheet_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='balancesheet',
+            index=models.Index(fields=['created_at'], name='balancesheet_created_idx'),
+        ),
+    ]
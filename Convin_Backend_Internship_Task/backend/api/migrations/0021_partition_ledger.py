@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.db import migrations
+
+from api.partitioning import LEDGER_TABLES, partition_scheme, partition_table
+
+
+def partition_ledger_tables(apps, schema_editor):
+    # Opt-in and PostgreSQL only; see LEDGER_PARTITIONING in settings.
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql' or not settings.LEDGER_PARTITIONING:
+        return
+    for table in LEDGER_TABLES:
+        if partition_scheme(connection, table) is None:
+            partition_table(
+                connection, table, settings.LEDGER_PARTITIONING,
+                hash_partitions=settings.LEDGER_HASH_PARTITIONS,
+                months_ahead=settings.LEDGER_PARTITION_MONTHS_AHEAD,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_balancesheet_created_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_ledger_tables, migrations.RunPython.noop),
+    ]
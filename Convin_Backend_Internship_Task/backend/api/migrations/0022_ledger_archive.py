@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_partition_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(choices=[('expensesplit', 'ExpenseSplit'), ('balancesheet', 'BalanceSheet')], max_length=32)),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('period_start', models.DateTimeField()),
+                ('period_end', models.DateTimeField()),
+                ('row_count', models.PositiveIntegerField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['table', 'period_end', 'period_start'], name='ledgerarchive_period_idx')],
+            },
+        ),
+    ]
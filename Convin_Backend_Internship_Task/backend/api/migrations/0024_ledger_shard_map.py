@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_expense_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerShardBucket',
+            fields=[
+                ('bucket', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('alias', models.CharField(max_length=100)),
+                ('moving_to', models.CharField(blank=True, max_length=100)),
+                ('draining_from', models.CharField(blank=True, max_length=100)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
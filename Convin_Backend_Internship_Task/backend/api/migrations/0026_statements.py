@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_settlements'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Statement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('closed', models.BooleanField(default=False)),
+                ('stale', models.BooleanField(default=False)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('summary', models.JSONField()),
+                ('lines', models.JSONField()),
+                ('built_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='balancesheet',
+            index=models.Index(fields=['owner', 'created_at'], name='balancesheet_owner_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='statement',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statements', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='statement',
+            constraint=models.UniqueConstraint(fields=('user', 'period'), name='statement_user_period_uniq'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_statements'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='expensesplit',
+            constraint=models.UniqueConstraint(fields=('expense', 'user', 'created_at'), name='expensesplit_expense_user_uniq'),
+        ),
+    ]
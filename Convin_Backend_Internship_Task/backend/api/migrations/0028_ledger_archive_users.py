@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:38
+
+import gzip
+import json
+import os
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def list_archive_users(apps, schema_editor):
+    # Archives written before this migration: read each file once for its users.
+    LedgerArchive = apps.get_model('api', 'LedgerArchive')
+    LedgerArchiveUser = apps.get_model('api', 'LedgerArchiveUser')
+    for entry in LedgerArchive.objects.iterator():
+        users = set()
+        with gzip.open(os.path.join(settings.LEDGER_ARCHIVE_DIR, entry.path), 'rt', encoding='utf-8') as archive:
+            columns = json.loads(next(archive))['columns']
+            user, owner = columns.index('user_id'), columns.index('owner_id')
+            for line in archive:
+                row = json.loads(line)
+                users.update((row[user], row[owner]))
+        LedgerArchiveUser.objects.bulk_create(
+            [LedgerArchiveUser(archive_id=entry.id, user_id=user_id) for user_id in sorted(users - {None})],
+            batch_size=10000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_expensesplit_unique_participant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerArchiveUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archive', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='users', to='api.ledgerarchive')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'archive'), name='ledgerarchiveuser_user_archive_uniq')],
+            },
+        ),
+        migrations.RunPython(list_archive_users, migrations.RunPython.noop),
+    ]
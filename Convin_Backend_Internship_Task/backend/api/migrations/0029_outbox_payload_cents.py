@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:12
+
+from django.db import migrations
+
+from api.money import to_cents
+
+
+def payload_in_cents(apps, schema_editor):
+    # Entries queued before amounts were stored in cents hold decimal strings:
+    # rewrite them in the form the worker reads.
+    SplitOutbox = apps.get_model('api', 'SplitOutbox')
+    entries = SplitOutbox.objects.using(schema_editor.connection.alias).filter(processed_at__isnull=True)
+    for entry in entries.iterator():
+        payload = entry.payload
+        if payload['method'] == 'equal':
+            if 'base_cents' in payload:
+                continue
+            payload['base_cents'] = to_cents(payload.pop('split_amount'))
+            payload['bonus_user_id'] = None
+        elif all(isinstance(cents, int) for _, cents in payload['splits']):
+            continue
+        else:
+            payload['splits'] = [[user_id, cents if isinstance(cents, int) else to_cents(cents)] for user_id, cents in payload['splits']]
+        entry.save(update_fields=['payload'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_ledger_archive_users'),
+    ]
+
+    operations = [
+        migrations.RunPython(payload_in_cents, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.utils import timezone
+from django.db.models.functions import Lower
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 
 
 # Create your models here.
@@ -28,18 +30,39 @@ class CustomUser(AbstractBaseUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['name', 'mobile']
 
+    class Meta:
+        indexes = [
+            # Serves case-insensitive lookups written as Lower('email') IN (...).
+            models.Index(Lower('email'), name='customuser_email_lower_idx'),
+        ]
+
     def __str__(self):
         return self.email
+
+    # No per-model permissions: active staff may use the whole admin.
+    def has_perm(self, perm, obj=None):
+        return self.is_active and self.is_staff
+
+    def has_module_perms(self, app_label):
+        return self.is_active and self.is_staff
     
 class Expense(models.Model):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='owned_expenses')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # The amount in integer minor units, used for aggregation and exports.
+    amount_cents = models.BigIntegerField(default=0)
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     split_method = models.CharField(
         max_length=20,
         choices=[('equal', 'Equal'), ('exact', 'Exact'), ('percentage', 'Percentage')],
     )
+    status = models.CharField(
+        max_length=20,
+        choices=[('pending', 'Pending'), ('complete', 'Complete')],
+        default='complete',
+    )
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
     
     def __str__(self):
         return self.title
@@ -48,6 +71,26 @@ class ExpenseSplit(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='splits')
     split_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    split_amount_cents = models.BigIntegerField(default=0)
+    # Copied from the expense so balance summaries aggregate this table alone.
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # Explicit, because partitioned tables return rows in partition order.
+        ordering = ['id']
+        indexes = [
+            # Covering indexes for the per-user summaries: both sides of a split
+            # can be aggregated with index-only scans, optionally by date.
+            models.Index(fields=['user', 'created_at', 'owner', 'split_amount_cents'], name='expensesplit_user_summary_idx'),
+            models.Index(fields=['owner', 'created_at', 'user', 'split_amount_cents'], name='expensesplit_owner_summary_idx'),
+        ]
+        constraints = [
+            # One share per participant. created_at is the same on every split of
+            # an expense; it is included because a partitioned table's unique
+            # indexes must contain the partition key.
+            models.UniqueConstraint(fields=['expense', 'user', 'created_at'], name='expensesplit_expense_user_uniq'),
+        ]
 
     def __str__(self):
         return f"{self.user} - {self.split_amount}"
@@ -56,12 +99,178 @@ class BalanceSheet(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     expense = models.ForeignKey(Expense, on_delete=models.CASCADE)
     split_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    split_amount_cents = models.BigIntegerField(default=0)
     owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='owned_balance_sheets')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    amount_cents = models.BigIntegerField(default=0)
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
+    # Copied from the expense; the partition key when the table is partitioned by month.
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='balancesheet_user_created_idx'),
+            # Statements read the rows of a user's own expenses one month at a time.
+            models.Index(fields=['owner', 'created_at'], name='balancesheet_owner_created_idx'),
+            models.Index(fields=['created_at'], name='balancesheet_created_idx'),
+        ]
 
     def __str__(self):
         return f"BalanceSheet for {self.user} - {self.expense.id}"
-    
 
+
+class SplitOutbox(models.Model):
+    expense = models.OneToOneField(Expense, on_delete=models.CASCADE, related_name='outbox')
+    payload = models.JSONField()
+    # Position of the last materialized participant: a user id for equal splits,
+    # otherwise the number of entries from payload['splits'] already written.
+    cursor = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], condition=models.Q(processed_at__isnull=True), name='splitoutbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"SplitOutbox for {self.expense_id}"
+
+
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    # SHA-256 of the request payload, so a key reused with a different body is rejected.
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotencykey_user_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"IdempotencyKey {self.key} for {self.user_id}"
+
+
+class LedgerArchive(models.Model):
+    TABLE_CHOICES = [('expensesplit', 'ExpenseSplit'), ('balancesheet', 'BalanceSheet')]
+
+    table = models.CharField(max_length=32, choices=TABLE_CHOICES)
+    # Gzipped JSON Lines file, relative to LEDGER_ARCHIVE_DIR. Never rewritten once listed here.
+    path = models.CharField(max_length=255, unique=True)
+    # The file holds every archived row with period_start <= created_at < period_end.
+    period_start = models.DateTimeField()
+    period_end = models.DateTimeField()
+    row_count = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['table', 'period_end', 'period_start'], name='ledgerarchive_period_idx'),
+        ]
+
+    def __str__(self):
+        return self.path
+
+
+class LedgerArchiveUser(models.Model):
+    # Every user appearing in an archive file, as participant or owner, so that
+    # reads of one user's rows open only the files that hold some.
+    archive = models.ForeignKey(LedgerArchive, on_delete=models.CASCADE, related_name='users')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'archive'], name='ledgerarchiveuser_user_archive_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.archive_id}"
+
+
+class LedgerShardBucket(models.Model):
+    # Owners hash into LEDGER_SHARD_BUCKETS buckets; each bucket lives on one shard.
+    bucket = models.PositiveIntegerField(primary_key=True)
+    alias = models.CharField(max_length=100)
+    # Set while the bucket is copied to another shard; writes to it are refused meanwhile.
+    moving_to = models.CharField(max_length=100, blank=True)
+    # Set once the bucket has moved, until its rows are deleted from the old shard.
+    draining_from = models.CharField(max_length=100, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Bucket {self.bucket} on {self.alias}"
+
+
+class Settlement(models.Model):
+    # A payment from payer to payee, reducing what the payer owes (or adding to what they are owed).
+    payer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='settlements_paid')
+    payee = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='settlements_received')
+    amount_cents = models.BigIntegerField()
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['payer', 'created_at'], name='settlement_payer_created_idx'),
+            models.Index(fields=['payee', 'created_at'], name='settlement_payee_created_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(amount_cents__gt=0), name='settlement_amount_positive'),
+            models.CheckConstraint(condition=~models.Q(payer=models.F('payee')), name='settlement_distinct_users'),
+        ]
+
+    def __str__(self):
+        return f"Settlement {self.payer_id} -> {self.payee_id}: {self.amount_cents}"
+
+
+class SettlementCounter(models.Model):
+    # Running total of the settlements between two users (user_low < user_high),
+    # positive when user_low paid more. Each pair has up to SETTLEMENT_COUNTER_SLOTS
+    # rows so concurrent settlements between the same two users rarely wait on one
+    # row; compact_settlement_counters folds them back into slot 0.
+    user_low = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    user_high = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    slot = models.PositiveSmallIntegerField()
+    net_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high', 'slot'], name='settlementcounter_pair_slot_uniq'),
+        ]
+        indexes = [
+            # The summary reads every pair of one user from either side.
+            models.Index(fields=['user_high', 'user_low', 'net_cents'], name='settlementcounter_high_idx'),
+        ]
+
+    def __str__(self):
+        return f"SettlementCounter {self.user_low_id}/{self.user_high_id}#{self.slot}"
+
+
+class Statement(models.Model):
+    # One user's month: the balance summary of the period plus a snapshot of its
+    # line items, served as is. Open statements are rebuilt when marked stale;
+    # once the period is closed the statement never changes.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='statements')
+    period = models.DateField()
+    closed = models.BooleanField(default=False)
+    stale = models.BooleanField(default=False)
+    # Bumped with every stale mark, so a rebuild racing a write cannot clear the mark.
+    version = models.PositiveIntegerField(default=0)
+    summary = models.JSONField()
+    lines = models.JSONField()
+    built_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'period'], name='statement_user_period_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Statement {self.period:%Y-%m} for {self.user_id}"
@@ -0,0 +1,65 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+
+CENT = Decimal('0.01')
+
+
+def to_cents(amount):
+
+    """
+    Convert a Decimal amount to integer minor units, rounding half up.
+    """
+
+    return int((Decimal(amount) / CENT).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+
+    """
+    Convert integer minor units back to a two-place Decimal.
+    """
+
+    return Decimal(cents).scaleb(-2)
+
+
+def format_cents(cents):
+
+    """
+    Format minor units exactly like str() of the matching two-place Decimal.
+    """
+
+    sign = '-' if cents < 0 else ''
+    whole, fraction = divmod(abs(cents), 100)
+    return f'{sign}{whole}.{fraction:02d}'
+
+
+def allocate_cents(total_cents, weights):
+
+    """
+    Split total_cents in proportion to weights so the parts always sum to the total.
+
+    Each part gets the floor of its exact share; the cents left over go one each
+    to the largest fractional remainders, ties broken by position. Weights may be
+    ints or Decimals (e.g. percentages) and are scaled to integers so the
+    arithmetic is exact.
+    """
+
+    weights = [Decimal(weight) for weight in weights]
+    places = max((-weight.as_tuple().exponent for weight in weights), default=0)
+    scale = 10 ** max(places, 0)
+    int_weights = [int(weight * scale) for weight in weights]
+    total_weight = sum(int_weights)
+    if total_weight <= 0:
+        raise ValueError('weights must sum to a positive value')
+
+    parts = []
+    remainders = []
+    for index, weight in enumerate(int_weights):
+        part, remainder = divmod(total_cents * weight, total_weight)
+        parts.append(part)
+        remainders.append((-remainder, index))
+
+    leftover = total_cents - sum(parts)
+    for _, index in sorted(remainders)[:leftover]:
+        parts[index] += 1
+    return parts
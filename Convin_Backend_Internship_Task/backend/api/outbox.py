@@ -0,0 +1,105 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from .models import CustomUser, Expense, SplitOutbox
+from .sharding import ShardMoving, ledger_shards, shard_for_owner
+from .splits import materialize_splits
+
+
+def _next_batch(entry, batch_size):
+
+    """
+    Return the next (splits, cursor, done) step for an outbox entry.
+    """
+
+    payload = entry.payload
+    if payload['method'] == 'equal':
+        # Equal splits cover every user that existed when the expense was created,
+        # walked in primary key order so the cursor is simply the last user id.
+        user_ids = list(
+            CustomUser.objects.filter(id__gt=entry.cursor, id__lte=payload['max_user_id'])
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        # Users up to bonus_user_id absorb the leftover cents, one each.
+        bonus_user_id = payload['bonus_user_id'] or 0
+        splits = [
+            (user_id, payload['base_cents'] + (1 if user_id <= bonus_user_id else 0))
+            for user_id in user_ids
+        ]
+        cursor = user_ids[-1] if user_ids else entry.cursor
+        done = len(user_ids) < batch_size or cursor >= payload['max_user_id']
+    else:
+        rows = payload['splits'][entry.cursor:entry.cursor + batch_size]
+        splits = [(user_id, split_cents) for user_id, split_cents in rows]
+        cursor = entry.cursor + len(rows)
+        done = cursor >= len(payload['splits'])
+    return splits, cursor, done
+
+
+def process_outbox_batch(outbox_id, batch_size=None, using=DEFAULT_DB_ALIAS):
+
+    """
+    Materialize one batch of an outbox entry. Returns True once the entry is finished.
+
+    The batch and the cursor move are committed together, so a worker that dies
+    mid-way leaves the entry exactly where the last committed batch ended.
+    `using` is the ledger shard holding the entry.
+    """
+
+    batch_size = batch_size or settings.SPLIT_BATCH_SIZE
+    with transaction.atomic(using=using):
+        entry = (
+            SplitOutbox.objects.using(using).select_for_update(skip_locked=True, of=('self',))
+            .select_related('expense')
+            .filter(pk=outbox_id, processed_at__isnull=True)
+            .first()
+        )
+        if entry is None:
+            # Already finished, or another worker holds the entry right now.
+            return True
+
+        # Raises ShardMoving while the owner's expenses are being copied to another shard.
+        shard_for_owner(entry.expense.owner_id, for_write=True)
+        splits, entry.cursor, done = _next_batch(entry, batch_size)
+        materialize_splits(entry.expense, splits)
+
+        update_fields = ['cursor']
+        if done:
+            entry.processed_at = timezone.now()
+            update_fields.append('processed_at')
+            Expense.objects.using(using).filter(pk=entry.expense_id).update(status='complete')
+        entry.save(update_fields=update_fields)
+    return done
+
+
+def process_pending_outbox(batch_size=None, limit=None):
+
+    """
+    Drain pending outbox entries, oldest first on each ledger shard. Returns the
+    number of entries handled.
+
+    Entries whose expenses are being moved between shards are left for a later pass.
+    """
+
+    handled = 0
+    for using in ledger_shards():
+        pending = (
+            SplitOutbox.objects.using(using).filter(processed_at__isnull=True)
+            .order_by('created_at')
+            .values_list('id', flat=True)
+        )
+        if limit:
+            pending = pending[:limit - handled]
+
+        for outbox_id in list(pending):
+            try:
+                while not process_outbox_batch(outbox_id, batch_size, using=using):
+                    pass
+            except ShardMoving:
+                continue
+            handled += 1
+        if limit and handled >= limit:
+            break
+    return handled
@@ -0,0 +1,152 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import NotSupportedError, transaction
+from django.utils import timezone
+
+
+# Tables that can be converted to partitioned tables, and their partition keys.
+LEDGER_TABLES = ('api_expensesplit', 'api_balancesheet')
+PARTITION_KEYS = {'month': 'created_at', 'user': 'user_id'}
+_STRATEGIES = {'r': 'month', 'h': 'user'}
+
+
+def _check_vendor(connection):
+    if connection.vendor != 'postgresql':
+        raise NotSupportedError('Ledger partitioning requires PostgreSQL.')
+
+
+def month_start(moment, months=0):
+
+    """
+    Return midnight UTC on the first day of the month `months` after `moment`.
+    """
+
+    moment = moment.astimezone(dt_timezone.utc)
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_scheme(connection, table):
+
+    """
+    Return 'month' or 'user' for a partitioned table, or None for a plain one.
+    """
+
+    _check_vendor(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT p.partstrat FROM pg_partitioned_table p WHERE p.partrelid = to_regclass(%s)',
+            [table],
+        )
+        row = cursor.fetchone()
+    return _STRATEGIES.get(row[0]) if row else None
+
+
+def create_month_partitions(connection, table, first, last):
+
+    """
+    Create the monthly partitions of `table` from month `first` through month `last`.
+
+    Existing partitions are left alone. Returns the names of the new partitions.
+    """
+
+    _check_vendor(connection)
+    quote = connection.ops.quote_name
+    created = []
+    months = 0
+    with connection.cursor() as cursor:
+        while month_start(first, months) <= month_start(last):
+            start, end = month_start(first, months), month_start(first, months + 1)
+            name = f'{table}_p{start:%Y_%m}'
+            cursor.execute('SELECT to_regclass(%s)', [name])
+            if cursor.fetchone()[0] is None:
+                cursor.execute(
+                    f'CREATE TABLE {quote(name)} PARTITION OF {quote(table)} FOR VALUES FROM (%s) TO (%s)',
+                    [start, end],
+                )
+                created.append(name)
+            months += 1
+    return created
+
+
+def partition_table(connection, table, scheme, hash_partitions=16, months_ahead=3):
+
+    """
+    Rebuild `table` as a table partitioned by month of created_at or by hash of user_id.
+
+    The rows are copied into a new partitioned table under the same name, which
+    gets the old table's indexes and foreign keys back. The primary key becomes
+    (id, partition key) as PostgreSQL requires; ids keep coming from the same
+    identity sequence position. Runs in one transaction and holds an exclusive
+    lock on the table throughout, so schedule it like any other table rewrite.
+    """
+
+    _check_vendor(connection)
+    if scheme not in PARTITION_KEYS:
+        raise ValueError(f'Unknown partition scheme {scheme!r}.')
+    if partition_scheme(connection, table) is not None:
+        raise ValueError(f'{table} is already partitioned.')
+
+    quote = connection.ops.quote_name
+    key = PARTITION_KEYS[scheme]
+    old = f'{table}_unpartitioned'
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        # Run deferred foreign key checks now; the old table can't be dropped while they're pending.
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'",
+            [table],
+        )
+        primary_key = cursor.fetchone()[0]
+        cursor.execute(
+            'SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s AND indexname <> %s',
+            [table, primary_key],
+        )
+        index_definitions = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+
+        # Free the names of the table, its primary key and its indexes for the new table.
+        cursor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(old)}')
+        cursor.execute(f'ALTER TABLE {quote(old)} RENAME CONSTRAINT {quote(primary_key)} TO {quote(old + "_pkey")}')
+
+        method = 'RANGE' if scheme == 'month' else 'HASH'
+        cursor.execute(
+            f'CREATE TABLE {quote(table)} (LIKE {quote(old)} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS) '
+            f'PARTITION BY {method} ({quote(key)})'
+        )
+        cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(primary_key)} PRIMARY KEY (id, {quote(key)})')
+
+        if scheme == 'month':
+            cursor.execute(f'SELECT MIN(created_at) FROM {quote(old)}')
+            oldest = cursor.fetchone()[0] or timezone.now()
+            create_month_partitions(connection, table, oldest, month_start(timezone.now(), months_ahead))
+            # Catches rows outside the monthly ranges instead of failing the insert.
+            cursor.execute(f'CREATE TABLE {quote(table + "_default")} PARTITION OF {quote(table)} DEFAULT')
+        else:
+            for remainder in range(hash_partitions):
+                cursor.execute(
+                    f'CREATE TABLE {quote(f"{table}_h{remainder}")} PARTITION OF {quote(table)} '
+                    f'FOR VALUES WITH (MODULUS {int(hash_partitions)}, REMAINDER {remainder})'
+                )
+
+        cursor.execute(f'INSERT INTO {quote(table)} SELECT * FROM {quote(old)}')
+        cursor.execute(f'SELECT MAX(id) FROM {quote(old)}')
+        last_id = cursor.fetchone()[0]
+        cursor.execute(f'DROP TABLE {quote(old)}')
+
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence = cursor.fetchone()[0]
+        cursor.execute(f'ALTER SEQUENCE {sequence} RENAME TO {quote(table + "_id_seq")}')
+        if last_id is not None:
+            cursor.execute('SELECT setval(%s, %s)', [f'{table}_id_seq', last_id])
+
+        for definition in index_definitions:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}')
+        # Back to Django's default for the rest of an enclosing transaction.
+        cursor.execute('SET CONSTRAINTS ALL DEFERRED')
@@ -0,0 +1,187 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+
+# Read-only fields whose DRF representation of a database value is the value itself.
+PASSTHROUGH_FIELDS = (
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.BooleanField,
+    serializers.ChoiceField,
+    serializers.ReadOnlyField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+
+class PlannedRows(list):
+
+    """
+    Rows built by a ReadPlan. FastJSONRenderer encodes these with orjson when safe.
+    """
+
+    orjson_safe = True
+
+
+def _decimal_converter(field):
+    # DRF quantizes and formats with '{:f}'; values read back from a column with the
+    # same scale are already quantized, so only odd ones need the full treatment.
+    exponent = -field.decimal_places
+
+    def convert(value):
+        if isinstance(value, Decimal) and value.as_tuple().exponent == exponent:
+            return '{:f}'.format(value)
+        return field.to_representation(value)
+
+    return convert
+
+
+class ReadPlan:
+
+    """
+    Precompiled description of a ModelSerializer's read output.
+
+    Building a plan walks the serializer's fields once and records, per output key,
+    the database column to read and how to convert it. rows() then produces the
+    serializer's exact output from values_list() tuples without instantiating models
+    or running DRF's per-field machinery. Nested `many=True` serializers over a
+    reverse foreign key are fetched with one extra query.
+    """
+
+    def __init__(self, serializer_class, fields=None):
+        serializer = serializer_class()
+        self.model = serializer.Meta.model
+        self.orjson_safe = True
+        self.columns = [self.model._meta.pk.attname]
+        self.field_names = [self.model._meta.pk.name]
+        self.fields = []
+        self.nested = []
+        self.prefetch = []
+
+        for name, field in serializer.fields.items():
+            if field.write_only or (fields is not None and name not in fields):
+                continue
+
+            if isinstance(field, serializers.ListSerializer):
+                relation = self.model._meta.get_field(field.source)
+                child_plan = ReadPlan(type(field.child))
+                self.orjson_safe = self.orjson_safe and child_plan.orjson_safe
+                self.fields.append((name, None, None))
+                self.nested.append((name, relation.field.attname, child_plan))
+                self.prefetch.append(field.source)
+                continue
+
+            try:
+                model_field = self.model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                # The model has no such attribute, so DRF leaves the key out as well.
+                continue
+
+            if isinstance(field, serializers.DecimalField) and getattr(
+                field, 'coerce_to_string', serializers.api_settings.COERCE_DECIMAL_TO_STRING
+            ) and not field.localize and not field.normalize_output:
+                converter = _decimal_converter(field)
+            elif isinstance(field, PASSTHROUGH_FIELDS) and not (
+                isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is not None
+            ):
+                converter = None
+            else:
+                converter = field.to_representation
+                self.orjson_safe = False
+
+            column = model_field.attname
+            if column not in self.columns:
+                self.columns.append(column)
+                self.field_names.append(model_field.name)
+            self.fields.append((name, self.columns.index(column), converter))
+
+    def _build(self, record, nested_rows):
+        row = {}
+        for name, index, converter in self.fields:
+            if index is None:
+                row[name] = nested_rows[name].get(record[0], [])
+                continue
+            value = record[index]
+            row[name] = value if converter is None or value is None else converter(value)
+        return row
+
+    def rows(self, queryset, key_column=None):
+
+        """
+        Return the serialized representation of every object in `queryset`.
+
+        With `key_column`, return (key, row) pairs instead, key being the value
+        of that column for the object.
+        """
+
+        nested_rows = {}
+        for name, fk_column, child_plan in self.nested:
+            children = child_plan.model._default_manager.using(queryset.db).filter(
+                **{f'{fk_column}__in': queryset.values('pk')}
+            ).order_by('pk')
+            grouped = defaultdict(list)
+            for parent_id, child in child_plan.rows_with_key(children, fk_column):
+                grouped[parent_id].append(child)
+            nested_rows[name] = grouped
+
+        if key_column is not None:
+            return [
+                (record[-1], self._build(record, nested_rows))
+                for record in queryset.values_list(*self.columns, key_column)
+            ]
+        result = PlannedRows(
+            self._build(record, nested_rows) for record in queryset.values_list(*self.columns)
+        )
+        result.orjson_safe = self.orjson_safe
+        return result
+
+    def narrow(self, queryset):
+
+        """
+        Restrict a model queryset to the columns and relations this plan reads.
+        """
+
+        return queryset.only(*self.field_names).prefetch_related(*self.prefetch)
+
+    def rows_with_key(self, queryset, key_column):
+
+        """
+        Yield (key, row) pairs, where key is the value of `key_column` for each row.
+        """
+
+        columns = self.columns + [key_column]
+        key_index = len(columns) - 1
+        for record in queryset.values_list(*columns):
+            yield record[key_index], self._build(record, {})
+
+
+_plans = {}
+
+
+def read_plan_for(serializer_class, fields=None):
+
+    """
+    Return the cached ReadPlan for a serializer class and optional field subset.
+    """
+
+    key = (serializer_class, fields)
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _plans[key] = ReadPlan(serializer_class, fields)
+    return plan
+
+
+def readable_fields(serializer_class):
+
+    """
+    Return the (scalar, nested) output field names of a serializer.
+    """
+
+    scalar, nested = [], []
+    for name, field in serializer_class().fields.items():
+        if field.write_only:
+            continue
+        (nested if isinstance(field, serializers.ListSerializer) else scalar).append(name)
+    return scalar, nested
@@ -0,0 +1,143 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .archive import archived_rows
+from .models import Expense, ExpenseSplit
+
+
+# Title matches outrank description matches.
+_PG_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+_FTS_TABLE = 'api_expense_fts'
+_SQLITE_TRIGGERS = {
+    'api_expense_fts_ai': (
+        'AFTER INSERT ON api_expense BEGIN '
+        'INSERT INTO api_expense_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END'
+    ),
+    'api_expense_fts_ad': (
+        'AFTER DELETE ON api_expense BEGIN '
+        "INSERT INTO api_expense_fts(api_expense_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); END"
+    ),
+    'api_expense_fts_au': (
+        'AFTER UPDATE ON api_expense BEGIN '
+        "INSERT INTO api_expense_fts(api_expense_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+        'INSERT INTO api_expense_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END'
+    ),
+}
+
+
+def install_search_index(connection):
+
+    """
+    Create the expense full-text index for this database, if it supports one.
+
+    PostgreSQL gets a stored, generated tsvector column with a GIN index; SQLite
+    an external-content FTS5 table kept in sync by triggers. Either way the
+    database updates the index on every insert, including bulk inserts. Safe to
+    run repeatedly.
+    """
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f'ALTER TABLE api_expense ADD COLUMN IF NOT EXISTS search_vector tsvector '
+                f'GENERATED ALWAYS AS ({_PG_VECTOR}) STORED'
+            )
+            cursor.execute('CREATE INDEX IF NOT EXISTS expense_search_vector_idx ON api_expense USING gin (search_vector)')
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [_FTS_TABLE])
+            created = cursor.fetchone() is None
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {_FTS_TABLE} USING fts5("
+                f"title, description, content='api_expense', content_rowid='id', tokenize='porter unicode61')"
+            )
+            if created:
+                cursor.execute(f"INSERT INTO {_FTS_TABLE}({_FTS_TABLE}) VALUES ('rebuild')")
+            # Rebuilding api_expense in a later SQLite migration drops its triggers.
+            for name, definition in _SQLITE_TRIGGERS.items():
+                cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {definition}')
+
+
+def restore_search_triggers(sender, using, **kwargs):
+    # post_migrate: put back triggers lost when a migration rebuilt api_expense on SQLite.
+    connection = connections[using]
+    if connection.vendor == 'sqlite' and _FTS_TABLE in connection.introspection.table_names():
+        install_search_index(connection)
+
+
+def uninstall_search_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('ALTER TABLE api_expense DROP COLUMN IF EXISTS search_vector')
+        elif connection.vendor == 'sqlite':
+            for name in _SQLITE_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(f'DROP TABLE IF EXISTS {_FTS_TABLE}')
+
+
+def search_expenses(query, owner_id=None, participant_id=None, using=None):
+
+    """
+    Return expenses matching `query`, best match first, annotated with `rank`.
+
+    Owner and participant filters are applied in the same query; participants
+    of archived expenses are read from the archive files listing them. Databases
+    without a full-text index fall back to matching every word with icontains.
+    `using` selects the ledger shard to search.
+    """
+
+    expenses = Expense.objects.using(using)
+    if owner_id is not None:
+        expenses = expenses.filter(owner_id=owner_id)
+    if participant_id is not None:
+        archived = {expense_id for expense_id, in archived_rows('expensesplit', ('expense_id',), user_id=participant_id)}
+        expenses = expenses.filter(
+            Q(id__in=ExpenseSplit.objects.filter(user_id=participant_id).values('expense_id')) | Q(id__in=sorted(archived))
+        )
+    return match_expenses(expenses, query)
+
+
+def match_expenses(expenses, query):
+
+    """
+    Narrow the `expenses` queryset to those matching `query`, best match first,
+    annotated with `rank`. The full-text conditions name api_expense, so the
+    result cannot be nested as a subquery.
+    """
+
+    connection = connections[expenses.db]
+    if connection.vendor == 'postgresql':
+        tsquery = "websearch_to_tsquery('english', %s)"
+        return expenses.filter(
+            RawSQL(f'api_expense.search_vector @@ {tsquery}', [query], output_field=BooleanField())
+        ).annotate(
+            rank=RawSQL(f'ts_rank_cd(api_expense.search_vector, {tsquery})', [query], output_field=FloatField())
+        ).order_by('-rank', '-created_at', '-id')
+
+    words = re.findall(r'\w+', query)
+    if not words:
+        return expenses.none()
+
+    if connection.vendor == 'sqlite':
+        # Quote every word so FTS5 never parses user input as query syntax.
+        match = ' '.join('"%s"' % word for word in words)
+        return expenses.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {_FTS_TABLE} WHERE {_FTS_TABLE} MATCH %s', [match])
+        ).annotate(
+            # bm25() is lower for better matches; negate it so higher is better, as on PostgreSQL.
+            rank=RawSQL(
+                f'SELECT -bm25({_FTS_TABLE}, 10.0, 5.0) FROM {_FTS_TABLE} '
+                f'WHERE {_FTS_TABLE} MATCH %s AND {_FTS_TABLE}.rowid = api_expense.id',
+                [match],
+                output_field=FloatField(),
+            )
+        ).order_by('-rank', '-created_at', '-id')
+
+    for word in words:
+        expenses = expenses.filter(Q(title__icontains=word) | Q(description__icontains=word))
+    return expenses.annotate(rank=Value(0.0, output_field=FloatField())).order_by('-created_at', '-id')
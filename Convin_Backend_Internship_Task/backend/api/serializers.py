@@ -1,8 +1,17 @@
 from rest_framework import serializers
-from .models import CustomUser, Expense, ExpenseSplit, BalanceSheet
+from .models import CustomUser, Expense, ExpenseSplit, BalanceSheet, SplitOutbox, Settlement
+from .splits import apply_split_changes, materialize_splits
+from .archive import is_archived
+from .statements import is_closed
+from .sharding import shard_for_owner
+from .money import format_cents, to_cents
+from .settlements import record_settlement
+from .splitcalc import SplitError, parse_splits, exact_splits, percentage_splits, equal_splits
+from django.conf import settings
+from django.db import transaction
 from django.contrib.auth import get_user_model
-from decimal import Decimal
 import re
+from decimal import Decimal
 
 class CustomUserSerializer(serializers.ModelSerializer):
     
@@ -48,6 +57,23 @@ class CustomUserSerializer(serializers.ModelSerializer):
     
     
     
+class BulkCustomUserSerializer(CustomUserSerializer):
+    
+    """
+    CustomUserSerializer without the per-row uniqueness queries.
+    
+    Bulk registration validates rows with the same field rules and checks email
+    and mobile uniqueness for a whole batch at once.
+    """
+    
+    class Meta(CustomUserSerializer.Meta):
+        extra_kwargs = {
+            'password': {'write_only': True},
+            'email': {'validators': []},
+            'mobile': {'validators': []},
+        }
+        
+        
 class CustomUserDetailSerializer(serializers.ModelSerializer):
     
     """
@@ -90,6 +116,31 @@ class ExpenseSplitSerializer(serializers.ModelSerializer):
         }
 
 
+# Keeps id__in lists under SQLite's bound-parameter limit.
+USER_CHECK_CHUNK = 10000
+
+
+class SplitListField(serializers.Field):
+    
+    """
+    Write-only list of {'user': id, value_key: number} splits.
+    
+    Parsed into parallel (user_ids, units, places) lists in one pass; users are checked
+    and amounts computed for the whole list at once in ExpenseCreateSerializer.
+    """
+    
+    def __init__(self, value_key, **kwargs):
+        self.value_key = value_key
+        kwargs['write_only'] = True
+        super().__init__(**kwargs)
+        
+    def to_internal_value(self, data):
+        try:
+            return parse_splits(data, self.value_key)
+        except SplitError as exc:
+            raise serializers.ValidationError(str(exc))
+
+
 class ExpenseCreateSerializer(serializers.ModelSerializer):
     
     """
@@ -97,135 +148,164 @@ class ExpenseCreateSerializer(serializers.ModelSerializer):
     """
     
     splits = ExpenseSplitSerializer(many=True, read_only=True)
-    exact_splits = ExpenseSplitSerializer(many=True, write_only=True, required=False)
-    percentage_splits = ExpenseSplitSerializer(many=True, write_only=True, required=False)  # For percentage splits
+    exact_splits = SplitListField('split_amount', required=False)
+    percentage_splits = SplitListField('percentage', required=False)  # For percentage splits
 
     class Meta:
         model = Expense
-        fields = ('amount', 'title', 'description', 'split_method', 'splits', 'exact_splits', 'percentage_splits')
+        fields = ('id', 'amount', 'title', 'description', 'split_method', 'status', 'splits', 'exact_splits', 'percentage_splits')
+        read_only_fields = ('id', 'status')
         
     def validate(self, data):
         
         """
         Validate expense creation data based on split_method.
+        
+        On an update the splits are recomputed only when the amount, the split
+        method or the splits themselves are given; the method defaults to the
+        expense's current one.
         """
         
         split_method = data.get('split_method')
-        exact_splits = data.get('exact_splits', [])
-        percentage_splits = data.get('percentage_splits', [])
+        amount = data.get('amount')
+        if self.instance is not None:
+            self.validate_editable(self.instance)
+            self.computed_splits = None
+            if split_method is None and not data.keys() & {'amount', 'exact_splits', 'percentage_splits'}:
+                return data
+            split_method = split_method or self.instance.split_method
+            amount = self.instance.amount if amount is None else amount
+        exact_user_ids, *exact_amounts = data.get('exact_splits', ([], [], []))
+        percentage_user_ids, *percentages = data.get('percentage_splits', ([], [], []))
 
-        if split_method == 'exact':
-            if not exact_splits:
-                raise serializers.ValidationError("Exact splits are required for 'exact' split method.")
-            
-            total_split_amount = sum(Decimal(split['split_amount']) for split in exact_splits)
-            if total_split_amount != Decimal(data['amount']):
-                raise serializers.ValidationError("The total of all exact split amounts must equal the expense amount.")
+        try:
+            if split_method == 'exact':
+                if not exact_user_ids:
+                    raise serializers.ValidationError("Exact splits are required for 'exact' split method.")
+                user_ids = exact_user_ids
+                self.computed_splits = exact_splits(to_cents(amount), user_ids, *exact_amounts)
 
-            user_ids = [split['user'].id for split in exact_splits]
-            if len(user_ids) != len(set(user_ids)):
-                raise serializers.ValidationError("Duplicate user IDs found in exact splits.")
-            
-            users_exist = CustomUser.objects.filter(id__in=user_ids).count()
-            if users_exist != len(user_ids):
-                raise serializers.ValidationError("One or more user IDs are invalid.")
+            elif split_method == 'percentage':
+                if not percentage_user_ids:
+                    raise serializers.ValidationError("Percentage splits are required for 'percentage' split method.")
+                user_ids = percentage_user_ids
+                self.computed_splits = percentage_splits(to_cents(amount), user_ids, *percentages)
 
-        elif split_method == 'percentage':
-            if not percentage_splits:
-                raise serializers.ValidationError("Percentage splits are required for 'percentage' split method.")
-            
-            total_percentage = sum(Decimal(split['percentage']) for split in percentage_splits)
-            if total_percentage != Decimal('100.0'):
-                raise serializers.ValidationError("The sum of all percentages must equal 100%.")
-            
-            user_ids = [split['user'].id for split in percentage_splits]
-            if len(user_ids) != len(set(user_ids)):
-                raise serializers.ValidationError("Duplicate user IDs found in percentage splits.")
-            
-            users_exist = CustomUser.objects.filter(id__in=user_ids).count()
-            if users_exist != len(user_ids):
-                raise serializers.ValidationError("One or more user IDs are invalid.")
-        
-        elif split_method == 'equal' and (exact_splits or percentage_splits):
-            raise serializers.ValidationError("Exact or percentage splits should not be provided for 'equal' split method.")
+            else:
+                if split_method == 'equal' and (exact_user_ids or percentage_user_ids):
+                    raise serializers.ValidationError("Exact or percentage splits should not be provided for 'equal' split method.")
+                if self.instance is not None:
+                    # Edits are applied synchronously, so equal splits are computed here,
+                    # over the expense's current participants.
+                    participants = ExpenseSplit.objects.using(self.instance._state.db).filter(expense=self.instance)
+                    threshold = settings.SPLIT_OUTBOX_THRESHOLD
+                    if participants[:threshold + 1].count() > threshold:
+                        raise serializers.ValidationError("Equal splits over this many users cannot be edited; use exact or percentage splits.")
+                    user_ids = list(participants.order_by('user_id').values_list('user_id', flat=True))
+                    self.computed_splits = equal_splits(to_cents(amount), user_ids)
+                return data
+        except SplitError as exc:
+            raise serializers.ValidationError(str(exc))
+
+        users_exist = sum(
+            CustomUser.objects.filter(id__in=user_ids[start:start + USER_CHECK_CHUNK]).count()
+            for start in range(0, len(user_ids), USER_CHECK_CHUNK)
+        )
+        if users_exist != len(user_ids):
+            raise serializers.ValidationError("One or more user IDs are invalid.")
         
         return data
 
+    def validate_editable(self, expense):
+        
+        """
+        Refuse changes to pending expenses and to expenses of closed periods,
+        whose statements are frozen, or archived ones.
+        """
+        
+        if expense.status != 'complete':
+            raise serializers.ValidationError("This expense's splits are still being written; retry shortly.")
+        if is_closed(expense.created_at):
+            raise serializers.ValidationError("Expenses of closed statement periods cannot be changed.")
+        if is_archived(expense.created_at):
+            raise serializers.ValidationError("Archived expenses cannot be changed.")
+
     def create(self, validated_data):
         
         """
         Create an Expense instance and related ExpenseSplit and BalanceSheet entries based on split_method.
+        
+        Expenses with more than SPLIT_OUTBOX_THRESHOLD participants are stored as pending
+        together with a SplitOutbox record, and their splits are written by the worker.
         """
         
         owner = self.context['request'].user
-        amount = Decimal(validated_data['amount'])
+        amount_cents = to_cents(validated_data['amount'])
         split_method = validated_data['split_method']
         
-        exact_splits_data = validated_data.pop('exact_splits', [])
-        percentage_splits_data = validated_data.pop('percentage_splits', [])
-        
-        # Create the expense with the owner set
-        expense = Expense.objects.create(owner=owner, **validated_data)
-        
-        if split_method == 'equal':
-            num_users = CustomUser.objects.count()
-            split_amount = amount / Decimal(num_users)
-            for user in CustomUser.objects.all():
-                # Create ExpenseSplit without specifying owner again
-                ExpenseSplit.objects.create(expense=expense, user=user, split_amount=split_amount)
-                BalanceSheet.objects.create(
-                    user=user,
-                    expense=expense,
-                    split_amount=split_amount,
-                    owner=owner,
-                    amount=amount,
-                    title=expense.title,
-                    description=expense.description
-                )
-                
-        
-        elif split_method == 'exact':
-            for split_data in exact_splits_data:
-                user = split_data['user']
-                split_amount = Decimal(split_data['split_amount'])
-                
-                if not CustomUser.objects.filter(id=user.id).exists():
-                    raise serializers.ValidationError(f"User with ID {user.id} does not exist.")
-                
-                # Create ExpenseSplit without specifying owner again
-                ExpenseSplit.objects.create(expense=expense, user=user, split_amount=split_amount)
-                BalanceSheet.objects.create(
-                    user=user,
-                    expense=expense,
-                    split_amount=split_amount,
-                    owner=owner,
-                    amount=amount,
-                    title=expense.title,
-                    description=expense.description
-                )
-        
-        elif split_method == 'percentage':
-            for split_data in percentage_splits_data:
-                user = split_data['user']
-                percentage = Decimal(split_data['percentage'])
-                split_amount = (percentage / Decimal('100.0')) * amount
-                
-                if not CustomUser.objects.filter(id=user.id).exists():
-                    raise serializers.ValidationError(f"User with ID {user.id} does not exist.")
-                
-                # Create ExpenseSplit without specifying owner again
-                ExpenseSplit.objects.create(expense=expense, user=user, split_amount=split_amount)
-                BalanceSheet.objects.create(
-                    user=user,
-                    expense=expense,
-                    split_amount=split_amount,
-                    owner=owner,
-                    amount=amount,
-                    title=expense.title,
-                    description=expense.description
-                )
+        validated_data.pop('exact_splits', None)
+        validated_data.pop('percentage_splits', None)
+        threshold = settings.SPLIT_OUTBOX_THRESHOLD
+        # The expense and all of its rows live on the owner's ledger shard.
+        shard = shard_for_owner(owner.id, for_write=True)
+        
+        with transaction.atomic(using=shard):
+            if split_method == 'equal':
+                max_user_id = CustomUser.objects.order_by('-id').values_list('id', flat=True).first()
+                num_users = CustomUser.objects.filter(id__lte=max_user_id).count()
+                deferred = num_users > threshold
+            else:
+                # Computed in validate(); percentages are allocated in whole cents so the splits sum to the expense.
+                splits = self.computed_splits
+                deferred = len(splits) > threshold
+            
+            # Create the expense with the owner set
+            expense = Expense.objects.using(shard).create(
+                owner=owner,
+                amount_cents=amount_cents,
+                status='pending' if deferred else 'complete',
+                **validated_data
+            )
+            
+            if deferred:
+                # Commit only a compact description of the splits; the worker expands it.
+                if split_method == 'equal':
+                    # The first `leftover` users in id order get one extra cent each.
+                    base_cents, leftover = divmod(amount_cents, num_users)
+                    bonus_user_id = CustomUser.objects.order_by('id').values_list('id', flat=True)[leftover - 1] if leftover else None
+                    payload = {'method': 'equal', 'base_cents': base_cents, 'bonus_user_id': bonus_user_id, 'max_user_id': max_user_id}
+                else:
+                    payload = {'method': split_method, 'splits': [[user_id, cents] for user_id, cents in splits]}
+                SplitOutbox.objects.using(shard).create(expense=expense, payload=payload)
+            elif split_method == 'equal':
+                user_ids = list(CustomUser.objects.filter(id__lte=max_user_id).order_by('id').values_list('id', flat=True))
+                materialize_splits(expense, equal_splits(amount_cents, user_ids))
+            else:
+                materialize_splits(expense, splits)
 
         return expense
+
+    def update(self, instance, validated_data):
+        
+        """
+        Update an expense and rewrite only the splits and balance rows that changed.
+        """
+        
+        validated_data.pop('exact_splits', None)
+        validated_data.pop('percentage_splits', None)
+        using = instance._state.db
+        expense_changed = any(
+            validated_data.get(field, getattr(instance, field)) != getattr(instance, field)
+            for field in ('amount', 'title', 'description')
+        )
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.amount_cents = to_cents(instance.amount)
+
+        with transaction.atomic(using=using):
+            instance.save(using=using)
+            apply_split_changes(instance, self.computed_splits, expense_changed=expense_changed)
+        return instance
     
 class BalanceSheetSerializer(serializers.ModelSerializer):
     
@@ -235,4 +315,35 @@ class BalanceSheetSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = BalanceSheet
-        fields = ('id', 'user', 'expense', 'split_amount', 'owner', 'amount', 'title', 'description')
\ No newline at end of file
+        fields = ('id', 'user', 'expense', 'split_amount', 'owner', 'amount', 'title', 'description')
+
+class SettlementSerializer(serializers.ModelSerializer):
+    
+    """
+    Serializer recording a payment from the current user to `payee`.
+    """
+    
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.01'), write_only=True)
+
+    class Meta:
+        model = Settlement
+        fields = ('id', 'payer', 'payee', 'amount', 'note', 'created_at')
+        read_only_fields = ('payer', 'created_at')
+
+    def validate_payee(self, payee):
+        if payee.id == self.context['request'].user.id:
+            raise serializers.ValidationError("You cannot settle with yourself.")
+        return payee
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['amount'] = format_cents(instance.amount_cents)
+        return data
+
+    def create(self, validated_data):
+        return record_settlement(
+            self.context['request'].user.id,
+            validated_data['payee'].id,
+            to_cents(validated_data['amount']),
+            note=validated_data.get('note', ''),
+        )
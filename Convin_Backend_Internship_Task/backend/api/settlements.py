@@ -0,0 +1,143 @@
+import random
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+
+from .events import publish_settlement
+from .models import Settlement, SettlementCounter
+
+
+def _pair(payer_id, payee_id):
+    # Counters are keyed by the ordered pair; the sign says who paid.
+    if payer_id < payee_id:
+        return payer_id, payee_id, 1
+    return payee_id, payer_id, -1
+
+
+def add_to_counter(payer_id, payee_id, cents):
+
+    """
+    Add `cents` paid by payer to payee onto one randomly chosen counter slot of the pair.
+
+    A single UPDATE ... SET net_cents = net_cents + x, so concurrent settlements
+    never lose an update. Only that one row is locked, which rules out lock-order
+    deadlocks. Each pair has its own rows, so settlements of different pairs never
+    wait on each other; the slots spread concurrent settlements between the same
+    two users, in either direction, over several rows. Must run inside a transaction.
+    """
+
+    user_low, user_high, sign = _pair(payer_id, payee_id)
+    _add_to_slot(user_low, user_high, random.randrange(settings.SETTLEMENT_COUNTER_SLOTS), sign * cents)
+
+
+def _add_to_slot(user_low, user_high, slot, cents):
+    counter = SettlementCounter.objects.filter(user_low_id=user_low, user_high_id=user_high, slot=slot)
+    # Compaction may delete the slot between the update and the insert, and again
+    # after another transaction recreated it, so retry until one of them lands.
+    while not counter.update(net_cents=F('net_cents') + cents):
+        try:
+            with transaction.atomic():
+                SettlementCounter.objects.create(user_low_id=user_low, user_high_id=user_high, slot=slot, net_cents=cents)
+            return
+        except IntegrityError:
+            # Another transaction created the slot first; update it instead.
+            pass
+
+
+def record_settlement(payer_id, payee_id, cents, note=''):
+
+    """
+    Store a settlement and add it to the pair's running total in one transaction.
+    Both users are notified on the balance event stream once it commits, and
+    their open statements are marked for a rebuild.
+    """
+
+    with transaction.atomic():
+        settlement = Settlement.objects.create(payer_id=payer_id, payee_id=payee_id, amount_cents=cents, note=note)
+        add_to_counter(payer_id, payee_id, cents)
+        transaction.on_commit(lambda: publish_settlement(settlement), robust=True)
+        # Imported here: statements build on the summaries, which read settlements.
+        from .statements import mark_stale_on_commit
+        mark_stale_on_commit([payer_id, payee_id], settlement.created_at)
+    return settlement
+
+
+def settled_with(user_id, start=None, end=None, counterparty_id=None):
+
+    """
+    Return {counterparty: [cents paid to user, cents paid by user]}, netted per
+    pair: at most one of the two is non-zero.
+
+    All-time totals come from the counters, a handful of rows per pair; a date
+    range is summed from the settlements themselves through their
+    (payer|payee, created_at) indexes.
+    """
+
+    totals = {}
+    if start is None and end is None:
+        counters = SettlementCounter.objects.filter(Q(user_low_id=user_id) | Q(user_high_id=user_id))
+        if counterparty_id is not None:
+            counters = counters.filter(Q(user_low_id=counterparty_id) | Q(user_high_id=counterparty_id))
+        pairs = counters.values('user_low_id', 'user_high_id').annotate(net=Sum('net_cents'))
+        for row in pairs:
+            # Positive net: user_low paid user_high.
+            if row['user_low_id'] == user_id:
+                counterparty, received = row['user_high_id'], -row['net']
+            else:
+                counterparty, received = row['user_low_id'], row['net']
+            totals[counterparty] = [max(received, 0), max(-received, 0)]
+        return totals
+
+    settlements = Settlement.objects.filter(Q(payer_id=user_id) | Q(payee_id=user_id))
+    if start is not None:
+        settlements = settlements.filter(created_at__gte=start)
+    if end is not None:
+        settlements = settlements.filter(created_at__lt=end)
+    if counterparty_id is not None:
+        settlements = settlements.filter(Q(payer_id=counterparty_id) | Q(payee_id=counterparty_id))
+    received = {}
+    for payer_id, payee_id, cents in (
+        settlements.values('payer_id', 'payee_id').annotate(cents=Sum('amount_cents')).values_list('payer_id', 'payee_id', 'cents')
+    ):
+        if payee_id == user_id:
+            received[payer_id] = received.get(payer_id, 0) + cents
+        else:
+            received[payee_id] = received.get(payee_id, 0) - cents
+    for counterparty, cents in received.items():
+        totals[counterparty] = [max(cents, 0), max(-cents, 0)]
+    return totals
+
+
+def compact_counters(batch_size=1000):
+
+    """
+    Fold every pair's counter slots into slot 0. Returns the number of rows removed.
+
+    Each pair is compacted in its own short transaction that locks the pair's
+    rows in slot order, the same order for every compaction, so two compactions
+    cannot deadlock. Settlements arriving meanwhile wait for the lock or recreate
+    a slot, and their amounts are kept either way.
+    """
+
+    removed = 0
+    pairs = (
+        SettlementCounter.objects.filter(slot__gt=0)
+        .values_list('user_low_id', 'user_high_id')
+        .distinct()
+        .order_by('user_low_id', 'user_high_id')
+    )
+    for user_low, user_high in pairs.iterator(chunk_size=batch_size):
+        with transaction.atomic():
+            rows = list(
+                SettlementCounter.objects.select_for_update()
+                .filter(user_low_id=user_low, user_high_id=user_high)
+                .order_by('slot')
+            )
+            extra = [row for row in rows if row.slot > 0]
+            if not extra:
+                continue
+            SettlementCounter.objects.filter(pk__in=[row.pk for row in extra]).delete()
+            _add_to_slot(user_low, user_high, 0, sum(row.net_cents for row in extra))
+            removed += len(extra)
+    return removed
@@ -0,0 +1,391 @@
+import hashlib
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from rest_framework.exceptions import APIException
+
+from .models import CustomUser, Expense, ExpenseSplit, BalanceSheet, SplitOutbox, LedgerShardBucket
+
+
+# Models stored on the ledger shards. Everything else, including the users'
+# source of truth, the shard map and the archive manifest, stays on 'default'.
+LEDGER_MODELS = (Expense, ExpenseSplit, BalanceSheet, SplitOutbox)
+# Each shard allocates ledger ids from its own range, position << ID_RANGE_BITS,
+# so ids stay unique across shards and rows keep them when they are moved.
+ID_RANGE_BITS = 40
+
+_lock = threading.Lock()
+_map = {'expires': float('-inf'), 'buckets': {}}
+
+
+class ShardMoving(APIException):
+    status_code = 503
+    default_detail = 'These expenses are being moved between databases, retry shortly.'
+    default_code = 'shard_moving'
+
+    def __init__(self, detail=None, code=None):
+        super().__init__(detail, code)
+        # DRF's exception handler turns `wait` into a Retry-After header.
+        self.wait = max(1, round(settings.LEDGER_SHARD_MAP_TTL))
+
+
+def ledger_shards():
+
+    """
+    Return the aliases holding the ledger, in LEDGER_SHARDS order.
+    """
+
+    return settings.LEDGER_SHARDS or [DEFAULT_DB_ALIAS]
+
+
+def sharding_enabled():
+    return ledger_shards() != [DEFAULT_DB_ALIAS]
+
+
+def bucket_for(owner_id):
+
+    """
+    Return the bucket of an owner: a stable hash, identical in every process.
+    """
+
+    digest = hashlib.blake2b(str(owner_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % settings.LEDGER_SHARD_BUCKETS
+
+
+def shard_map(refresh=False):
+
+    """
+    Return {bucket: (alias, moving_to)}, cached for LEDGER_SHARD_MAP_TTL seconds.
+    """
+
+    now = time.monotonic()
+    with _lock:
+        if refresh or now >= _map['expires']:
+            _map['buckets'] = {
+                bucket: (alias, moving_to)
+                for bucket, alias, moving_to in LedgerShardBucket.objects.using(DEFAULT_DB_ALIAS)
+                .values_list('bucket', 'alias', 'moving_to')
+            }
+            _map['expires'] = now + settings.LEDGER_SHARD_MAP_TTL
+        return _map['buckets']
+
+
+def shard_for_owner(owner_id, for_write=False):
+
+    """
+    Return the alias holding the expenses of `owner_id`.
+
+    With for_write, raises ShardMoving while the owner's bucket is being copied
+    to another shard.
+    """
+
+    if not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    bucket = bucket_for(owner_id)
+    try:
+        alias, moving_to = shard_map()[bucket]
+    except KeyError:
+        raise ImproperlyConfigured(f'Ledger shard bucket {bucket} is not placed; run migrate on the default database.')
+    if for_write and moving_to:
+        raise ShardMoving()
+    return alias
+
+
+def ledger_aliases(owner_id=None):
+
+    """
+    Return the aliases a ledger read has to visit: the owner's shard, or all of them.
+    """
+
+    return [shard_for_owner(owner_id)] if owner_id is not None else ledger_shards()
+
+
+def merge_ordered(querysets, fields, order_by):
+
+    """
+    Yield tuples of `fields` from per-shard querysets, merged on `order_by`.
+
+    Each queryset must already be ordered by the `order_by` columns. Rows are
+    streamed from every shard at once through server-side cursors.
+    """
+
+    if len(querysets) == 1:
+        yield from querysets[0].values_list(*fields).iterator(chunk_size=settings.EXPORT_CHUNK_ROWS)
+        return
+    width = len(fields)
+    streams = [
+        queryset.values_list(*fields, *order_by).iterator(chunk_size=settings.EXPORT_CHUNK_ROWS)
+        for queryset in querysets
+    ]
+    for row in heapq.merge(*streams, key=lambda row: row[width:]):
+        yield row[:width]
+
+
+def pin_buckets(using=DEFAULT_DB_ALIAS):
+
+    """
+    Record a shard for every bucket that has none yet, spreading them round robin.
+
+    Once pinned, buckets only change shards through rebalance_ledger_shards, so
+    adding an alias to LEDGER_SHARDS never silently moves anybody's expenses.
+    """
+
+    shards = ledger_shards()
+    placed = set(LedgerShardBucket.objects.using(using).values_list('bucket', flat=True))
+    LedgerShardBucket.objects.using(using).bulk_create(
+        [
+            LedgerShardBucket(bucket=bucket, alias=shards[bucket % len(shards)])
+            for bucket in range(settings.LEDGER_SHARD_BUCKETS)
+            if bucket not in placed
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def plan_rebalance():
+
+    """
+    Return {bucket: target alias} evening out bucket counts across LEDGER_SHARDS.
+
+    Buckets on aliases no longer listed always move; otherwise buckets only
+    leave shards holding more than their share.
+    """
+
+    shards = ledger_shards()
+    placement = {}
+    for bucket, alias in LedgerShardBucket.objects.using(DEFAULT_DB_ALIAS).values_list('bucket', 'alias').order_by('bucket'):
+        placement.setdefault(alias, []).append(bucket)
+    share, extra = divmod(settings.LEDGER_SHARD_BUCKETS, len(shards))
+    quota = {alias: share + (position < extra) for position, alias in enumerate(shards)}
+
+    surplus = [bucket for alias, buckets in placement.items() if alias not in quota for bucket in buckets]
+    for alias in shards:
+        buckets = placement.get(alias, [])
+        surplus.extend(buckets[quota[alias]:])
+    moves = {}
+    for alias in shards:
+        free = quota[alias] - len(placement.get(alias, []))
+        while free > 0 and surplus:
+            moves[surplus.pop()] = alias
+            free -= 1
+    return moves
+
+
+def _bucket_owners(bucket, using):
+    owners = Expense.objects.using(using).values_list('owner_id', flat=True).distinct()
+    return sorted(owner_id for owner_id in owners.iterator() if bucket_for(owner_id) == bucket)
+
+
+def _chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def copy_owners(owners, source, target, batch_size):
+
+    """
+    Copy the ledger rows of `owners` from `source` to `target`, keeping their ids.
+
+    Rows already on `target` are skipped, so an interrupted copy can be rerun.
+    Returns the number of expenses copied.
+    """
+
+    copied = 0
+    for owner_ids in _chunks(owners, batch_size):
+        expense_ids = list(
+            Expense.objects.using(source).filter(owner_id__in=owner_ids).order_by('pk').values_list('pk', flat=True)
+        )
+        for ids in _chunks(expense_ids, batch_size):
+            with transaction.atomic(using=target):
+                Expense.objects.using(target).bulk_create(
+                    Expense.objects.using(source).filter(pk__in=ids).order_by('pk'), ignore_conflicts=True
+                )
+                for model in (SplitOutbox, ExpenseSplit, BalanceSheet):
+                    model.objects.using(target).bulk_create(
+                        model.objects.using(source).filter(expense_id__in=ids).order_by('pk'),
+                        batch_size=batch_size, ignore_conflicts=True,
+                    )
+            copied += len(ids)
+    return copied
+
+
+def drain_owners(owners, using, batch_size):
+
+    """
+    Delete the ledger rows of `owners` from `using`, children first.
+    """
+
+    for owner_ids in _chunks(owners, batch_size):
+        with transaction.atomic(using=using):
+            expenses = Expense.objects.using(using).filter(owner_id__in=owner_ids)
+            for model in (BalanceSheet, ExpenseSplit, SplitOutbox):
+                model.objects.using(using).filter(expense_id__in=expenses.values('pk')).delete()
+            expenses.delete()
+
+
+def _set_bucket(bucket, **fields):
+    LedgerShardBucket.objects.using(DEFAULT_DB_ALIAS).filter(bucket=bucket).update(**fields)
+    shard_map(refresh=True)
+
+
+def move_bucket(bucket, target, wait, batch_size, log=lambda message: None):
+
+    """
+    Move one bucket to `target`, resuming a move that was interrupted.
+
+    1. Mark the bucket moving, so writes to its owners are refused, and wait for
+       every process's cached map to expire.
+    2. Copy the owners' rows to `target`.
+    3. Point the bucket at `target`, remembering the old shard as draining, and
+       wait again so no process still reads or writes the old shard.
+    4. Delete the rows from the old shard.
+    """
+
+    def drain(source):
+        drain_owners(_bucket_owners(bucket, source), source, batch_size)
+        _set_bucket(bucket, draining_from='')
+        log(f'Bucket {bucket}: drained from {source}.')
+
+    entry = LedgerShardBucket.objects.using(DEFAULT_DB_ALIAS).get(bucket=bucket)
+    if entry.draining_from:
+        drain(entry.draining_from)
+    if entry.alias == target:
+        return
+    source = entry.alias
+    if entry.moving_to != target:
+        _set_bucket(bucket, moving_to=target)
+        time.sleep(wait)
+    owners = _bucket_owners(bucket, source)
+    copied = copy_owners(owners, source, target, batch_size)
+    log(f'Bucket {bucket}: copied {copied} expense(s) of {len(owners)} owner(s) from {source} to {target}.')
+    _set_bucket(bucket, alias=target, moving_to='', draining_from=source)
+    time.sleep(wait)
+    drain(source)
+
+
+def reserve_id_range(connection):
+
+    """
+    Move the ledger id sequences of a shard to the start of its id range.
+    """
+
+    position = ledger_shards().index(connection.alias)
+    start = position << ID_RANGE_BITS
+    if not start:
+        return
+    with connection.cursor() as cursor:
+        for model in LEDGER_MODELS:
+            table = model._meta.db_table
+            if connection.vendor == 'postgresql':
+                cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+                sequence = cursor.fetchone()[0] or f'{table}_id_seq'
+                cursor.execute(f'SELECT last_value FROM {sequence}')
+                if cursor.fetchone()[0] < start:
+                    cursor.execute('SELECT setval(%s, %s, false)', [sequence, start])
+            elif connection.vendor == 'sqlite':
+                cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, start - 1])
+                elif row[0] < start:
+                    cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [start - 1, table])
+
+
+def prepare_shards(sender, using, **kwargs):
+    # post_migrate: place the buckets (on 'default') and set up each shard's id range.
+    if not sharding_enabled():
+        return
+    if using == DEFAULT_DB_ALIAS:
+        pin_buckets(using)
+    if using in ledger_shards():
+        reserve_id_range(connections[using])
+
+
+def _user_copy(user):
+    return CustomUser(**{field.attname: getattr(user, field.attname) for field in CustomUser._meta.concrete_fields})
+
+
+def replicate_users(users):
+
+    """
+    Copy users from 'default' to every other ledger shard, inserting or updating.
+
+    Ledger rows reference users through foreign keys, so every shard keeps a
+    replica of the user table. 'default' remains the one that is read and written.
+    """
+
+    if not sharding_enabled() or not users:
+        return
+    fields = [field.name for field in CustomUser._meta.concrete_fields if not field.primary_key]
+    for alias in ledger_shards():
+        if alias == DEFAULT_DB_ALIAS:
+            continue
+        CustomUser.objects.using(alias).bulk_create(
+            [_user_copy(user) for user in users],
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=fields,
+        )
+
+
+def _on_user_saved(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS:
+        replicate_users([instance])
+
+
+def _on_user_deleted(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS and sharding_enabled():
+        for alias in ledger_shards():
+            if alias != DEFAULT_DB_ALIAS:
+                CustomUser.objects.using(alias).filter(pk=instance.pk).delete()
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+    post_save.connect(_on_user_saved, sender=CustomUser, dispatch_uid='api.sharding.user_saved')
+    post_delete.connect(_on_user_deleted, sender=CustomUser, dispatch_uid='api.sharding.user_deleted')
+
+
+class LedgerShardRouter:
+
+    """
+    Route new ledger rows to their owner's shard and keep related rows together.
+
+    Saving a new Expense, ExpenseSplit or BalanceSheet goes to the shard of its
+    owner_id; rows already loaded stay on the database they came from, and so do
+    related lookups such as expense.splits. Reads without an instance cannot be
+    placed and go to 'default': code reading the ledger picks shards with
+    .using(shard_for_owner(...)) or fans out over ledger_shards().
+    """
+
+    def _is_ledger(self, model):
+        return issubclass(model, LEDGER_MODELS)
+
+    def _instance_db(self, instance, for_write):
+        if instance is None or not isinstance(instance, LEDGER_MODELS):
+            return None
+        # Read from __dict__: a deferred owner_id would be loaded through this router.
+        owner_id = instance.__dict__.get('owner_id')
+        if instance._state.adding and owner_id is not None:
+            return shard_for_owner(owner_id, for_write=for_write)
+        return instance._state.db
+
+    def db_for_read(self, model, **hints):
+        if not self._is_ledger(model):
+            return None
+        return self._instance_db(hints.get('instance'), for_write=False)
+
+    def db_for_write(self, model, **hints):
+        if not self._is_ledger(model):
+            return None
+        return self._instance_db(hints.get('instance'), for_write=True)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if isinstance(obj1, LEDGER_MODELS) and isinstance(obj2, LEDGER_MODELS):
+            return obj1._state.db == obj2._state.db
+        # Users are replicated to every shard.
+        return True
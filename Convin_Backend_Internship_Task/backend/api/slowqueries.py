@@ -0,0 +1,245 @@
+import contextvars
+import hashlib
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections, transaction
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+# Statement prefixes used to capture a plan, per vendor. ANALYZE executes the
+# statement again, so only reads are ever explained.
+EXPLAIN_PREFIXES = {
+    'postgresql': 'EXPLAIN (ANALYZE, BUFFERS) ',
+    'mysql': 'EXPLAIN ANALYZE ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+_READ = re.compile(r'^\s*\(?\s*(SELECT|WITH)\b', re.IGNORECASE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_ROWS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+_SPACE = re.compile(r'\s+')
+_SQL_LIMIT = 4000
+
+_lock = threading.Lock()
+_shapes = OrderedDict()
+_recent = deque()
+_current_view = contextvars.ContextVar('slow_query_view', default=None)
+_local = threading.local()
+
+
+def normalize(sql):
+
+    """
+    Reduce a statement to its shape: literals and parameters become ?, and IN
+    lists and multi-row VALUES collapse to (...), so queries that differ only in
+    their arguments are counted together.
+    """
+
+    shape = _STRING.sub('?', sql)
+    shape = _NUMBER.sub('?', shape.replace('%s', '?'))
+    shape = _ROWS.sub('(...)', _LIST.sub('(...)', shape))
+    return _SPACE.sub(' ', shape).strip()
+
+
+def _origin():
+    # Innermost frame of project code (not Django, DRF or this module) that led to the query.
+    base = str(settings.BASE_DIR) + os.sep
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base) and filename != __file__ and os.sep + 'site-packages' + os.sep not in filename:
+            return f'{os.path.relpath(filename, base)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+def _explain(connection, sql, params):
+    prefix = EXPLAIN_PREFIXES.get(connection.vendor)
+    if prefix is None or connection.needs_rollback:
+        return None
+    _local.busy = True
+    try:
+        # A savepoint keeps a failed EXPLAIN from aborting the caller's transaction.
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(prefix + sql, params)
+                rows = cursor.fetchall()
+    except DatabaseError as exc:
+        return f'EXPLAIN failed: {exc}'
+    finally:
+        _local.busy = False
+    if connection.vendor == 'sqlite':
+        return '\n'.join(str(row[-1]) for row in rows)
+    return '\n'.join(str(row[0]) for row in rows)
+
+
+def record(execute, sql, params, many, context):
+
+    """
+    Database execute wrapper timing every statement and recording slow ones.
+
+    Statements slower than SLOW_QUERY_THRESHOLD_MS are logged with the view and
+    the project stack frame they came from, and counted under their normalized
+    shape. SLOW_QUERY_EXPLAIN_SAMPLE_RATE of the slow reads are explained on the
+    same connection. Query parameters are never stored.
+    """
+
+    # Pass through the recorder's own EXPLAINs, and any second copy of it in the wrapper chain.
+    if getattr(_local, 'busy', False):
+        return execute(sql, params, many, context)
+    _local.busy = True
+    try:
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+    finally:
+        _local.busy = False
+    duration_ms = (time.perf_counter() - started) * 1000
+    if duration_ms < settings.SLOW_QUERY_THRESHOLD_MS:
+        return result
+
+    connection = context['connection']
+    view = _current_view.get()
+    origin = _origin()
+    explain = None
+    if not many and _READ.match(sql) and random.random() < settings.SLOW_QUERY_EXPLAIN_SAMPLE_RATE:
+        explain = _explain(connection, sql, params)
+    _store(sql, duration_ms, connection.alias, view, origin, explain)
+    logger.warning(
+        'Slow query (%.1fms) on %s from %s at %s: %s',
+        duration_ms, connection.alias, view or '-', origin or '-', sql[:_SQL_LIMIT],
+    )
+    return result
+
+
+def _store(sql, duration_ms, alias, view, origin, explain):
+    shape = normalize(sql)
+    fingerprint = hashlib.sha1(shape.encode()).hexdigest()[:12]
+    now = timezone.now()
+    with _lock:
+        entry = _shapes.get(fingerprint)
+        if entry is None:
+            entry = _shapes[fingerprint] = {
+                'fingerprint': fingerprint,
+                'shape': shape[:_SQL_LIMIT],
+                'count': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'explain': None,
+                'explained_at': None,
+            }
+            # Forget the least recently seen shapes past the limit.
+            while len(_shapes) > settings.SLOW_QUERY_MAX_SHAPES:
+                _shapes.popitem(last=False)
+        else:
+            _shapes.move_to_end(fingerprint)
+        entry['count'] += 1
+        entry['total_ms'] += duration_ms
+        entry['max_ms'] = max(entry['max_ms'], duration_ms)
+        entry.update(last_seen=now, last_view=view, last_origin=origin)
+        if explain is not None:
+            entry.update(explain=explain, explained_at=now)
+
+        _recent.append({
+            'at': now,
+            'fingerprint': fingerprint,
+            'duration_ms': round(duration_ms, 3),
+            'alias': alias,
+            'view': view,
+            'origin': origin,
+            'sql': sql[:_SQL_LIMIT],
+            'explain': explain,
+        })
+        while len(_recent) > settings.SLOW_QUERY_RECENT:
+            _recent.popleft()
+
+
+def snapshot():
+
+    """
+    Return the recorded shapes (most total time first) and the latest slow queries.
+    """
+
+    with _lock:
+        shapes = [dict(entry) for entry in _shapes.values()]
+        recent = list(reversed(_recent))
+    for entry in shapes:
+        entry['mean_ms'] = round(entry['total_ms'] / entry['count'], 3)
+        entry['total_ms'] = round(entry['total_ms'], 3)
+        entry['max_ms'] = round(entry['max_ms'], 3)
+    shapes.sort(key=lambda entry: entry['total_ms'], reverse=True)
+    return {
+        'enabled': settings.SLOW_QUERY_LOG,
+        'threshold_ms': settings.SLOW_QUERY_THRESHOLD_MS,
+        'explain_sample_rate': settings.SLOW_QUERY_EXPLAIN_SAMPLE_RATE,
+        'shapes': shapes,
+        'recent': recent,
+    }
+
+
+def reset():
+    with _lock:
+        _shapes.clear()
+        _recent.clear()
+
+
+def install(connection):
+    if record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    install(connection)
+
+
+def connect_signals():
+
+    """
+    Install the recorder on every database connection, current and future.
+    """
+
+    connection_created.connect(_on_connection_created, dispatch_uid='api.slowqueries.connection_created')
+    for connection in connections.all(initialized_only=True):
+        install(connection)
+
+
+class SlowQueryMiddleware:
+
+    """
+    Tag slow queries with the view that ran them. Unused unless SLOW_QUERY_LOG is set.
+
+    Streaming responses, such as the exports, run their queries while the body
+    is consumed, so their tag is kept until the response is closed.
+    """
+
+    def __init__(self, get_response):
+        if not settings.SLOW_QUERY_LOG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            if response is not None and response.streaming:
+                response._resource_closers.append(lambda: _current_view.set(None))
+            else:
+                _current_view.set(None)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'view_class', view_func)
+        _current_view.set(f'{view.__module__}.{view.__qualname__}')
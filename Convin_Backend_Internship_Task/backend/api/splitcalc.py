@@ -0,0 +1,197 @@
+from decimal import Decimal, InvalidOperation
+
+from .money import allocate_cents
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None
+
+
+# Products of cents and scaled weights above this could overflow int64.
+_INT64_SAFE = 2 ** 62
+
+# User ids are bigint primary keys.
+_MAX_USER_ID = 2 ** 63 - 1
+
+# Split amounts are stored with max_digits=10 and decimal_places=2.
+_VALUE_LIMIT = 10 ** 8
+
+# Values below _VALUE_LIMIT fit in int64 when expressed in units of 10 ** -scale up to this scale.
+_INT64_MAX_SCALE = 10
+
+
+class SplitError(ValueError):
+
+    """
+    Raised when split input is malformed or does not add up.
+    """
+
+
+def parse_splits(items, value_key):
+
+    """
+    Read [{'user': ..., value_key: ...}, ...] into parallel lists.
+
+    Returns (user_ids, units, places) where each value equals
+    units[i] * 10 ** -places[i]. User ids and values are range-checked here, so
+    later int64 arithmetic and the decimal columns never overflow. This replaces a nested serializer per split: at
+    tens of thousands of participants, per-item field validation and user
+    lookups cost far more than the arithmetic.
+    """
+
+    if not isinstance(items, list):
+        raise SplitError('Expected a list of splits.')
+    try:
+        user_ids = [item['user'] for item in items]
+        values = [item[value_key] for item in items]
+    except (TypeError, KeyError):
+        raise SplitError(f'Each split needs a "user" and a "{value_key}".')
+
+    try:
+        user_ids = [_to_int(user_id) for user_id in user_ids]
+    except (TypeError, ValueError):
+        raise SplitError('User IDs must be integers.')
+    if not all(0 < user_id <= _MAX_USER_ID for user_id in user_ids):
+        raise SplitError('User IDs must be positive and fit in 64 bits.')
+    try:
+        fixed = [_to_fixed_point(value) for value in values]
+    except (TypeError, ValueError, InvalidOperation):
+        raise SplitError(f'A valid number is required for "{value_key}".')
+    if not all(abs(units) < _VALUE_LIMIT * 10 ** places for units, places in fixed):
+        raise SplitError(f'Ensure that "{value_key}" is less than {_VALUE_LIMIT} in absolute value.')
+    return user_ids, [units for units, _ in fixed], [places for _, places in fixed]
+
+
+def _to_int(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise TypeError(value)
+    return int(value)
+
+
+def _to_fixed_point(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str, Decimal)):
+        raise TypeError(value)
+    text = str(value).strip()
+    whole, _, fraction = text.partition('.')
+    digits = whole[1:] if whole[:1] in ('-', '+') else whole
+    if digits.isdigit() and (fraction.isdigit() or not fraction):
+        # Plain "123.45": skip Decimal, which is several times slower.
+        return int(whole + fraction), len(fraction)
+    value = Decimal(text)
+    if not value.is_finite():
+        raise ValueError(value)
+    exponent = value.as_tuple().exponent
+    if exponent >= 0:
+        return int(value), 0
+    return int(value.scaleb(-exponent)), -exponent
+
+
+def _rescale(units, places, target):
+    # Express every value in units of 10 ** -target; exact only when target >= places.
+    if all(place == target for place in places):
+        return units
+    return [unit * 10 ** (target - place) for unit, place in zip(units, places)]
+
+
+def has_duplicates(user_ids):
+    if np is not None:
+        return np.unique(np.asarray(user_ids, dtype=np.int64)).size != len(user_ids)
+    return len(set(user_ids)) != len(user_ids)
+
+
+def exact_splits(amount_cents, user_ids, units, places):
+
+    """
+    Validate exact split amounts and return (user_id, split_cents) pairs.
+
+    Rescaled, converted to cents and summed as int64 arrays when numpy is
+    available and the values fit, element by element otherwise.
+    """
+
+    scale = max(max(places), 2)
+    if np is not None and scale <= _INT64_MAX_SCALE:
+        scaled = np.asarray(units, dtype=np.int64) * np.power(10, scale - np.asarray(places, dtype=np.int64))
+        cents, rest = np.divmod(scaled, 10 ** (scale - 2))
+        if rest.any():
+            raise SplitError('Ensure that there are no more than 2 decimal places.')
+        if has_duplicates(user_ids):
+            raise SplitError('Duplicate user IDs found in exact splits.')
+        if int(cents.sum()) != amount_cents:
+            raise SplitError('The total of all exact split amounts must equal the expense amount.')
+        return list(zip(user_ids, cents.tolist()))
+
+    scaled = _rescale(units, places, scale)
+    if scale > 2:
+        cents, rest = _divmod(scaled, 10 ** (scale - 2))
+        if rest:
+            raise SplitError('Ensure that there are no more than 2 decimal places.')
+    else:
+        cents = scaled
+    if has_duplicates(user_ids):
+        raise SplitError('Duplicate user IDs found in exact splits.')
+    if sum(cents) != amount_cents:
+        raise SplitError('The total of all exact split amounts must equal the expense amount.')
+    return list(zip(user_ids, cents))
+
+
+def _divmod(values, divisor):
+    # Element-wise quotients, and whether any remainder was non-zero.
+    quotients = [value // divisor for value in values]
+    return quotients, any(value % divisor for value in values)
+
+
+def percentage_splits(amount_cents, user_ids, units, places):
+
+    """
+    Validate percentages and return (user_id, split_cents) pairs allocated exactly.
+    """
+
+    scale = max(places)
+    weights = _rescale(units, places, scale)
+    if sum(weights) != 100 * 10 ** scale:
+        raise SplitError('The sum of all percentages must equal 100%.')
+    if has_duplicates(user_ids):
+        raise SplitError('Duplicate user IDs found in percentage splits.')
+    return list(zip(user_ids, allocate(amount_cents, weights)))
+
+
+def equal_splits(amount_cents, user_ids):
+
+    """
+    Return (user_id, split_cents) pairs sharing amount_cents equally.
+
+    The first amount_cents % len(user_ids) users get one extra cent each.
+    """
+
+    base, leftover = divmod(amount_cents, len(user_ids))
+    if np is not None:
+        cents = np.full(len(user_ids), base, dtype=np.int64)
+        cents[:leftover] += 1
+        return list(zip(user_ids, cents.tolist()))
+    return [(user_id, base + 1 if index < leftover else base) for index, user_id in enumerate(user_ids)]
+
+
+def allocate(total_cents, weights):
+
+    """
+    Vectorized money.allocate_cents for integer weights.
+
+    Falls back to the pure-Python version without numpy, or when the
+    intermediate products would not fit in int64.
+    """
+
+    total_weight = sum(weights)
+    if total_weight <= 0:
+        raise ValueError('weights must sum to a positive value')
+    if np is None or abs(total_cents) * max(total_weight, max(map(abs, weights))) >= _INT64_SAFE:
+        return allocate_cents(total_cents, weights)
+
+    products = total_cents * np.asarray(weights, dtype=np.int64)
+    parts, remainders = np.divmod(products, total_weight)
+    leftover = int(total_cents - parts.sum())
+    if leftover:
+        # Largest remainder first, ties by position, like allocate_cents.
+        order = np.lexsort((np.arange(parts.size), -remainders))
+        parts[order[:leftover]] += 1
+    return parts.tolist()
@@ -0,0 +1,150 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .events import publish_balance_changes
+from .models import Expense, ExpenseSplit, BalanceSheet, SplitOutbox
+from .money import from_cents
+from .statements import mark_stale_on_commit
+
+
+def materialize_splits(expense, splits):
+
+    """
+    Bulk insert the ExpenseSplit and BalanceSheet rows of an expense.
+
+    `splits` is a sequence of (user_id, split_cents) pairs. Subscribers of the
+    balance event stream are notified once the surrounding transaction commits,
+    and the open statements of everyone involved are marked for a rebuild.
+    The rows are written to the expense's own database (its ledger shard).
+    """
+
+    _insert_rows(expense, splits)
+    transaction.on_commit(lambda: publish_balance_changes(expense, splits), using=expense._state.db, robust=True)
+    mark_stale_on_commit([expense.owner_id, *(user_id for user_id, _ in splits)], expense.created_at, expense._state.db)
+
+
+def _insert_rows(expense, splits):
+    batch_size = settings.SPLIT_BATCH_SIZE
+    using = expense._state.db
+    ExpenseSplit.objects.using(using).bulk_create(
+        [
+            ExpenseSplit(
+                expense=expense,
+                user_id=user_id,
+                split_amount=from_cents(split_cents),
+                split_amount_cents=split_cents,
+                owner_id=expense.owner_id,
+                created_at=expense.created_at
+            )
+            for user_id, split_cents in splits
+        ],
+        batch_size=batch_size,
+    )
+    BalanceSheet.objects.using(using).bulk_create(
+        [
+            BalanceSheet(
+                user_id=user_id,
+                expense=expense,
+                split_amount=from_cents(split_cents),
+                split_amount_cents=split_cents,
+                owner_id=expense.owner_id,
+                amount=expense.amount,
+                amount_cents=expense.amount_cents,
+                title=expense.title,
+                description=expense.description,
+                created_at=expense.created_at
+            )
+            for user_id, split_cents in splits
+        ],
+        batch_size=batch_size,
+    )
+
+
+def _chunks(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def apply_split_changes(expense, splits, expense_changed=False):
+
+    """
+    Rewrite the rows of an edited expense, touching only the participants that changed.
+
+    `splits` is the new sequence of (user_id, split_cents) pairs, or None when
+    the splits stay as they are. The current amounts are read in one query;
+    then removed participants are deleted, new ones inserted, and changed ones
+    updated with one UPDATE per distinct new amount, so the writes are
+    proportional to the number of changed participants. With
+    `expense_changed`, the expense's title, description and amount copied into
+    every BalanceSheet row are refreshed in one UPDATE as well. Must run inside
+    a transaction on the expense's database; affected users are notified once
+    it commits, removed participants with a zero amount, and their open
+    statements are marked for a rebuild.
+    """
+
+    using = expense._state.db
+    batch_size = settings.SPLIT_BATCH_SIZE
+    if expense_changed:
+        BalanceSheet.objects.using(using).filter(expense=expense).update(
+            amount=from_cents(expense.amount_cents),
+            amount_cents=expense.amount_cents,
+            title=expense.title,
+            description=expense.description,
+        )
+        # Every participant's statement shows the title and amount.
+        participants = ExpenseSplit.objects.using(using).filter(expense=expense).values_list('user_id', flat=True)
+        mark_stale_on_commit([expense.owner_id, *participants], expense.created_at, using)
+    if splits is None:
+        return []
+
+    current = dict(ExpenseSplit.objects.using(using).filter(expense=expense).values_list('user_id', 'split_amount_cents'))
+    wanted = dict(splits)
+    removed = current.keys() - wanted.keys()
+    added = [(user_id, cents) for user_id, cents in splits if user_id not in current]
+    by_amount = defaultdict(list)
+    for user_id, cents in splits:
+        if user_id in current and current[user_id] != cents:
+            by_amount[cents].append(user_id)
+
+    for user_ids in _chunks(removed, batch_size):
+        ExpenseSplit.objects.using(using).filter(expense=expense, user_id__in=user_ids).delete()
+        BalanceSheet.objects.using(using).filter(expense=expense, user_id__in=user_ids).delete()
+    for cents, users in by_amount.items():
+        for user_ids in _chunks(users, batch_size):
+            amounts = {'split_amount': from_cents(cents), 'split_amount_cents': cents}
+            ExpenseSplit.objects.using(using).filter(expense=expense, user_id__in=user_ids).update(**amounts)
+            BalanceSheet.objects.using(using).filter(expense=expense, user_id__in=user_ids).update(**amounts)
+    if added:
+        _insert_rows(expense, added)
+
+    changes = [(user_id, 0) for user_id in sorted(removed)] + added + [
+        (user_id, cents) for cents, users in by_amount.items() for user_id in users
+    ]
+    if changes:
+        transaction.on_commit(lambda: publish_balance_changes(expense, changes), using=using, robust=True)
+        mark_stale_on_commit([expense.owner_id, *(user_id for user_id, _ in changes)], expense.created_at, using)
+    return changes
+
+
+def delete_expense(expense):
+
+    """
+    Delete an expense with its splits, balance rows and outbox entry, in one transaction.
+
+    Participants are notified with a zero amount once it commits, and their open
+    statements are marked for a rebuild.
+    """
+
+    using = expense._state.db
+    with transaction.atomic(using=using):
+        participants = list(ExpenseSplit.objects.using(using).filter(expense=expense).values_list('user_id', flat=True))
+        BalanceSheet.objects.using(using).filter(expense=expense).delete()
+        ExpenseSplit.objects.using(using).filter(expense=expense).delete()
+        SplitOutbox.objects.using(using).filter(expense=expense).delete()
+        Expense.objects.using(using).filter(pk=expense.pk).delete()
+        changes = [(user_id, 0) for user_id in participants]
+        transaction.on_commit(lambda: publish_balance_changes(expense, changes), using=using, robust=True)
+        mark_stale_on_commit([expense.owner_id, *participants], expense.created_at, using)
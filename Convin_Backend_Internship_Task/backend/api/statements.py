@@ -0,0 +1,200 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .archive import archived_rows
+from .models import BalanceSheet, Settlement, Statement
+from .money import format_cents
+from .partitioning import month_start
+from .sharding import ledger_shards
+from .summaries import balance_summary
+
+
+# Columns of the BalanceSheet rows a statement is built from, hot or archived.
+LINE_COLUMNS = ('expense_id', 'owner_id', 'user_id', 'title', 'amount_cents', 'split_amount_cents', 'created_at')
+# Keeps user_id__in lists under SQLite's bound-parameter limit.
+STALE_CHUNK = 10000
+
+
+def period_bounds(period):
+
+    """
+    Return [start, end) of the calendar month (UTC) containing `period`.
+    """
+
+    start = month_start(period)
+    return start, month_start(start, 1)
+
+
+def is_closed(period, now=None):
+
+    """
+    A period closes STATEMENT_CLOSE_AFTER_DAYS after its last day, leaving time
+    for late split writes before the statement is frozen.
+    """
+
+    _, end = period_bounds(period)
+    return (now or timezone.now()) >= end + timedelta(days=settings.STATEMENT_CLOSE_AFTER_DAYS)
+
+
+def _ledger_lines(user_id, start, end):
+    rows = BalanceSheet.objects.filter(Q(user_id=user_id) | Q(owner_id=user_id), created_at__gte=start, created_at__lt=end)
+    for using in ledger_shards():
+        yield from rows.using(using).values_list(*LINE_COLUMNS).iterator(chunk_size=settings.EXPORT_CHUNK_ROWS)
+    yield from archived_rows('balancesheet', LINE_COLUMNS, start, end, involving=user_id)
+
+
+def build_lines(user_id, start, end):
+
+    """
+    Return the line items of a user's period, oldest first.
+
+    One line per expense the user owns or shares in, with their own share and,
+    for their own expenses, what the other participants owe them; and one line
+    per settlement they paid or received.
+    """
+
+    expenses = {}
+    for expense_id, owner_id, split_user_id, title, amount_cents, split_cents, created_at in _ledger_lines(user_id, start, end):
+        line = expenses.get(expense_id)
+        if line is None:
+            line = expenses[expense_id] = {
+                'created_at': created_at,
+                'expense': expense_id,
+                'owner': owner_id,
+                'title': title,
+                'amount': amount_cents,
+                'my_share': 0,
+                'owed_to_me': 0,
+            }
+        if split_user_id == user_id:
+            line['my_share'] += split_cents
+        else:
+            line['owed_to_me'] += split_cents
+
+    settlements = (
+        Settlement.objects.filter(Q(payer_id=user_id) | Q(payee_id=user_id), created_at__gte=start, created_at__lt=end)
+        .values_list('id', 'payer_id', 'payee_id', 'amount_cents', 'created_at')
+    )
+    lines = list(expenses.values()) + [
+        {'created_at': created_at, 'settlement': settlement_id, 'payer': payer_id, 'payee': payee_id, 'amount': cents}
+        for settlement_id, payer_id, payee_id, cents, created_at in settlements
+    ]
+    lines.sort(key=lambda line: (line['created_at'], line.get('expense', 0), line.get('settlement', 0)))
+    for line in lines:
+        line['created_at'] = line['created_at'].isoformat()
+        for name in ('amount', 'my_share', 'owed_to_me'):
+            if name in line:
+                line[name] = format_cents(line[name])
+    return lines
+
+
+def build_statement(user_id, period, now=None):
+
+    """
+    Compute a user's statement for the month of `period` and store it, closed
+    if the period is over. A closed statement that already exists is kept.
+
+    A month without any line items is returned unsaved, so reads of arbitrary
+    empty periods do not each leave a row behind.
+    """
+
+    now = now or timezone.now()
+    start, end = period_bounds(period)
+    statements = Statement.objects.filter(user_id=user_id, period=start.date())
+    version = statements.values_list('version', flat=True).first()
+    values = {
+        'summary': balance_summary(user_id, start=start, end=end),
+        'lines': build_lines(user_id, start, end),
+        'closed': is_closed(start, now),
+        'stale': False,
+        'built_at': now,
+    }
+    if version is None:
+        if not values['lines']:
+            return Statement(user_id=user_id, period=start.date(), **values)
+        try:
+            with transaction.atomic():
+                return Statement.objects.create(user_id=user_id, period=start.date(), **values)
+        except IntegrityError:
+            # Built by a concurrent request.
+            return statements.get()
+    if not statements.filter(closed=False, version=version).update(**values):
+        # A write marked it stale while it was being built: keep the mark (and
+        # stay open) so the next read rebuilds it. Closed statements are kept.
+        statements.filter(closed=False).update(**{**values, 'stale': True, 'closed': False})
+    return statements.get()
+
+
+def _cache_key(user_id, period):
+    return f'statement:{user_id}:{period:%Y-%m}'
+
+
+def statement_payload(statement):
+    return {
+        'user': statement.user_id,
+        'period': f'{statement.period:%Y-%m}',
+        'closed': statement.closed,
+        'built_at': statement.built_at.isoformat(),
+        **statement.summary,
+        'lines': statement.lines,
+    }
+
+
+def get_statement(user_id, period):
+
+    """
+    Return the statement payload of a user's month.
+
+    Closed statements come from the STATEMENT_CACHE cache, or one keyed lookup
+    that then fills it; empty months are neither stored nor cached. Open statements are one keyed lookup, rebuilt first if
+    writes marked them stale or they are older than STATEMENT_OPEN_TTL seconds.
+    """
+
+    start, _ = period_bounds(period)
+    cache = caches[settings.STATEMENT_CACHE]
+    key = _cache_key(user_id, start)
+    payload = cache.get(key)
+    if payload is not None:
+        return payload
+
+    now = timezone.now()
+    statement = Statement.objects.filter(user_id=user_id, period=start.date()).first()
+    fresh = statement is not None and (
+        statement.closed
+        or (not statement.stale and not is_closed(start, now)
+            and statement.built_at > now - timedelta(seconds=settings.STATEMENT_OPEN_TTL))
+    )
+    if not fresh:
+        statement = build_statement(user_id, start, now)
+    payload = statement_payload(statement)
+    if statement.closed and statement.pk is not None:
+        cache.set(key, payload, timeout=None)
+    return payload
+
+
+def mark_stale(user_ids, created_at):
+
+    """
+    Flag the open statements of `user_ids` covering `created_at` for a rebuild.
+
+    Only statements that were already built are touched; the others are built
+    on first read anyway. Closed statements are never changed.
+    """
+
+    period = month_start(created_at).date()
+    user_ids = sorted(set(user_ids))
+    for index in range(0, len(user_ids), STALE_CHUNK):
+        Statement.objects.filter(
+            user_id__in=user_ids[index:index + STALE_CHUNK], period=period, closed=False
+        ).update(stale=True, version=F('version') + 1)
+
+
+def mark_stale_on_commit(user_ids, created_at, using=DEFAULT_DB_ALIAS):
+    # Ledger rows may live on another database than the statements ('default').
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: mark_stale(user_ids, created_at), using=using, robust=True)
@@ -0,0 +1,96 @@
+from django.db.models import Case, F, Q, Sum, When
+
+from .archive import archived_rows
+from .models import ExpenseSplit
+from .money import format_cents
+from .settlements import settled_with
+from .sharding import ledger_shards
+
+
+def balance_summary(user_id, start=None, end=None, counterparty_id=None):
+
+    """
+    Aggregate a user's splits into totals and per-counterparty balances.
+
+    One GROUP BY over ExpenseSplit, keyed by the other party of each split. Both
+    sides are served by the covering (user|owner, created_at, ...) indexes. Splits
+    of the user's own expenses sum to the expense amounts, so "paid" comes out of
+    the same query as "owed". Archived splits are added in when the range reaches
+    back into an archived period. Settlements between the user and each
+    counterparty reduce the net balance.
+    """
+
+    splits = ExpenseSplit.objects.filter(Q(user_id=user_id) | Q(owner_id=user_id))
+    if start is not None:
+        splits = splits.filter(created_at__gte=start)
+    if end is not None:
+        splits = splits.filter(created_at__lt=end)
+    if counterparty_id is not None:
+        splits = splits.filter(
+            Q(user_id=counterparty_id, owner_id=user_id) | Q(user_id=user_id, owner_id=counterparty_id)
+        )
+
+    rows = (
+        splits.annotate(counterparty=Case(When(user_id=user_id, then=F('owner_id')), default=F('user_id')))
+        .values('counterparty')
+        .annotate(
+            paid_cents=Sum('split_amount_cents', filter=Q(owner_id=user_id), default=0),
+            share_cents=Sum('split_amount_cents', filter=Q(user_id=user_id), default=0),
+        )
+    )
+
+    # The user's splits are spread over every ledger shard; add up each shard's groups.
+    balances = {}
+    for using in ledger_shards():
+        for row in rows.using(using):
+            balance = balances.setdefault(row['counterparty'], [0, 0])
+            balance[0] += row['paid_cents']
+            balance[1] += row['share_cents']
+    archived = archived_rows('expensesplit', ('user_id', 'owner_id', 'split_amount_cents'), start, end, involving=user_id)
+    for split_user_id, owner_id, cents in archived:
+        counterparty = owner_id if split_user_id == user_id else split_user_id
+        if counterparty_id is not None and counterparty != counterparty_id:
+            continue
+        balance = balances.setdefault(counterparty, [0, 0])
+        if owner_id == user_id:
+            balance[0] += cents
+        if split_user_id == user_id:
+            balance[1] += cents
+
+    settled = settled_with(user_id, start=start, end=end, counterparty_id=counterparty_id)
+    for counterparty in settled:
+        balances.setdefault(counterparty, [0, 0])
+
+    totals = {'paid': 0, 'share': 0, 'owed_to_me': 0, 'i_owe': 0, 'settled_to_me': 0, 'settled_by_me': 0}
+    counterparties = []
+    for counterparty, (paid_cents, share_cents) in sorted(balances.items()):
+        totals['paid'] += paid_cents
+        totals['share'] += share_cents
+        if counterparty == user_id:
+            continue
+        received_cents, sent_cents = settled.get(counterparty, (0, 0))
+        totals['owed_to_me'] += paid_cents
+        totals['i_owe'] += share_cents
+        totals['settled_to_me'] += received_cents
+        totals['settled_by_me'] += sent_cents
+        counterparties.append({
+            'user': counterparty,
+            'owed_to_me': format_cents(paid_cents),
+            'i_owe': format_cents(share_cents),
+            'settled_to_me': format_cents(received_cents),
+            'settled_by_me': format_cents(sent_cents),
+            'net': format_cents(paid_cents - share_cents - received_cents + sent_cents),
+        })
+
+    return {
+        'total_paid': format_cents(totals['paid']),
+        'total_share': format_cents(totals['share']),
+        'total_owed_to_me': format_cents(totals['owed_to_me']),
+        'total_i_owe': format_cents(totals['i_owe']),
+        'total_settled_to_me': format_cents(totals['settled_to_me']),
+        'total_settled_by_me': format_cents(totals['settled_by_me']),
+        'net': format_cents(
+            totals['owed_to_me'] - totals['i_owe'] - totals['settled_to_me'] + totals['settled_by_me']
+        ),
+        'counterparties': counterparties,
+    }
@@ -1,9 +1,44 @@
 from django.test import TestCase
-from django.urls import reverse
+from django.urls import URLPattern, URLResolver, resolve, reverse
 from rest_framework import status
 from rest_framework.test import APIClient
-from .models import CustomUser, Expense, ExpenseSplit, BalanceSheet
+from django.test import override_settings, AsyncClient, LiveServerTestCase, TransactionTestCase
+from django.core.management import call_command
+from django.conf import settings
+from django.apps import apps as django_apps
+from django.core.management.base import CommandError
+from django.db import connection
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+import asyncio
+import gzip
+import importlib
+import io
+import json
+import re
+import os
+import tempfile
+from urllib.parse import urlsplit
+from rest_framework_simplejwt.tokens import RefreshToken
+from .events import get_broker
+from .views import BalanceEventStreamView
+from .models import CustomUser, Expense, ExpenseSplit, BalanceSheet, SplitOutbox, IdempotencyKey, LedgerArchive, LedgerArchiveUser, LedgerShardBucket, Settlement, SettlementCounter, Statement
+from .outbox import process_outbox_batch, process_pending_outbox
+from .partitioning import LEDGER_TABLES, month_start, partition_scheme
+from .money import allocate_cents, format_cents
+from . import splitcalc, slowqueries, throttling, sharding, settlements
+from django.core.cache import cache
+from .loadtest import EXCLUDED_URL_NAMES, Histogram, LoadTest, Session, default_routes
+from unittest import mock
+import random
+from decimal import Decimal
+from datetime import datetime, timezone as dt_timezone
+from django.utils import timezone
 from .serializers import CustomUserSerializer, ExpenseCreateSerializer
+from .admin import ProbedDatesQuerySet
+from backend import urls as backend_urls
 
 class CustomUserTests(TestCase):
 
@@ -139,3 +174,1620 @@ class ExpenseCreateTests(TestCase):
 
     
 
+class DBConnectionStatsTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.stats_url = reverse('db-stats')
+
+    def test_db_stats_requires_staff(self):
+        user = CustomUser.objects.create_user(email='test@example.com', name='Test User', mobile='+1234567890', password='testpassword')
+        self.client.force_authenticate(user=user)
+        response = self.client.get(self.stats_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_db_stats_reports_connection_settings(self):
+        staff = CustomUser.objects.create_user(email='staff@example.com', name='Staff User', mobile='+1234567890', password='testpassword', is_staff=True)
+        self.client.force_authenticate(user=staff)
+        response = self.client.get(self.stats_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('default', response.data['databases'])
+        self.assertIn('conn_max_age', response.data['databases']['default'])
+        self.assertIn('reuse_ratio', response.data['databases']['default'])
+
+
+
+@override_settings(SLOW_QUERY_LOG=True, SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_EXPLAIN_SAMPLE_RATE=1)
+class SlowQueryLogTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.slow_queries_url = reverse('slow-queries')
+        self.staff = CustomUser.objects.create_user(email='staff@example.com', name='Staff User', mobile='+1234567890', password='testpassword', is_staff=True)
+        slowqueries.reset()
+        self.addCleanup(slowqueries.reset)
+
+    def test_normalize_collapses_literals_and_lists(self):
+        self.assertEqual(
+            slowqueries.normalize("SELECT *  FROM t WHERE id IN (%s, %s, %s) AND name = 'o''k' LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?',
+        )
+        self.assertEqual(
+            slowqueries.normalize('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)'),
+            slowqueries.normalize('INSERT INTO t (a, b) VALUES (%s, %s)'),
+        )
+
+    def test_records_view_origin_and_explain_for_reads(self):
+        with connection.execute_wrapper(slowqueries.record), self.assertLogs('api.slowqueries', 'WARNING') as logs:
+            for _ in range(2):
+                response = self.client.get(reverse('get-all-expenses'))
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+            CustomUser.objects.filter(id=self.staff.id).update(name='Renamed')
+
+        self.client.force_authenticate(user=self.staff)
+        data = self.client.get(self.slow_queries_url).data
+        self.assertIn('GetAllExpensesView', logs.output[0])
+        listed = [entry for entry in data['shapes'] if entry['shape'].endswith('FROM "api_expense"')]
+        self.assertEqual(len(listed), 1)
+        self.assertEqual(listed[0]['count'], 2)
+        self.assertEqual(listed[0]['last_view'], 'api.views.GetAllExpensesView')
+        self.assertTrue(listed[0]['last_origin'].startswith('api' + os.sep))
+        self.assertTrue(listed[0]['explain'])
+
+        update = next(entry for entry in data['recent'] if entry['sql'].startswith('UPDATE'))
+        self.assertIsNone(update['explain'])
+        self.assertIn('test_records_view_origin_and_explain_for_reads', update['origin'])
+
+        response = self.client.delete(self.slow_queries_url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(slowqueries.snapshot()['shapes'], [])
+
+    def test_streamed_export_queries_keep_the_view(self):
+        self.client.force_authenticate(user=self.staff)
+        with connection.execute_wrapper(slowqueries.record), self.assertLogs('api.slowqueries', 'WARNING'):
+            response = self.client.get(reverse('overall-balance-sheet-csv'))
+            self.assertTrue(response.streaming)
+            # The test client closes the response once its content is consumed.
+            b''.join(response.streaming_content)
+            CustomUser.objects.filter(id=self.staff.id).update(name='Renamed')
+
+        recent = slowqueries.snapshot()['recent']
+        export = [entry for entry in recent if 'FROM "api_balancesheet"' in entry['sql']]
+        self.assertTrue(export)
+        self.assertEqual({entry['view'] for entry in export}, {'api.views.GenerateOverallBalanceSheetCSVView'})
+        update = next(entry for entry in recent if entry['sql'].startswith('UPDATE'))
+        self.assertIsNone(update['view'])
+
+    def test_slow_queries_require_staff(self):
+        user = CustomUser.objects.create_user(email='test@example.com', name='Test User', mobile='+1987654321', password='testpassword')
+        self.client.force_authenticate(user=user)
+        response = self.client.get(self.slow_queries_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+
+@override_settings(
+    THROTTLE_ENABLED=True,
+    THROTTLE_ANON_RATE=0.01, THROTTLE_ANON_BURST=20,
+    THROTTLE_USER_RATE=0.01, THROTTLE_USER_BURST=30,
+    THROTTLE_ROUTE_RATE=0.01, THROTTLE_ROUTE_BURST=1000,
+)
+class ThrottlingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.user1 = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+
+    def test_expensive_routes_spend_the_bucket_faster(self):
+        url = reverse('get-all-expenses')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+        # A cost-10 list would not fit, but the bucket never went below zero for cheaper calls.
+        cache.clear()
+        for _ in range(20):
+            response = self.client.post(reverse('get-user-by-email'), {'email': 'user1@example.com'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('get-user-by-email'), {'email': 'user1@example.com'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_users_have_separate_buckets(self):
+        url = reverse('overall-balance-sheet-csv')
+        self.client.force_authenticate(user=self.user1)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.client.force_authenticate(user=self.user2)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    @override_settings(THROTTLE_ROUTE_BURST=25)
+    def test_route_bucket_is_shared_by_all_clients(self):
+        url = reverse('overall-balance-sheet-csv')
+        self.client.force_authenticate(user=self.user1)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(user=self.user2)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # The rejected request took nothing from user2's own bucket.
+        self.assertEqual(self.client.get(reverse('balance-summary')).status_code, status.HTTP_200_OK)
+        self.assertAlmostEqual(cache.get(f'throttle:user:{self.user2.pk}')[0], 27, places=0)
+
+
+@override_settings(LOAD_SHEDDING=True, LOAD_SHED_MAX_HEAVY=1, LOAD_SHED_DB_LATENCY_MS=1000, THROTTLE_ENABLED=False)
+class LoadSheddingTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+
+    def test_heavy_requests_release_their_slot(self):
+        for _ in range(3):
+            for url, params in ((reverse('get-all-expenses'), {}), (reverse('balance-sheet-csv'), {'export_format': 'ndjson'})):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                # Streamed exports hold their slot until the server closes the response.
+                if response.streaming:
+                    self.assertEqual(throttling.heavy_in_flight(), 1)
+                    b''.join(response.streaming_content)
+                self.assertEqual(throttling.heavy_in_flight(), 0)
+
+    def test_sheds_heavy_requests_when_saturated(self):
+        with mock.patch.dict(throttling._heavy, in_flight=1):
+            response = self.client.get(reverse('overall-balance-sheet-csv'))
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], str(settings.LOAD_SHED_RETRY_AFTER))
+            # Cheap routes are never shed.
+            self.assertEqual(self.client.get(reverse('balance-summary')).status_code, status.HTTP_200_OK)
+
+        with mock.patch.object(throttling, 'db_latency_ms', return_value=5000):
+            response = self.client.get(reverse('get-all-expenses'))
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(throttling.heavy_in_flight(), 0)
+
+
+@override_settings(SPLIT_OUTBOX_THRESHOLD=1)
+class SplitOutboxTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.create_expense_url = reverse('expense-create')
+        self.user1 = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+        self.user3 = CustomUser.objects.create_user(email='user3@example.com', name='User Three', mobile='+1122334455', password='testpassword')
+        self.client.force_authenticate(user=self.user1)
+
+    def test_large_split_is_deferred_to_outbox(self):
+        expense_data = {
+            'amount': '100.00',
+            'title': 'Test Expense',
+            'description': 'Test Description',
+            'split_method': 'equal'
+        }
+        response = self.client.post(self.create_expense_url, expense_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(SplitOutbox.objects.count(), 1)
+        self.assertEqual(ExpenseSplit.objects.count(), 0)
+
+        self.assertEqual(process_pending_outbox(), 1)
+        self.assertEqual(Expense.objects.get().status, 'complete')
+        self.assertEqual(ExpenseSplit.objects.count(), 3)
+        self.assertEqual(BalanceSheet.objects.count(), 3)
+        self.assertEqual(sorted(ExpenseSplit.objects.values_list('split_amount_cents', flat=True)), [3333, 3333, 3334])
+
+    def test_outbox_worker_resumes_and_is_idempotent(self):
+        expense_data = {
+            'amount': '200.00',
+            'title': 'Test Expense',
+            'description': 'Test Description',
+            'split_method': 'exact',
+            'exact_splits': [{'user': self.user1.id, 'split_amount': '50.00'}, {'user': self.user2.id, 'split_amount': '150.00'}]
+        }
+        response = self.client.post(self.create_expense_url, expense_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        outbox = SplitOutbox.objects.get()
+
+        # A worker that stops after one batch leaves the cursor where it ended.
+        self.assertFalse(process_outbox_batch(outbox.id, batch_size=1))
+        outbox.refresh_from_db()
+        self.assertEqual(outbox.cursor, 1)
+        self.assertEqual(ExpenseSplit.objects.count(), 1)
+
+        self.assertTrue(process_outbox_batch(outbox.id, batch_size=1))
+        self.assertTrue(process_outbox_batch(outbox.id, batch_size=1))
+        self.assertEqual(process_pending_outbox(), 0)
+        self.assertEqual(ExpenseSplit.objects.count(), 2)
+        self.assertEqual(BalanceSheet.objects.count(), 2)
+        self.assertEqual(Expense.objects.get().status, 'complete')
+
+    def test_migration_rewrites_queued_decimal_payloads(self):
+        legacy = [
+            {'method': 'equal', 'split_amount': '33.33', 'max_user_id': self.user3.id},
+            {'method': 'exact', 'splits': [[self.user1.id, '12.50'], [self.user2.id, 750]]},
+        ]
+        for payload in legacy:
+            expense = Expense.objects.create(owner=self.user1, amount='99.99', amount_cents=9999, title='Queued', split_method=payload['method'], status='pending')
+            SplitOutbox.objects.create(expense=expense, payload=payload)
+
+        migration = importlib.import_module('api.migrations.0029_outbox_payload_cents')
+        migration.payload_in_cents(django_apps, mock.Mock(connection=connection))
+        self.assertEqual(
+            list(SplitOutbox.objects.order_by('id').values_list('payload', flat=True)),
+            [
+                {'method': 'equal', 'base_cents': 3333, 'bonus_user_id': None, 'max_user_id': self.user3.id},
+                {'method': 'exact', 'splits': [[self.user1.id, 1250], [self.user2.id, 750]]},
+            ],
+        )
+        self.assertEqual(process_pending_outbox(), 2)
+        self.assertEqual(sorted(ExpenseSplit.objects.values_list('split_amount_cents', flat=True)), [750, 1250, 3333, 3333, 3333])
+
+
+class IdempotencyKeyTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.create_expense_url = reverse('expense-create')
+        self.user = CustomUser.objects.create_user(email='test@example.com', name='Test User', mobile='+1234567890', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.expense_data = {
+            'amount': '100.00',
+            'title': 'Test Expense',
+            'description': 'Test Description',
+            'split_method': 'equal'
+        }
+
+    def test_retry_replays_original_response(self):
+        first = self.client.post(self.create_expense_url, self.expense_data, format='json', HTTP_IDEMPOTENCY_KEY='abc123')
+        retry = self.client.post(self.create_expense_url, self.expense_data, format='json', HTTP_IDEMPOTENCY_KEY='abc123')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Expense.objects.count(), 1)
+        self.assertEqual(BalanceSheet.objects.count(), 1)
+
+    def test_key_reused_with_different_payload_is_rejected(self):
+        self.client.post(self.create_expense_url, self.expense_data, format='json', HTTP_IDEMPOTENCY_KEY='abc123')
+        changed = dict(self.expense_data, amount='120.00')
+        response = self.client.post(self.create_expense_url, changed, format='json', HTTP_IDEMPOTENCY_KEY='abc123')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Expense.objects.count(), 1)
+
+    def test_failed_request_does_not_store_key(self):
+        invalid = dict(self.expense_data, split_method='exact')
+        response = self.client.post(self.create_expense_url, invalid, format='json', HTTP_IDEMPOTENCY_KEY='abc123')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(IdempotencyKey.objects.count(), 0)
+
+
+class BalanceEventStreamTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='test@example.com', name='Test User', mobile='+1234567890', password='testpassword')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    async def test_stream_requires_token(self):
+        response = await AsyncClient().get(reverse('balance-events'))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_stream_opens_with_token(self):
+        response = await AsyncClient().get(reverse('balance-events'), {'token': self.token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+    async def test_stream_delivers_balance_events(self):
+        stream = BalanceEventStreamView().stream(self.user.id)
+        self.assertEqual(await anext(stream), 'retry: 5000\n\n')
+        get_broker().publish(self.user.id, {'type': 'balance_changed', 'expense_id': 1})
+        self.assertEqual(await anext(stream), 'event: balance_changed\ndata: {"type": "balance_changed", "expense_id": 1}\n\n')
+        await stream.aclose()
+        self.assertEqual(get_broker().subscriber_count(), 0)
+
+    def test_expense_commit_publishes_to_participants(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        published = []
+        broker = get_broker()
+        original_publish = broker.publish
+        broker.publish = lambda user_id, event: published.append((user_id, event))
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                client.post(reverse('expense-create'), {
+                    'amount': '100.00',
+                    'title': 'Test Expense',
+                    'description': 'Test Description',
+                    'split_method': 'equal'
+                }, format='json')
+        finally:
+            broker.publish = original_publish
+        self.assertEqual([(user_id, event['role']) for user_id, event in published], [(self.user.id, 'participant'), (self.user.id, 'owner')])
+
+
+class FastReadPathTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = CustomUser.objects.create_user(email='user1@example.com', name='Ünïcode\u2028User', mobile='+1234567890', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+        self.client.force_authenticate(user=self.user1)
+        self.client.post(reverse('expense-create'), {
+            'amount': '200.00',
+            'title': 'Saputara trip',
+            'description': 'Trip with friends',
+            'split_method': 'percentage',
+            'percentage_splits': [{'user': self.user1.id, 'percentage': '33.3'}, {'user': self.user2.id, 'percentage': '66.7'}]
+        }, format='json')
+        self.client.post(reverse('expense-create'), {
+            'amount': '99.99',
+            'title': 'Dinner',
+            'description': '',
+            'split_method': 'equal'
+        }, format='json')
+
+    def assert_fast_path_matches(self, url):
+        fast = self.client.get(url)
+        with override_settings(FAST_READ_SERIALIZERS=False):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast.content, slow.content)
+        self.assertEqual(fast['Content-Type'], slow['Content-Type'])
+
+    def test_all_expenses_fast_path_matches_serializer(self):
+        self.assert_fast_path_matches(reverse('get-all-expenses'))
+
+    def test_user_list_fast_path_matches_serializer(self):
+        self.assert_fast_path_matches(reverse('user-list'))
+
+    def test_expenses_by_user_fast_path_matches_serializer(self):
+        self.assert_fast_path_matches(reverse('get-expenses-by-user', kwargs={'user_id': self.user1.id}))
+
+    def test_sparse_fields_narrow_output(self):
+        response = self.client.get(reverse('get-all-expenses'), {'fields': 'id,amount'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([sorted(row) for row in response.json()], [['amount', 'id'], ['amount', 'id']])
+
+        response = self.client.get(reverse('user-list'), {'fields': 'id,email'})
+        self.assertEqual(response.json()[0], {'id': self.user1.id, 'email': 'user1@example.com'})
+
+    def test_sparse_fields_expand_splits(self):
+        url = reverse('get-all-expenses')
+        params = {'fields': 'id', 'expand': 'splits'}
+        response = self.client.get(url, params)
+        self.assertEqual(sorted(response.json()[0]), ['id', 'splits'])
+        self.assertEqual(len(response.json()[0]['splits']), 2)
+        narrow = self.client.get(url, {'fields': 'id,title'})
+        with override_settings(FAST_READ_SERIALIZERS=False):
+            self.assertEqual(self.client.get(url, params).content, response.content)
+            self.assertEqual(self.client.get(url, {'fields': 'id,title'}).content, narrow.content)
+
+    def test_sparse_fields_skip_splits_query(self):
+        with self.assertNumQueries(1):
+            self.client.get(reverse('get-all-expenses'), {'fields': 'id,amount'})
+
+    def test_sparse_fields_rejects_unknown_field(self):
+        response = self.client.get(reverse('get-all-expenses'), {'fields': 'id,password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BulkUserLookupTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.lookup_url = reverse('bulk-user-lookup')
+        self.user1 = CustomUser.objects.create_user(email='User1@Example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+
+    def test_lookup_returns_found_and_missing(self):
+        with self.assertNumQueries(1):
+            response = self.client.post(self.lookup_url, {
+                'emails': ['user1@example.com', 'nobody@example.com'],
+                'mobiles': ['+9876543210', '+1111111111'],
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([user['id'] for user in response.data['found']], [self.user1.id, self.user2.id])
+        self.assertEqual(response.data['missing'], {'emails': ['nobody@example.com'], 'mobiles': ['+1111111111']})
+
+    @override_settings(USER_LOOKUP_MAX_ITEMS=2)
+    def test_lookup_rejects_oversized_batches(self):
+        response = self.client.post(self.lookup_url, {'emails': ['a@example.com', 'b@example.com', 'c@example.com']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_lookup_rejects_a_body_that_is_not_an_object(self):
+        response = self.client.post(self.lookup_url, ['a@example.com'], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BulkRegisterUsersTests(TestCase):
+
+    def test_bulk_register_reports_invalid_and_conflicting_rows(self):
+        CustomUser.objects.create_user(email='taken@example.com', name='Taken', mobile='+1234567890', password='testpassword')
+        rows = [
+            'email,name,mobile,password',
+            'new1@example.com,New One,+1111111111,testpassword',
+            'new2@example.com,New Two,+2222222222,testpassword',
+            'taken@example.com,Taken Again,+3333333333,testpassword',
+            'new1@example.com,Duplicate,+4444444444,testpassword',
+            'invalid_email,Invalid,+5555555555,testpassword',
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as source:
+            source.write('\n'.join(rows))
+        self.addCleanup(os.unlink, source.name)
+
+        out, err = io.StringIO(), io.StringIO()
+        call_command('bulk_register_users', source.name, workers=2, batch_size=2, stdout=out, stderr=err)
+
+        self.assertIn('Created 2 user(s), 1 invalid, 2 conflicting', out.getvalue())
+        self.assertEqual(CustomUser.objects.count(), 3)
+        self.assertTrue(CustomUser.objects.get(email='new2@example.com').check_password('testpassword'))
+        self.assertIn('line 4: email taken@example.com', err.getvalue())
+
+
+class IntegerCentsTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+        self.user3 = CustomUser.objects.create_user(email='user3@example.com', name='User Three', mobile='+1122334455', password='testpassword')
+        self.client.force_authenticate(user=self.user1)
+
+    def test_allocate_cents_distributes_remainder_deterministically(self):
+        self.assertEqual(allocate_cents(10000, [1, 1, 1]), [3334, 3333, 3333])
+        self.assertEqual(allocate_cents(1000, [Decimal('33.3'), Decimal('33.3'), Decimal('33.4')]), [333, 333, 334])
+        self.assertEqual(format_cents(-5), '-0.05')
+
+    def test_equal_split_sums_exactly(self):
+        response = self.client.post(reverse('expense-create'), {
+            'amount': '100.00',
+            'title': 'Test Expense',
+            'description': 'Test Description',
+            'split_method': 'equal'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        amounts = list(ExpenseSplit.objects.order_by('user_id').values_list('split_amount', 'split_amount_cents'))
+        self.assertEqual(amounts, [(Decimal('33.34'), 3334), (Decimal('33.33'), 3333), (Decimal('33.33'), 3333)])
+        self.assertEqual(Expense.objects.get().amount_cents, 10000)
+
+    def test_percentage_split_sums_exactly(self):
+        response = self.client.post(reverse('expense-create'), {
+            'amount': '10.00',
+            'title': 'Test Expense',
+            'description': 'Test Description',
+            'split_method': 'percentage',
+            'percentage_splits': [
+                {'user': self.user1.id, 'percentage': 33.3},
+                {'user': self.user2.id, 'percentage': 33.3},
+                {'user': self.user3.id, 'percentage': 33.4},
+            ]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sum(BalanceSheet.objects.values_list('split_amount_cents', flat=True)), 1000)
+
+    def test_balance_sheet_csv_formats_cents(self):
+        self.client.post(reverse('expense-create'), {
+            'amount': '20.00',
+            'title': 'Lunch',
+            'description': 'Lunch, with "friends"',
+            'split_method': 'exact',
+            'exact_splits': [{'user': self.user1.id, 'split_amount': '5.50'}, {'user': self.user2.id, 'split_amount': '14.50'}]
+        }, format='json')
+        response = self.client.get(reverse('balance-sheet-csv'))
+        sheet = BalanceSheet.objects.get(user=self.user1)
+        self.assertEqual(b''.join(response.streaming_content).decode(), (
+            'ID,Expense ID,Split Amount,Owner ID,Total Amount,Title,Description\r\n'
+            f'{sheet.id},{sheet.expense_id},5.50,{self.user1.id},20.00,Lunch,"Lunch, with ""friends"""\r\n'
+        ))
+
+        response = self.client.get(reverse('overall-balance-sheet-csv'))
+        # The rows, plus the archive manifest lookup.
+        with self.assertNumQueries(2):
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[2].endswith(f',{self.user2.id},14.50,{self.user1.id},20.00,Lunch,"Lunch, with ""friends"""'))
+
+
+class BalanceSummaryTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.summary_url = reverse('balance-summary')
+        self.user1 = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+        self.user3 = CustomUser.objects.create_user(email='user3@example.com', name='User Three', mobile='+1122334455', password='testpassword')
+
+    def create_expense(self, owner, amount, exact_splits):
+        self.client.force_authenticate(user=owner)
+        response = self.client.post(reverse('expense-create'), {
+            'amount': amount,
+            'title': 'Test Expense',
+            'description': 'Test Description',
+            'split_method': 'exact',
+            'exact_splits': [{'user': user.id, 'split_amount': split} for user, split in exact_splits]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Expense.objects.get(id=response.data['id'])
+
+    def test_summary_totals_and_counterparties(self):
+        self.create_expense(self.user1, '90.00', [(self.user1, '30.00'), (self.user2, '30.00'), (self.user3, '30.00')])
+        self.create_expense(self.user2, '40.00', [(self.user1, '25.00'), (self.user2, '15.00')])
+        self.client.force_authenticate(user=self.user1)
+
+        # The aggregate, the archive manifest lookup and the settlement counters.
+        with self.assertNumQueries(3):
+            response = self.client.get(self.summary_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_paid'], '90.00')
+        self.assertEqual(response.data['total_share'], '55.00')
+        self.assertEqual(response.data['total_owed_to_me'], '60.00')
+        self.assertEqual(response.data['total_i_owe'], '25.00')
+        self.assertEqual(response.data['net'], '35.00')
+        self.assertEqual(response.data['counterparties'], [
+            {'user': self.user2.id, 'owed_to_me': '30.00', 'i_owe': '25.00', 'settled_to_me': '0.00', 'settled_by_me': '0.00', 'net': '5.00'},
+            {'user': self.user3.id, 'owed_to_me': '30.00', 'i_owe': '0.00', 'settled_to_me': '0.00', 'settled_by_me': '0.00', 'net': '30.00'},
+        ])
+
+        response = self.client.get(self.summary_url, {'counterparty': self.user3.id})
+        self.assertEqual(response.data['total_owed_to_me'], '30.00')
+        self.assertEqual(response.data['total_i_owe'], '0.00')
+
+    def test_summary_date_range(self):
+        expense = self.create_expense(self.user1, '10.00', [(self.user2, '10.00')])
+        ExpenseSplit.objects.filter(expense=expense).update(created_at=datetime(2024, 1, 15, tzinfo=dt_timezone.utc))
+        self.client.force_authenticate(user=self.user1)
+
+        response = self.client.get(self.summary_url, {'start': '2024-01-01', 'end': '2024-01-31'})
+        self.assertEqual(response.data['total_owed_to_me'], '10.00')
+        response = self.client.get(self.summary_url, {'start': '2024-02-01'})
+        self.assertEqual(response.data['total_owed_to_me'], '0.00')
+        response = self.client.get(self.summary_url, {'start': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ExpenseEditTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = CustomUser.objects.create_user(email='owner@example.com', name='Owner', mobile='+1234567890', password='testpassword')
+        self.other = CustomUser.objects.create_user(email='other@example.com', name='Other', mobile='+9876543210', password='testpassword')
+        CustomUser.objects.bulk_create([
+            CustomUser(email=f'member{n}@example.com', name=f'Member {n}', mobile=f'+3{n:09d}', password='!')
+            for n in range(60)
+        ])
+        self.members = list(CustomUser.objects.filter(email__startswith='member').order_by('id').values_list('id', flat=True))
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.post(reverse('expense-create'), {
+            'amount': '600.00',
+            'title': 'Retreat',
+            'split_method': 'exact',
+            'exact_splits': self.exact(self.members, {})
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.expense_id = response.data['id']
+        self.url = reverse('expense-detail', args=[self.expense_id])
+
+    def exact(self, members, amounts):
+        return [{'user': user_id, 'split_amount': amounts.get(user_id, '10.00')} for user_id in members]
+
+    def shares(self, model=ExpenseSplit):
+        return dict(model.objects.filter(expense_id=self.expense_id).values_list('user_id', 'split_amount_cents'))
+
+    def test_edit_rewrites_only_changed_participants(self):
+        first, second = self.members[:2]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.url, {
+                'exact_splits': self.exact(self.members, {first: '5.00', second: '15.00'})
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        writes = [query['sql'] for query in queries if query['sql'].startswith(('UPDATE "api_expensesplit"', 'UPDATE "api_balancesheet"', 'INSERT', 'DELETE'))]
+        # One UPDATE per table and distinct new amount, whatever the number of participants.
+        self.assertEqual(len(writes), 4)
+        for model in (ExpenseSplit, BalanceSheet):
+            shares = self.shares(model)
+            self.assertEqual((shares[first], shares[second]), (500, 1500))
+            self.assertEqual(sum(shares.values()), 60000)
+
+    def test_edit_replaces_participants_and_amount(self):
+        leaving, joining = self.members[0], self.other.id
+        members = self.members[1:] + [joining]
+        response = self.client.put(self.url, {
+            'amount': '610.00',
+            'title': 'Retreat',
+            'description': 'With Other',
+            'split_method': 'exact',
+            'exact_splits': self.exact(members, {joining: '20.00'})
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        shares = self.shares(BalanceSheet)
+        self.assertNotIn(leaving, shares)
+        self.assertEqual(shares[joining], 2000)
+        self.assertEqual(len(shares), 60)
+        self.assertEqual(self.shares(), shares)
+        self.assertEqual(set(BalanceSheet.objects.filter(expense_id=self.expense_id).values_list('amount_cents', 'description')), {(61000, 'With Other')})
+        self.assertEqual(Expense.objects.get(id=self.expense_id).amount_cents, 61000)
+
+    def test_descriptive_edit_keeps_splits(self):
+        before = self.shares()
+        response = self.client.patch(self.url, {'title': 'Offsite'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.shares(), before)
+        self.assertEqual(set(BalanceSheet.objects.filter(expense_id=self.expense_id).values_list('title', flat=True)), {'Offsite'})
+
+        # Changing the amount alone leaves exact splits that no longer add up.
+        response = self.client.patch(self.url, {'amount': '700.00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_only_the_owner_can_edit_or_delete(self):
+        self.client.force_authenticate(user=self.other)
+        self.assertEqual(self.client.patch(self.url, {'title': 'Mine'}, format='json').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.delete(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_removes_expense_and_rows(self):
+        response = self.client.delete(self.url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Expense.objects.filter(id=self.expense_id).exists())
+        self.assertEqual(self.shares(), {})
+        self.assertEqual(self.shares(BalanceSheet), {})
+
+    def test_equal_edit_keeps_the_participants(self):
+        CustomUser.objects.create_user(email='late@example.com', name='Late', mobile='+5555555555', password='testpassword')
+        response = self.client.patch(self.url, {'split_method': 'equal', 'amount': '300.00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.shares(), {user_id: 500 for user_id in self.members})
+
+        with override_settings(SPLIT_OUTBOX_THRESHOLD=59):
+            response = self.client.patch(self.url, {'amount': '600.00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_expense_of_a_closed_period_cannot_be_changed(self):
+        created_at = month_start(timezone.now(), -2)
+        Expense.objects.filter(id=self.expense_id).update(created_at=created_at)
+        ExpenseSplit.objects.filter(expense_id=self.expense_id).update(created_at=created_at)
+        BalanceSheet.objects.filter(expense_id=self.expense_id).update(created_at=created_at)
+        response = self.client.patch(self.url, {'title': 'Offsite'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.delete(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(Expense.objects.filter(id=self.expense_id, title='Retreat').exists())
+
+    def test_pending_expense_cannot_be_edited(self):
+        Expense.objects.filter(id=self.expense_id).update(status='pending')
+        response = self.client.patch(self.url, {'title': 'Offsite'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Needs concurrent transactions')
+class ExpenseEditConcurrencyTests(TransactionTestCase):
+
+    def test_concurrent_edits_and_deletes_apply_one_at_a_time(self):
+        owner = CustomUser.objects.create_user(email='owner@example.com', name='Owner', mobile='+1234567890', password='testpassword')
+        other = CustomUser.objects.create_user(email='other@example.com', name='Other', mobile='+9876543210', password='testpassword')
+        client = APIClient()
+        client.force_authenticate(user=owner)
+        expense_ids = []
+        for n in range(20):
+            response = client.post(reverse('expense-create'), {
+                'amount': '20.00',
+                'title': f'Lunch {n}',
+                'split_method': 'exact',
+                'exact_splits': [{'user': owner.id, 'split_amount': '10.00'}, {'user': other.id, 'split_amount': '10.00'}]
+            }, format='json')
+            expense_ids.append(response.data['id'])
+
+        def change(job):
+            expense_id, action = job
+            try:
+                client = APIClient()
+                client.force_authenticate(user=owner)
+                url = reverse('expense-detail', args=[expense_id])
+                if action == 'delete':
+                    return client.delete(url).status_code
+                return client.patch(url, {'title': 'Dinner', 'amount': '30.00', 'exact_splits': [
+                    {'user': owner.id, 'split_amount': '10.00'}, {'user': other.id, 'split_amount': '20.00'}
+                ]}, format='json').status_code
+            finally:
+                connection.close()
+
+        jobs = [(expense_id, action) for expense_id in expense_ids for action in ('edit', 'delete', 'edit')]
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            codes = list(pool.map(change, jobs))
+        self.assertEqual(set(codes) - {status.HTTP_200_OK, status.HTTP_204_NO_CONTENT, status.HTTP_404_NOT_FOUND}, set())
+        self.assertEqual(codes.count(status.HTTP_204_NO_CONTENT), len(expense_ids))
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(ExpenseSplit.objects.exists())
+        self.assertFalse(BalanceSheet.objects.exists())
+
+class StatementTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user1 = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+        self.now = timezone.now()
+
+    def create_expense(self, title, amount, shares):
+        self.client.force_authenticate(user=self.user1)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('expense-create'), {
+                'amount': amount,
+                'title': title,
+                'split_method': 'exact',
+                'exact_splits': [{'user': user.id, 'split_amount': share} for user, share in shares]
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def statement(self, user, year, month):
+        self.client.force_authenticate(user=user)
+        return self.client.get(reverse('statement', args=[year, month]))
+
+    def test_open_statement_is_rebuilt_after_writes_only(self):
+        dinner = self.create_expense('Dinner', '60.00', [(self.user1, '20.00'), (self.user2, '40.00')])
+        response = self.statement(self.user2, self.now.year, self.now.month)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['closed'])
+        self.assertEqual(response.data['total_i_owe'], '40.00')
+        self.assertEqual(response.data['lines'], [{
+            'created_at': response.data['lines'][0]['created_at'], 'expense': dinner, 'owner': self.user1.id,
+            'title': 'Dinner', 'amount': '60.00', 'my_share': '40.00', 'owed_to_me': '0.00',
+        }])
+
+        # Unchanged since it was built: a single keyed lookup.
+        with self.assertNumQueries(1):
+            self.statement(self.user2, self.now.year, self.now.month)
+
+        self.create_expense('Taxi', '10.00', [(self.user2, '10.00')])
+        self.client.force_authenticate(user=self.user2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('settlements'), {'payee': self.user1.id, 'amount': '50.00'}, format='json')
+        response = self.statement(self.user2, self.now.year, self.now.month)
+        self.assertEqual(response.data['total_i_owe'], '50.00')
+        self.assertEqual(response.data['total_settled_by_me'], '50.00')
+        self.assertEqual(response.data['net'], '0.00')
+        self.assertEqual([line.get('title', 'settlement') for line in response.data['lines']], ['Dinner', 'Taxi', 'settlement'])
+        response = self.statement(self.user1, self.now.year, self.now.month)
+        self.assertEqual(response.data['lines'][0]['owed_to_me'], '40.00')
+
+    def test_closed_statement_is_frozen_and_cached(self):
+        expense_id = self.create_expense('Hotel', '30.00', [(self.user2, '30.00')])
+        january = datetime(2024, 1, 15, tzinfo=dt_timezone.utc)
+        for model in (Expense, ExpenseSplit, BalanceSheet):
+            model.objects.filter(**({'id': expense_id} if model is Expense else {'expense_id': expense_id})).update(created_at=january)
+
+        out = io.StringIO()
+        call_command('build_statements', period='2024-01', stdout=out)
+        self.assertIn('Built 2 statement(s) for 2024-01', out.getvalue())
+        response = self.statement(self.user2, 2024, 1)
+        self.assertTrue(response.data['closed'])
+        self.assertEqual(response.data['total_i_owe'], '30.00')
+
+        # Later changes to the period do not alter the closed statement, which
+        # is now served from the cache.
+        BalanceSheet.objects.filter(expense_id=expense_id).update(split_amount_cents=1)
+        with self.assertNumQueries(0):
+            response = self.statement(self.user2, 2024, 1)
+        self.assertEqual(response.data['lines'][0]['my_share'], '30.00')
+
+    def test_statement_periods_are_validated(self):
+        self.assertEqual(self.statement(self.user1, 2024, 13).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.statement(self.user1, self.now.year + 1, 1).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.statement(self.user1, 2023, 6)
+        self.assertEqual(response.data['lines'], [])
+        self.assertEqual(response.data['net'], '0.00')
+        # Empty months are answered without being stored or cached.
+        self.assertEqual(self.statement(self.user1, 1, 1).status_code, status.HTTP_200_OK)
+        self.assertFalse(Statement.objects.exists())
+        self.assertIsNone(cache.get(f'statement:{self.user1.id}:2023-06'))
+
+
+class SettlementTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.settlements_url = reverse('settlements')
+        self.user1 = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.post(reverse('expense-create'), {
+            'amount': '60.00',
+            'title': 'Dinner',
+            'split_method': 'exact',
+            'exact_splits': [{'user': self.user1.id, 'split_amount': '30.00'}, {'user': self.user2.id, 'split_amount': '30.00'}]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def settle(self, payer, payee, amount):
+        self.client.force_authenticate(user=payer)
+        return self.client.post(self.settlements_url, {'payee': payee.id, 'amount': amount, 'note': 'Cash'}, format='json')
+
+    def test_settlement_reduces_the_balance(self):
+        response = self.settle(self.user2, self.user1, '20.00')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['amount'], '20.00')
+        self.assertEqual(response.data['payer'], self.user2.id)
+        self.settle(self.user2, self.user1, '10.00')
+
+        self.client.force_authenticate(user=self.user1)
+        summary = self.client.get(reverse('balance-summary')).data
+        self.assertEqual(summary['total_settled_to_me'], '30.00')
+        self.assertEqual(summary['net'], '0.00')
+        self.assertEqual(summary['counterparties'][0]['net'], '0.00')
+        # Date ranges are summed from the settlements themselves.
+        today = timezone.now().date().isoformat()
+        summary = self.client.get(reverse('balance-summary'), {'start': today, 'end': today}).data
+        self.assertEqual(summary['total_settled_to_me'], '30.00')
+
+        self.client.force_authenticate(user=self.user2)
+        summary = self.client.get(reverse('balance-summary'), {'counterparty': self.user1.id}).data
+        self.assertEqual(summary['total_settled_by_me'], '30.00')
+        self.assertEqual(summary['net'], '0.00')
+        response = self.client.get(self.settlements_url)
+        self.assertEqual([settlement['amount'] for settlement in response.data], ['10.00', '20.00'])
+
+    def test_settlements_both_ways_are_netted_with_and_without_a_range(self):
+        self.settle(self.user2, self.user1, '20.00')
+        self.settle(self.user1, self.user2, '5.00')
+        self.settle(self.user2, self.user1, '1.50')
+
+        today = timezone.now().date().isoformat()
+        for user, counterparty, to_me, by_me in ((self.user1, self.user2, '16.50', '0.00'), (self.user2, self.user1, '0.00', '16.50')):
+            self.client.force_authenticate(user=user)
+            all_time = self.client.get(reverse('balance-summary')).data
+            ranged = self.client.get(reverse('balance-summary'), {'start': today, 'end': today}).data
+            for summary in (all_time, ranged):
+                self.assertEqual((summary['total_settled_to_me'], summary['total_settled_by_me']), (to_me, by_me))
+                self.assertEqual(summary['counterparties'][0]['user'], counterparty.id)
+            self.assertEqual(all_time['counterparties'], ranged['counterparties'])
+            self.assertEqual(settlements.settled_with(user.id), settlements.settled_with(user.id, start=month_start(timezone.now())))
+
+    def test_invalid_settlements_are_rejected(self):
+        for payee, amount in ((self.user1, '5.00'), (self.user2, '0.00'), (self.user2, '-5.00')):
+            response = self.settle(self.user1, payee, amount)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Settlement.objects.count(), 0)
+
+    def test_compaction_keeps_totals(self):
+        for slot in range(4):
+            with mock.patch('api.settlements.random.randrange', return_value=slot):
+                self.settle(self.user2, self.user1, '5.00')
+                self.settle(self.user1, self.user2, '1.00')
+        self.assertEqual(SettlementCounter.objects.count(), 4)
+
+        out = io.StringIO()
+        call_command('compact_settlement_counters', stdout=out)
+        self.assertIn('Removed 3', out.getvalue())
+        counter = SettlementCounter.objects.get()
+        self.assertEqual(counter.slot, 0)
+        self.client.force_authenticate(user=self.user1)
+        summary = self.client.get(reverse('balance-summary')).data
+        self.assertEqual(summary['total_settled_to_me'], '16.00')
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Needs concurrent writers; SQLite serializes them.')
+class SettlementConcurrencyTests(TransactionTestCase):
+
+    def test_concurrent_settlements_within_one_pair_lose_nothing(self):
+        # Every thread settles between the same two users, in both directions,
+        # so they contend on the pair's slots while compaction folds them.
+        first = CustomUser.objects.create_user(email='first@example.com', name='First', mobile='+1000000000', password='testpassword')
+        second = CustomUser.objects.create_user(email='second@example.com', name='Second', mobile='+2000000000', password='testpassword')
+        rounds = 25
+        jobs = [(first, second, 100 + n) if n % 2 else (second, first, 100 + n) for n in range(16)]
+
+        def settle(job):
+            payer, payee, cents = job
+            try:
+                for _ in range(rounds):
+                    settlements.record_settlement(payer.id, payee.id, cents)
+            finally:
+                connection.close()
+
+        def compact():
+            try:
+                for _ in range(rounds):
+                    settlements.compact_counters()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            futures = [pool.submit(settle, job) for job in jobs] + [pool.submit(compact) for _ in range(2)]
+            for future in futures:
+                future.result()
+
+        paid = {payer.id: 0 for payer in (first, second)}
+        for payer, _, cents in jobs:
+            paid[payer.id] += cents * rounds
+        self.assertEqual(
+            dict(Settlement.objects.values('payer_id').annotate(total=Sum('amount_cents')).values_list('payer_id', 'total')), paid
+        )
+        net = paid[first.id] - paid[second.id]
+        self.assertEqual(settlements.settled_with(second.id)[first.id], [max(net, 0), max(-net, 0)])
+
+        settlements.compact_counters()
+        self.assertEqual(list(SettlementCounter.objects.values_list('slot', 'net_cents')), [(0, net)])
+
+class SplitCalculatorTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+        self.client.force_authenticate(user=self.user1)
+
+    def test_allocation_matches_allocate_cents(self):
+        rng = random.Random(36)
+        for _ in range(50):
+            weights = [rng.randint(0, 10 ** 6) for _ in range(rng.randint(1, 200))] + [1]
+            total = rng.randint(0, 10 ** 9)
+            expected = allocate_cents(total, weights)
+            self.assertEqual(splitcalc.allocate(total, weights), expected)
+            with mock.patch.object(splitcalc, 'np', None):
+                self.assertEqual(splitcalc.allocate(total, weights), expected)
+
+    def test_large_percentage_split_without_numpy(self):
+        user_ids, units, places = splitcalc.parse_splits(
+            [{'user': user_id, 'percentage': '0.004' if user_id % 3 == 0 else 0.003} for user_id in range(1, 30001)],
+            'percentage',
+        )
+        for np in (splitcalc.np, None):
+            with mock.patch.object(splitcalc, 'np', np):
+                splits = splitcalc.percentage_splits(123456789, user_ids, units, places)
+                self.assertEqual(sum(cents for _, cents in splits), 123456789)
+                with self.assertRaisesMessage(splitcalc.SplitError, 'Duplicate user IDs found in percentage splits.'):
+                    splitcalc.percentage_splits(100, user_ids[:-1] + [1], units, places)
+
+    def test_exact_splits_match_without_numpy(self):
+        rng = random.Random(36)
+        values = [f'{rng.randint(0, 10 ** 6) / 100:.2f}' for _ in range(20000)] + ['1.5', 3, '0.250']
+        user_ids, units, places = splitcalc.parse_splits(
+            [{'user': user_id, 'split_amount': value} for user_id, value in enumerate(values, start=1)], 'split_amount'
+        )
+        total = sum(round(Decimal(str(value)) * 100) for value in values)
+        results = []
+        for np in (splitcalc.np, None):
+            with mock.patch.object(splitcalc, 'np', np):
+                results.append(splitcalc.exact_splits(total, user_ids, units, places))
+                for amount, splits, message in (
+                    (total + 1, user_ids, 'The total of all exact split amounts must equal the expense amount.'),
+                    (total, user_ids[:-1] + [1], 'Duplicate user IDs found in exact splits.'),
+                ):
+                    with self.assertRaisesMessage(splitcalc.SplitError, message):
+                        splitcalc.exact_splits(amount, splits, units, places)
+                with self.assertRaisesMessage(splitcalc.SplitError, 'Ensure that there are no more than 2 decimal places.'):
+                    splitcalc.exact_splits(total, user_ids, units[:-1] + [2501], places)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0][-3:], [(20001, 150), (20002, 300), (20003, 25)])
+
+    def test_rejects_malformed_splits(self):
+        url = reverse('expense-create')
+        base = {'amount': '10.00', 'title': 'Test', 'description': 'Test', 'split_method': 'exact'}
+        for splits in (
+            [{'user': self.user1.id}],
+            [{'user': 'abc', 'split_amount': '10.00'}],
+            [{'user': self.user1.id, 'split_amount': 'NaN'}],
+            [{'user': self.user1.id, 'split_amount': '9.999'}, {'user': self.user2.id, 'split_amount': '0.001'}],
+            [{'user': self.user1.id, 'split_amount': '100000010.00'}, {'user': self.user2.id, 'split_amount': '-100000000.00'}],
+            [{'user': 10 ** 20, 'split_amount': '5.00'}, {'user': self.user2.id, 'split_amount': '5.00'}],
+            [{'user': -self.user1.id, 'split_amount': '5.00'}, {'user': self.user2.id, 'split_amount': '5.00'}],
+        ):
+            response = self.client.post(url, dict(base, exact_splits=splits), format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, splits)
+        self.assertFalse(Expense.objects.exists())
+
+
+class LedgerPartitioningTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+        self.client.force_authenticate(user=self.user1)
+
+    def create_expense(self, title):
+        response = self.client.post(reverse('expense-create'), {
+            'amount': '30.00',
+            'title': title,
+            'description': '',
+            'split_method': 'exact',
+            'exact_splits': [{'user': self.user1.id, 'split_amount': '10.00'}, {'user': self.user2.id, 'split_amount': '20.00'}]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Expense.objects.get(id=response.data['id'])
+
+    def test_export_is_bounded_by_created_at(self):
+        old = self.create_expense('Old')
+        Expense.objects.filter(id=old.id).update(created_at=datetime(2024, 1, 15, tzinfo=dt_timezone.utc))
+        BalanceSheet.objects.filter(expense=old).update(created_at=datetime(2024, 1, 15, tzinfo=dt_timezone.utc))
+        new = self.create_expense('New')
+        self.assertEqual(set(BalanceSheet.objects.filter(expense=new).values_list('created_at', flat=True)), {new.created_at})
+
+        response = self.client.get(reverse('overall-balance-sheet-csv'), {'start': '2024-01-15', 'end': '2024-01-15'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([line.split(',')[6] for line in lines[1:]], ['Old', 'Old'])
+
+        response = self.client.get(reverse('balance-sheet-csv'), {'start': '2024-01-16'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([line.split(',')[5] for line in lines[1:]], ['New'])
+
+        response = self.client.get(reverse('balance-sheet-csv'), {'end': '15-01-2024'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @unittest.skipIf(connection.vendor == 'postgresql', 'Checks the error on other databases.')
+    def test_partitioning_requires_postgresql(self):
+        with self.assertRaisesMessage(CommandError, 'requires PostgreSQL'):
+            call_command('partition_ledger', stdout=io.StringIO())
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'Declarative partitioning is PostgreSQL only.')
+    def test_partition_by_month_prunes_date_bounded_queries(self):
+        if any(partition_scheme(connection, table) for table in LEDGER_TABLES):
+            self.skipTest('Ledger tables are already partitioned (LEDGER_PARTITIONING is set).')
+        before = self.create_expense('Before')
+        call_command('partition_ledger', by='month', months_ahead=1, stdout=io.StringIO())
+        self.assertEqual([partition_scheme(connection, table) for table in LEDGER_TABLES], ['month', 'month'])
+
+        after = self.create_expense('After')
+        self.assertEqual(ExpenseSplit.objects.filter(expense=after).count(), 2)
+        self.assertGreater(after.splits.first().id, before.splits.last().id)
+
+        this_month = month_start(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT DISTINCT tableoid::regclass::text FROM api_balancesheet')
+            self.assertEqual(cursor.fetchall(), [(f'api_balancesheet_p{this_month:%Y_%m}',)])
+
+        plan = BalanceSheet.objects.filter(created_at__gte=this_month, created_at__lt=month_start(this_month, 1)).explain()
+        self.assertIn(f'api_balancesheet_p{this_month:%Y_%m}', plan)
+        self.assertNotIn(f'api_balancesheet_p{month_start(this_month, 1):%Y_%m}', plan)
+        self.assertNotIn('api_balancesheet_default', plan)
+
+        out = io.StringIO()
+        call_command('create_ledger_partitions', months_ahead=2, stdout=out)
+        self.assertIn(f'api_balancesheet_p{month_start(this_month, 2):%Y_%m}', out.getvalue())
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'Declarative partitioning is PostgreSQL only.')
+    def test_partition_by_user_hash(self):
+        if any(partition_scheme(connection, table) for table in LEDGER_TABLES):
+            self.skipTest('Ledger tables are already partitioned (LEDGER_PARTITIONING is set).')
+        call_command('partition_ledger', by='user', partitions=4, stdout=io.StringIO())
+        self.assertEqual([partition_scheme(connection, table) for table in LEDGER_TABLES], ['user', 'user'])
+        self.create_expense('Hashed')
+        self.assertEqual(BalanceSheet.objects.count(), 2)
+        plan = BalanceSheet.objects.filter(user=self.user1).explain()
+        self.assertEqual(len(set(re.findall(r'api_balancesheet_h\d+\b', plan))), 1)
+
+
+class LedgerArchiveTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        settings_override = override_settings(LEDGER_ARCHIVE_DIR=archive_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_expense(self, owner, created_at, splits):
+        self.client.force_authenticate(user=owner)
+        response = self.client.post(reverse('expense-create'), {
+            'amount': format_cents(sum(cents for _, cents in splits)),
+            'title': f'Expense on {created_at:%Y-%m-%d}',
+            'description': 'Archived, "maybe"',
+            'split_method': 'exact',
+            'exact_splits': [{'user': user.id, 'split_amount': format_cents(cents)} for user, cents in splits]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        expense_id = response.data['id']
+        Expense.objects.filter(id=expense_id).update(created_at=created_at)
+        ExpenseSplit.objects.filter(expense_id=expense_id).update(created_at=created_at)
+        BalanceSheet.objects.filter(expense_id=expense_id).update(created_at=created_at)
+        return expense_id
+
+    def snapshot(self):
+        self.client.force_authenticate(user=self.user1)
+        snapshot = []
+        for url, params in (
+            (reverse('overall-balance-sheet-csv'), {}),
+            (reverse('overall-balance-sheet-csv'), {'start': '2024-02-01', 'end': '2024-03-31'}),
+            (reverse('balance-sheet-csv'), {'end': '2024-02-10'}),
+        ):
+            snapshot.append(b''.join(self.client.get(url, params).streaming_content))
+        for params in ({}, {'start': '2024-02-10'}, {'counterparty': self.user2.id}):
+            snapshot.append(self.client.get(reverse('balance-summary'), params).data)
+        return snapshot
+
+    def test_archived_rows_stay_visible_to_exports_and_summaries(self):
+        self.create_expense(self.user1, datetime(2024, 1, 20, tzinfo=dt_timezone.utc), [(self.user1, 1000), (self.user2, 2550)])
+        self.create_expense(self.user2, datetime(2024, 2, 5, tzinfo=dt_timezone.utc), [(self.user1, 700), (self.user2, 300)])
+        self.create_expense(self.user1, datetime(2024, 2, 25, tzinfo=dt_timezone.utc), [(self.user2, 1234)])
+        self.create_expense(self.user2, datetime(2024, 3, 3, tzinfo=dt_timezone.utc), [(self.user1, 99)])
+        before = self.snapshot()
+
+        out = io.StringIO()
+        call_command('archive_ledger', before='2024-02-15', stdout=out)
+        self.assertIn('Archived 8 row(s)', out.getvalue())
+        # One file per month and user bucket.
+        self.assertEqual(sorted(LedgerArchive.objects.values_list('table', 'row_count')), [('balancesheet', 1)] * 4 + [('expensesplit', 1)] * 4)
+        self.assertEqual(ExpenseSplit.objects.count(), 2)
+        self.assertEqual(BalanceSheet.objects.count(), 2)
+        self.assertEqual(self.snapshot(), before)
+
+        # A range that ends before any archive does not open the files.
+        with mock.patch('api.archive.gzip.open') as gzip_open:
+            self.client.get(reverse('balance-summary'), {'start': '2024-03-01'})
+        gzip_open.assert_not_called()
+
+    def expense_reads(self, expense_id):
+        self.client.force_authenticate(user=self.user1)
+        reads = []
+        for url, params in (
+            (reverse('get-all-expenses'), {}),
+            (reverse('get-user-expenses'), {}),
+            (reverse('get-expenses-by-user', args=[self.user1.id]), {'fields': 'id,splits'}),
+            (reverse('expense-search'), {'q': 'Expense', 'participant': self.user2.id}),
+            (reverse('expense-detail', args=[expense_id]), {}),
+        ):
+            for fast in (True, False):
+                with override_settings(FAST_READ_SERIALIZERS=fast):
+                    reads.append(json.loads(self.client.get(url, params).content))
+        return reads
+
+    def test_archived_splits_stay_visible_to_expense_reads(self):
+        january = self.create_expense(self.user1, datetime(2024, 1, 20, tzinfo=dt_timezone.utc), [(self.user1, 1000), (self.user2, 2550)])
+        self.create_expense(self.user1, datetime(2024, 3, 3, tzinfo=dt_timezone.utc), [(self.user2, 99)])
+        before = self.expense_reads(january)
+        self.assertEqual(len(before[0][0]['splits']), 2)
+        self.assertEqual(len(before[6]), 2)
+
+        call_command('archive_ledger', before='2024-02-15', stdout=io.StringIO())
+        self.assertFalse(ExpenseSplit.objects.filter(expense_id=january).exists())
+        self.assertEqual(self.expense_reads(january), before)
+
+    def test_user_reads_open_only_files_listing_the_user(self):
+        user3 = CustomUser.objects.create_user(email='user3@example.com', name='User Three', mobile='+5555555555', password='testpassword')
+        self.create_expense(self.user2, datetime(2024, 1, 10, tzinfo=dt_timezone.utc), [(self.user2, 500), (user3, 500)])
+        self.create_expense(self.user1, datetime(2024, 1, 20, tzinfo=dt_timezone.utc), [(self.user1, 1000)])
+        self.create_expense(self.user2, datetime(2024, 1, 25, tzinfo=dt_timezone.utc), [(self.user1, 250)])
+        call_command('archive_ledger', before='2024-02-01', stdout=io.StringIO())
+        mine = set(LedgerArchiveUser.objects.filter(user=self.user1).values_list('archive__path', flat=True))
+        self.assertEqual(len(mine), 2)
+
+        self.client.force_authenticate(user=self.user1)
+        with mock.patch('api.archive.gzip.open', wraps=gzip.open) as gzip_open:
+            summary = self.client.get(reverse('balance-summary')).data
+            export = b''.join(self.client.get(reverse('balance-sheet-csv')).streaming_content)
+        opened = {os.path.relpath(call.args[0], settings.LEDGER_ARCHIVE_DIR) for call in gzip_open.call_args_list}
+        self.assertEqual(opened, mine)
+        self.assertEqual((summary['total_paid'], summary['total_share']), ('10.00', '12.50'))
+        self.assertEqual(export.count(b'\n'), 3)
+
+    def test_failed_archive_keeps_rows_and_leaves_no_file(self):
+        self.create_expense(self.user1, datetime(2024, 1, 20, tzinfo=dt_timezone.utc), [(self.user1, 1000), (self.user2, 2550)])
+        with mock.patch('api.archive.LedgerArchive.objects.create', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                call_command('archive_ledger', before='2024-02-01', stdout=io.StringIO())
+        self.assertEqual(ExpenseSplit.objects.count(), 2)
+        self.assertFalse(LedgerArchive.objects.exists())
+        self.assertEqual([files for _, _, files in os.walk(settings.LEDGER_ARCHIVE_DIR) if files], [])
+
+
+class ExpenseSearchTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.search_url = reverse('expense-search')
+        self.user1 = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+        self.trip = self.create_expense(self.user1, 'Saputara trip', 'Weekend in the hills', [self.user1, self.user2])
+        self.goa = self.create_expense(self.user2, 'Goa trip', 'Beach shacks', [self.user2])
+        self.dinner = self.create_expense(self.user2, 'Dinner', 'After the Saputara trek', [self.user1, self.user2])
+
+    def create_expense(self, owner, title, description, participants):
+        self.client.force_authenticate(user=owner)
+        response = self.client.post(reverse('expense-create'), {
+            'amount': '10.00',
+            'title': title,
+            'description': description,
+            'split_method': 'percentage',
+            'percentage_splits': [{'user': user.id, 'percentage': 100 / len(participants)} for user in participants]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def search(self, **params):
+        response = self.client.get(self.search_url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [expense['id'] for expense in response.data]
+
+    def test_search_ranks_and_filters(self):
+        self.assertEqual(self.search(q='Saputara trip'), [self.trip])
+        # Title matches rank above description matches; words are stemmed.
+        self.assertEqual(self.search(q='saputara'), [self.trip, self.dinner])
+        self.assertEqual(self.search(q='trips'), [self.goa, self.trip])
+        self.assertEqual(self.search(q='saputara', owner=self.user2.id), [self.dinner])
+        self.assertEqual(self.search(q='trip', participant=self.user1.id), [self.trip])
+        self.assertEqual(self.search(q='saputara', limit=1), [self.trip])
+        self.assertEqual(self.search(q='"trip -"*'), [self.goa, self.trip])
+        self.assertEqual(self.search(q='nothing'), [])
+
+        response = self.client.get(self.search_url, {'q': 'trip', 'fields': 'id,title'})
+        self.assertEqual(response.data[0], {'id': self.goa, 'title': 'Goa trip'})
+
+    def test_new_expenses_are_searchable_immediately(self):
+        self.assertEqual(self.search(q='kayaking'), [])
+        kayaking = self.create_expense(self.user1, 'Kayaking', '', [self.user1])
+        self.assertEqual(self.search(q='kayaking'), [kayaking])
+
+    def test_search_requires_query(self):
+        for params in ({}, {'q': ' '}, {'q': 'trip', 'owner': 'me'}):
+            response = self.client.get(self.search_url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class NDJSONExportTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+        self.user3 = CustomUser.objects.create_user(email='user3@example.com', name='User Three', mobile='+1122334455', password='testpassword')
+        self.create_expense(self.user1, 'Lunch', [(self.user1, '5.50'), (self.user2, '14.50')])
+        self.create_expense(self.user2, 'Taxi "late"', [(self.user1, '7.05'), (self.user3, '2.95')])
+        self.create_expense(self.user3, 'Snacks', [(self.user2, '3.00')])
+
+    def create_expense(self, owner, title, splits):
+        self.client.force_authenticate(user=owner)
+        response = self.client.post(reverse('expense-create'), {
+            'amount': format_cents(sum(int(Decimal(amount) * 100) for _, amount in splits)),
+            'title': title,
+            'description': 'ಊಟ\u2028\u2029x',
+            'split_method': 'exact',
+            'exact_splits': [{'user': user.id, 'split_amount': amount} for user, amount in splits]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def export(self, url_name, **params):
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse(url_name), dict(params, export_format='ndjson'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        body = b''.join(response.streaming_content).decode()
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_rows_are_typed(self):
+        rows = self.export('overall-balance-sheet-csv')
+        self.assertEqual(len(rows), 5)
+        sheet = BalanceSheet.objects.get(user=self.user1, title='Lunch')
+        self.assertEqual(rows[0], {
+            'id': sheet.id,
+            'expense_id': sheet.expense_id,
+            'user_id': self.user1.id,
+            'owner_id': self.user1.id,
+            'split_amount': '5.50',
+            'amount': '20.00',
+            'title': 'Lunch',
+            'description': 'ಊಟ\u2028\u2029x',
+            'created_at': sheet.created_at.isoformat(),
+        })
+        self.assertEqual([row['split_amount'] for row in rows], ['5.50', '14.50', '7.05', '2.95', '3.00'])
+
+    def test_filters(self):
+        self.assertEqual([row['title'] for row in self.export('balance-sheet-csv')], ['Lunch', 'Taxi "late"'])
+        self.assertEqual([row['title'] for row in self.export('balance-sheet-csv', counterparty=self.user2.id)], ['Taxi "late"'])
+        self.assertEqual(
+            [(row['user_id'], row['owner_id']) for row in self.export('overall-balance-sheet-csv', counterparty=self.user3.id)],
+            [(self.user3.id, self.user2.id), (self.user2.id, self.user3.id)],
+        )
+        self.assertEqual(len(self.export('overall-balance-sheet-csv', owner=self.user2.id)), 2)
+        self.assertEqual(self.export('overall-balance-sheet-csv', start='2000-01-01', end='2000-12-31'), [])
+
+        response = self.client.get(reverse('balance-sheet-csv'), {'export_format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('balance-sheet-csv'), {'owner': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # The CSV export takes the same filters.
+        response = self.client.get(reverse('balance-sheet-csv'), {'counterparty': self.user2.id})
+        lines = b''.join(response.streaming_content).decode().split('\r\n')
+        self.assertEqual(len(lines), 3)
+        self.assertIn(',7.05,', lines[1])
+
+    @override_settings(EXPORT_BUFFER_BYTES=300, EXPORT_CHUNK_ROWS=2)
+    def test_streams_buffered_chunks(self):
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse('overall-balance-sheet-csv'), {'export_format': 'ndjson'})
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(chunk.endswith(b'\n') for chunk in chunks))
+        self.assertEqual(len(b''.join(chunks).splitlines()), 5)
+
+
+@override_settings(EXPORT_MEMORY_PROFILE=True, EXPORT_CHUNK_ROWS=500, EXPORT_MEMORY_SAMPLE_ROWS=500)
+class ExportMemoryProfileTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1234567890', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.expense = Expense.objects.create(owner=self.user, amount=Decimal('1.00'), amount_cents=100, title='Bulk', split_method='exact')
+        self.rows = 0
+
+    def add_rows(self, count):
+        BalanceSheet.objects.bulk_create([
+            BalanceSheet(
+                user=self.user, expense=self.expense, owner=self.user, split_amount=Decimal('1.00'), split_amount_cents=100,
+                amount=Decimal('1.00'), amount_cents=100, title='Bulk', description=f'Row {self.rows + n}',
+            )
+            for n in range(count)
+        ], batch_size=5000)
+        self.rows += count
+
+    def export(self, **params):
+        with self.assertLogs('api.exports', level='INFO') as logs:
+            response = self.client.get(reverse('overall-balance-sheet-csv'), params)
+            for _ in response.streaming_content:
+                pass
+        report = logs.records[-1].export_profile
+        self.assertEqual(report['rows'], self.rows)
+        return report
+
+    def test_peak_memory_does_not_grow_with_rows(self):
+        # Ten times the rows, about the same peak: rows are streamed, never held.
+        # The same holds from 10k to 1M rows; smaller counts keep the test fast.
+        self.add_rows(2000)
+        small = {export_format: self.export(export_format=export_format) for export_format in ('csv', 'ndjson')}
+        self.add_rows(18000)
+        for export_format, report in small.items():
+            large = self.export(export_format=export_format)
+            self.assertLess(large['peak_bytes'], report['peak_bytes'] * 1.5 + 256 * 1024, (export_format, report, large))
+            self.assertLess(large['peak_bytes_per_row'], report['peak_bytes_per_row'] / 5)
+            self.assertLessEqual(len(large['top_sites']), settings.EXPORT_MEMORY_TOP)
+
+    @override_settings(EXPORT_MEMORY_PROFILE=False)
+    def test_profiling_is_off_by_default(self):
+        self.add_rows(10)
+        with self.assertNoLogs('api.exports', level='INFO'):
+            response = self.client.get(reverse('overall-balance-sheet-csv'))
+            self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 11)
+
+
+class LoadTestDriverTests(LiveServerTestCase):
+
+    def test_histogram_percentiles_stay_within_bucket_precision(self):
+        histogram = Histogram()
+        for value in range(1, 100001):
+            histogram.record(value)
+        self.assertEqual(histogram.total, 100000)
+        for percent in (50, 90, 99, 99.9):
+            expected = 100000 * percent / 100
+            self.assertAlmostEqual(histogram.percentile(percent), expected, delta=expected / 1000)
+        self.assertEqual(histogram.percentile(100), 100000)
+
+        other = Histogram()
+        other.record(5_000_000)
+        histogram.merge(other)
+        self.assertEqual(histogram.max, 5_000_000)
+        self.assertEqual(histogram.percentile(100), 5_000_000)
+
+    def test_short_run_covers_the_mix_without_errors(self):
+        test = LoadTest(self.live_server_url, users=2, concurrency=2, duration=1.0, timeout=10)
+        report = asyncio.run(test.run())
+
+        self.assertEqual(report['overall']['errors'], {})
+        self.assertGreater(report['overall']['requests'], 0)
+        self.assertEqual(set(report['routes']), {route.name for route in default_routes()})
+        self.assertTrue(CustomUser.objects.filter(email__startswith='load-').exists())
+
+    def test_mix_covers_every_route_but_the_excluded_ones(self):
+        session = Session('check', 0, 'password')
+        session.user_id, session.user_ids, session.emails = 1, [1, 2], [session.email]
+        requests = set()
+        for route in default_routes():
+            session.expense_ids = [7]
+            method, path, _ = route.build(session)
+            requests.add((resolve(urlsplit(path).path).url_name, method))
+
+        patterns = backend_urls.urlpatterns
+        # Included URLconfs: the admin site and the browsable-API login.
+        self.assertEqual({str(p.pattern) for p in patterns if isinstance(p, URLResolver)}, {'admin/', 'api-auth/'})
+        self.assertEqual(
+            {name for name, _ in requests},
+            {p.name for p in patterns if isinstance(p, URLPattern)} - EXCLUDED_URL_NAMES,
+        )
+        self.assertLessEqual({('expense-detail', 'PUT'), ('expense-detail', 'DELETE')}, requests)
+
+
+
+@unittest.skipUnless(len(settings.LEDGER_SHARDS) > 1, 'LEDGER_SHARDS lists a single database')
+class LedgerShardingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.client = APIClient()
+        sharding.shard_map(refresh=True)
+        self.first, self.second = settings.LEDGER_SHARDS[:2]
+        # One owner per shard, found by creating users until both shards have one.
+        owners = {}
+        for number in range(100):
+            user = CustomUser.objects.create_user(
+                email=f'owner{number}@example.com', name=f'Owner {number}', mobile=f'+91{number:010d}', password='testpassword'
+            )
+            owners.setdefault(sharding.shard_for_owner(user.id), user)
+            if self.first in owners and self.second in owners:
+                break
+        self.user1, self.user2 = owners[self.first], owners[self.second]
+
+    def create_expense(self, owner, title, participants):
+        self.client.force_authenticate(user=owner)
+        response = self.client.post(reverse('expense-create'), {
+            'amount': f'{5 * len(participants)}.00',
+            'title': title,
+            'description': '',
+            'split_method': 'exact',
+            'exact_splits': [{'user': user.id, 'split_amount': '5.00'} for user in participants]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def test_rows_live_on_the_owner_shard(self):
+        first = self.create_expense(self.user1, 'Trip tickets', [self.user1, self.user2])
+        second = self.create_expense(self.user2, 'Trip dinner', [self.user1, self.user2])
+
+        self.assertTrue(Expense.objects.using(self.first).filter(id=first).exists())
+        self.assertFalse(Expense.objects.using(self.second).filter(id=first).exists())
+        self.assertEqual(BalanceSheet.objects.using(self.second).filter(expense_id=second).count(), 2)
+        self.assertEqual(ExpenseSplit.objects.using(self.second).filter(expense_id=second).count(), 2)
+        # Each shard allocates ids from its own range.
+        position = settings.LEDGER_SHARDS.index(self.second)
+        self.assertEqual(second >> sharding.ID_RANGE_BITS, position)
+        self.assertTrue(CustomUser.objects.using(self.second).filter(id=self.user1.id).exists())
+
+    def test_reads_cover_every_shard(self):
+        first = self.create_expense(self.user1, 'Trip tickets', [self.user1, self.user2])
+        second = self.create_expense(self.user2, 'Trip dinner', [self.user1, self.user2])
+        self.client.force_authenticate(user=self.user1)
+
+        response = self.client.get(reverse('get-all-expenses'))
+        self.assertEqual(sorted(expense['id'] for expense in response.data), sorted([first, second]))
+        response = self.client.get(reverse('get-user-expenses'))
+        self.assertEqual([expense['id'] for expense in response.data], [first])
+        response = self.client.get(reverse('get-expenses-by-user', args=[self.user2.id]))
+        self.assertEqual([expense['id'] for expense in response.data], [second])
+        response = self.client.get(reverse('expense-search'), {'q': 'trip'})
+        self.assertEqual({expense['id'] for expense in response.data}, {first, second})
+
+        response = self.client.get(reverse('balance-summary'))
+        self.assertEqual(response.data['total_paid'], '10.00')
+        self.assertEqual(response.data['total_share'], '10.00')
+
+        response = self.client.get(reverse('overall-balance-sheet-csv'), {'export_format': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual([row['created_at'] for row in rows], sorted(row['created_at'] for row in rows))
+
+    def test_rebalance_moves_a_bucket(self):
+        expense_id = self.create_expense(self.user1, 'Trip tickets', [self.user1, self.user2])
+        bucket = sharding.bucket_for(self.user1.id)
+
+        out = io.StringIO()
+        call_command('rebalance_ledger_shards', bucket=[bucket], to=self.second, wait=0, stdout=out)
+        self.assertIn(f'Bucket {bucket}: drained from {self.first}', out.getvalue())
+
+        self.assertEqual(sharding.shard_for_owner(self.user1.id), self.second)
+        self.assertFalse(Expense.objects.using(self.first).filter(id=expense_id).exists())
+        self.assertEqual(BalanceSheet.objects.using(self.second).filter(expense_id=expense_id).count(), 2)
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse('get-user-expenses'))
+        self.assertEqual([expense['id'] for expense in response.data], [expense_id])
+        self.create_expense(self.user1, 'Trip dinner', [self.user1])
+
+    def test_writes_to_a_moving_bucket_are_refused(self):
+        LedgerShardBucket.objects.filter(bucket=sharding.bucket_for(self.user1.id)).update(moving_to=self.second)
+        sharding.shard_map(refresh=True)
+
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.post(reverse('expense-create'), {
+            'amount': '5.00',
+            'title': 'Trip',
+            'split_method': 'exact',
+            'exact_splits': [{'user': self.user1.id, 'split_amount': '5.00'}]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', response)
+
+
+class AdminTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = CustomUser.objects.create_user(email='staff@example.com', name='Staff User', mobile='+1234567890', password='testpassword', is_staff=True)
+        self.user1 = CustomUser.objects.create_user(email='user1@example.com', name='User One', mobile='+1111111111', password='testpassword')
+        self.user2 = CustomUser.objects.create_user(email='user2@example.com', name='User Two', mobile='+9876543210', password='testpassword')
+        self.dinner = self.create_expense(self.user1, 'Team dinner', datetime(2024, 3, 5, 12, tzinfo=dt_timezone.utc))
+        self.taxi = self.create_expense(self.user2, 'Airport taxi', datetime(2024, 7, 9, 12, tzinfo=dt_timezone.utc))
+        self.hotel = self.create_expense(self.user1, 'Hotel booking', datetime(2025, 1, 2, 12, tzinfo=dt_timezone.utc))
+        self.client.force_authenticate(user=None)
+        self.client.force_login(self.staff)
+
+    def create_expense(self, owner, title, created_at):
+        self.client.force_authenticate(user=owner)
+        response = self.client.post(reverse('expense-create'), {
+            'amount': '30.00',
+            'title': title,
+            'split_method': 'exact',
+            'exact_splits': [{'user': self.user1.id, 'split_amount': '10.00'}, {'user': self.user2.id, 'split_amount': '20.00'}]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        expense_id = response.data['id']
+        Expense.objects.filter(id=expense_id).update(created_at=created_at)
+        ExpenseSplit.objects.filter(expense_id=expense_id).update(created_at=created_at)
+        BalanceSheet.objects.filter(expense_id=expense_id).update(created_at=created_at)
+        return expense_id
+
+    def changelist(self, model, params=None):
+        response = self.client.get(reverse(f'admin:api_{model}_changelist'), params or {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_change_lists_never_count_whole_tables(self):
+        for model in ('expense', 'expensesplit', 'balancesheet'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.changelist(model)
+            self.assertEqual(response.context['cl'].result_count, 3 if model == 'expense' else 6)
+            counts = [query['sql'] for query in queries if 'COUNT(' in query['sql'].upper()]
+            self.assertTrue(counts)
+            for sql in counts:
+                self.assertIn('LIMIT', sql.upper())
+
+    def test_ledger_is_read_only(self):
+        response = self.client.get(reverse('admin:api_expense_change', args=[self.dinner]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotContains(response, 'name="_save"')
+        response = self.client.post(reverse('admin:api_expense_delete', args=[self.dinner]), {'post': 'yes'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertTrue(Expense.objects.filter(id=self.dinner).exists())
+
+    def test_search_uses_ids_emails_and_text(self):
+        def found(model, term):
+            return {row.pk for row in self.changelist(model, {'q': term}).context['cl'].result_list}
+
+        self.assertEqual(found('expense', str(self.taxi)), {self.taxi})
+        self.assertEqual(found('expense', 'USER1@example.com'), {self.dinner, self.hotel})
+        self.assertEqual(found('expense', 'dinner'), {self.dinner})
+        rows = found('balancesheet', str(self.hotel))
+        self.assertEqual(rows, set(BalanceSheet.objects.filter(expense_id=self.hotel).values_list('id', flat=True)))
+        rows = found('expensesplit', 'user2@example.com')
+        self.assertEqual(rows, set(ExpenseSplit.objects.filter(user=self.user2).values_list('id', flat=True)))
+        self.assertEqual(found('balancesheet', 'taxi'), set(BalanceSheet.objects.filter(expense_id=self.taxi).values_list('id', flat=True)))
+
+    def test_date_hierarchy_lists_only_periods_with_rows(self):
+        response = self.changelist('expense')
+        self.assertContains(response, 'created_at__year=2024')
+        self.assertContains(response, 'created_at__year=2025')
+
+        response = self.changelist('balancesheet', {'created_at__year': '2024'})
+        self.assertContains(response, 'created_at__month=3')
+        self.assertContains(response, 'created_at__month=7')
+        self.assertEqual(len(response.context['cl'].result_list), 4)
+
+        months = ProbedDatesQuerySet(BalanceSheet).filter(created_at__year=2024).datetimes('created_at', 'month', 'DESC')
+        self.assertEqual([(moment.year, moment.month) for moment in months], [(2024, 7), (2024, 3)])
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=2)
+    def test_counts_stop_at_the_limit(self):
+        self.assertEqual(self.changelist('expense', {'q': 'user1@example.com'}).context['cl'].result_count, 2)
+        self.assertEqual(self.changelist('balancesheet', {'q': 'user2@example.com'}).context['cl'].result_count, 2)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'Row estimates require PostgreSQL')
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=2)
+    def test_unfiltered_count_uses_the_row_estimate(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE api_balancesheet')
+        self.assertEqual(self.changelist('balancesheet').context['cl'].result_count, 6)
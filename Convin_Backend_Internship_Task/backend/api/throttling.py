@@ -0,0 +1,163 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import JsonResponse
+from rest_framework.throttling import BaseThrottle
+
+
+_lock = threading.Lock()
+_heavy = {'in_flight': 0}
+_probe = {'at': float('-inf'), 'latency_ms': 0.0}
+
+
+def throttle_cost(view):
+
+    """
+    Tokens one request to `view` takes from its buckets (its throttle_cost, default 1).
+    """
+
+    return getattr(view, 'throttle_cost', 1)
+
+
+def take(buckets, cost):
+
+    """
+    Take `cost` tokens from every (key, rate, burst) bucket, or from none of them.
+
+    Buckets refill continuously at `rate` tokens per second up to `burst`, and
+    live in the THROTTLE_CACHE backend. Returns 0 when the tokens were taken,
+    otherwise the seconds until all buckets can cover the cost. Updates are
+    atomic within a process; with a shared cache, concurrent processes may
+    briefly overdraw a bucket.
+    """
+
+    cache = caches[settings.THROTTLE_CACHE]
+    now = time.time()
+    with _lock:
+        states = cache.get_many([key for key, _, _ in buckets])
+        levels = []
+        wait = 0.0
+        for key, rate, burst in buckets:
+            tokens, updated = states.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            needed = min(cost, burst)
+            if tokens < needed:
+                wait = max(wait, (needed - tokens) / rate)
+            levels.append((key, tokens - needed, rate, burst))
+        if wait:
+            return wait
+        for key, tokens, rate, burst in levels:
+            # An untouched bucket is full again after burst / rate seconds, so it can expire then.
+            cache.set(key, (tokens, now), timeout=int(burst / rate) + 1)
+    return 0
+
+
+class CostWeightedThrottle(BaseThrottle):
+
+    """
+    Token-bucket throttle charging each request its view's throttle_cost.
+
+    Every request draws from a bucket for its client (the user, or the IP address
+    for anonymous requests) and from a bucket shared by all clients of the view,
+    so a flood of exports hits the limit long before the same number of lookups.
+    Active when THROTTLE_ENABLED is set.
+    """
+
+    def allow_request(self, request, view):
+        if not settings.THROTTLE_ENABLED:
+            return True
+        if request.user and request.user.is_authenticated:
+            client = (f'throttle:user:{request.user.pk}', settings.THROTTLE_USER_RATE, settings.THROTTLE_USER_BURST)
+        else:
+            client = (f'throttle:anon:{self.get_ident(request)}', settings.THROTTLE_ANON_RATE, settings.THROTTLE_ANON_BURST)
+        route = (f'throttle:route:{type(view).__name__}', settings.THROTTLE_ROUTE_RATE, settings.THROTTLE_ROUTE_BURST)
+        self.wait_seconds = take([client, route], throttle_cost(view))
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+def db_latency_ms():
+
+    """
+    Return the smoothed round-trip time of SELECT 1, probing at most every
+    LOAD_SHED_PROBE_INTERVAL seconds.
+    """
+
+    now = time.monotonic()
+    with _lock:
+        if now - _probe['at'] < settings.LOAD_SHED_PROBE_INTERVAL:
+            return _probe['latency_ms']
+        _probe['at'] = now
+    started = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+    latency_ms = (time.perf_counter() - started) * 1000
+    with _lock:
+        _probe['latency_ms'] = latency_ms if not _probe['latency_ms'] else (_probe['latency_ms'] + latency_ms) / 2
+        return _probe['latency_ms']
+
+
+def heavy_in_flight():
+    with _lock:
+        return _heavy['in_flight']
+
+
+def _release():
+    with _lock:
+        _heavy['in_flight'] -= 1
+
+
+class LoadSheddingMiddleware:
+
+    """
+    Reject heavy requests with 503 and Retry-After while the server is saturated.
+
+    A view is heavy when its throttle_cost is at least LOAD_SHED_MIN_COST. Heavy
+    requests are shed once LOAD_SHED_MAX_HEAVY of them are already running in
+    this process, or while the database round trip is slower than
+    LOAD_SHED_DB_LATENCY_MS. A streamed response holds its slot until the
+    stream is closed. Unused unless LOAD_SHEDDING is set.
+    """
+
+    def __init__(self, get_response):
+        if not settings.LOAD_SHEDDING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            if getattr(request, '_load_shed_slot', False):
+                _release()
+            raise
+        if getattr(request, '_load_shed_slot', False):
+            if response.streaming:
+                response._resource_closers.append(_release)
+            else:
+                _release()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if throttle_cost(getattr(view_func, 'view_class', view_func)) < settings.LOAD_SHED_MIN_COST:
+            return None
+        if db_latency_ms() > settings.LOAD_SHED_DB_LATENCY_MS:
+            return self.shed('Database is slow to respond')
+        with _lock:
+            if _heavy['in_flight'] >= settings.LOAD_SHED_MAX_HEAVY:
+                return self.shed('Too many expensive requests in progress')
+            _heavy['in_flight'] += 1
+        request._load_shed_slot = True
+        return None
+
+    def shed(self, reason):
+        response = JsonResponse({'error': f'{reason}, retry later'}, status=503)
+        response['Retry-After'] = str(settings.LOAD_SHED_RETRY_AFTER)
+        return response
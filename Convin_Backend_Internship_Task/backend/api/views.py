@@ -1,8 +1,8 @@
 from django.shortcuts import render
 from rest_framework import generics
-from .models import CustomUser, Expense, BalanceSheet
-from .serializers import CustomUserSerializer, CustomUserListSerializer, ExpenseCreateSerializer
-from rest_framework.permissions import IsAuthenticated,AllowAny
+from .models import CustomUser, Expense, BalanceSheet, Settlement
+from .serializers import CustomUserSerializer, CustomUserListSerializer, ExpenseCreateSerializer, SettlementSerializer
+from rest_framework.permissions import IsAuthenticated,AllowAny,IsAdminUser,SAFE_METHODS
 import csv
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
@@ -12,9 +12,154 @@ from rest_framework.views import APIView
 from .serializers import BalanceSheetSerializer
 from django.http import StreamingHttpResponse
 from io import StringIO
+from .dbstats import connection_stats
+from .slowqueries import reset as reset_slow_queries, snapshot as slow_query_snapshot
+from .money import format_cents
+from .summaries import balance_summary
+from .archive import archived_rows, archived_splits
+from .exports import NDJSON_COLUMNS, NDJSON_CONTENT_TYPE, buffered, ndjson_rows, profile_memory
+from .search import search_expenses
+from .splits import delete_expense
+from .statements import get_statement
+from .sharding import ledger_aliases, ledger_shards, merge_ordered, shard_for_owner
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from .idempotency import IDEMPOTENCY_HEADER, idempotent_response
+from .events import get_broker
+from .readplans import PlannedRows, read_plan_for, readable_fields
+from rest_framework.exceptions import ValidationError
+from .renderers import FastJSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.renderers import JSONRenderer
+from django.conf import settings
+from django.http import JsonResponse
+from django.views import View
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+from django.db import transaction
+from django.db.models import Case, Q, When
+from django.db.models.functions import Lower
+import asyncio
+import json
 
 # Create your views here.
 
+class FastListMixin:
+    
+    """
+    Serve list responses from a precompiled ReadPlan instead of the serializer.
+    
+    The output is identical to the serializer's; it is built from values_list()
+    rows and encoded with orjson. Disable with FAST_READ_SERIALIZERS=False.
+    
+    Clients may narrow the output with ?fields=id,amount. Nested lists such as
+    `splits` are then only fetched when named in fields or in ?expand=splits.
+    Expense lists fill in the splits of archived expenses from the archive files.
+    """
+    
+    renderer_classes = [FastJSONRenderer] + [
+        renderer for renderer in api_settings.DEFAULT_RENDERER_CLASSES if renderer is not JSONRenderer
+    ]
+    # {pk: position} ordering the combined rows of a list read from several ledger shards.
+    row_positions = None
+    # Whether the rows' `splits` include the ones moved to the ledger archive.
+    reads_archived_splits = False
+
+    def get_querysets(self):
+        # Views listing expenses of many owners return one queryset per ledger shard.
+        return [self.filter_queryset(self.get_queryset())]
+
+    def get_requested_fields(self):
+        fields = self.request.query_params.get('fields')
+        expand = self.request.query_params.get('expand')
+        if not fields and not expand:
+            return None
+
+        scalar, nested = readable_fields(self.get_serializer_class())
+        requested = {name.strip() for name in fields.split(',') if name.strip()} if fields else set(scalar)
+        expanded = {name.strip() for name in expand.split(',') if name.strip()} if expand else set()
+
+        unknown = sorted((requested - set(scalar) - set(nested)) | (expanded - set(nested)))
+        if unknown:
+            raise ValidationError({
+                'fields': f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(scalar + nested)}."
+            })
+        return frozenset(requested | expanded)
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+
+        fields = self.get_requested_fields()
+        plan = read_plan_for(self.get_serializer_class(), fields)
+        querysets = self.get_querysets()
+        if len(querysets) > 1 or self.wants_archived_splits(fields):
+            return Response(self.list_shards(plan, fields, querysets))
+        queryset = querysets[0]
+        if settings.FAST_READ_SERIALIZERS:
+            return Response(plan.rows(queryset))
+
+        if fields is None:
+            return Response(self.get_serializer(queryset, many=True).data)
+
+        serializer = self.get_serializer(plan.narrow(queryset), many=True)
+        for name in set(serializer.child.fields) - fields:
+            serializer.child.fields.pop(name)
+        return Response(serializer.data)
+
+    def list_shards(self, plan, fields, querysets):
+        
+        """
+        Build one list out of per-shard querysets, in row_positions order if set.
+        """
+        
+        if settings.FAST_READ_SERIALIZERS:
+            keyed = [pair for queryset in querysets for pair in plan.rows(queryset, key_column='pk')]
+        else:
+            keyed = [
+                (instance.pk, instance)
+                for queryset in querysets
+                for instance in (queryset if fields is None else plan.narrow(queryset))
+            ]
+        if self.row_positions is not None:
+            keyed.sort(key=lambda pair: self.row_positions[pair[0]])
+        items = [item for _, item in keyed]
+
+        if settings.FAST_READ_SERIALIZERS:
+            rows = PlannedRows(items)
+            rows.orjson_safe = plan.orjson_safe
+        else:
+            serializer = self.get_serializer(items, many=True)
+            if fields is not None:
+                for name in set(serializer.child.fields) - fields:
+                    serializer.child.fields.pop(name)
+            rows = serializer.data
+        if self.wants_archived_splits(fields):
+            add_archived_splits(querysets, zip((pk for pk, _ in keyed), rows))
+        return rows
+
+    def wants_archived_splits(self, fields):
+        return self.reads_archived_splits and (fields is None or 'splits' in fields)
+
+
+def add_archived_splits(querysets, keyed_rows):
+    
+    """
+    Set the `splits` of the (expense id, row) pairs whose splits were archived.
+    """
+    
+    splits = {}
+    for queryset in querysets:
+        splits.update(archived_splits(queryset))
+    for expense_id, row in keyed_rows:
+        if expense_id in splits:
+            row['splits'] = [
+                {'user': user_id, 'split_amount': format_cents(cents)} for user_id, cents in splits[expense_id]
+            ]
+
+
 class CreateUserView(generics.CreateAPIView):
     
     """
@@ -24,9 +169,10 @@ class CreateUserView(generics.CreateAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = [AllowAny]
+    throttle_cost = 2
 
 
-class UserListView(generics.ListAPIView):
+class UserListView(FastListMixin, generics.ListAPIView):
     
     """
     API view to list all CustomUser instances.
@@ -45,35 +191,225 @@ class ExpenseCreateView(generics.CreateAPIView):
     queryset = Expense.objects.all()
     serializer_class = ExpenseCreateSerializer
     permission_classes = [IsAuthenticated]
+    throttle_cost = 3
+
+    def create(self, request, *args, **kwargs):
+        # Retries carrying the same Idempotency-Key replay the first response.
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return super().create(request, *args, **kwargs)
+        return idempotent_response(request, key, lambda: super(ExpenseCreateView, self).create(request, *args, **kwargs))
 
     def perform_create(self, serializer):
         serializer.save()
         
 
-class GenerateBalanceSheetCSVView(generics.GenericAPIView):
+class ExpenseDetailView(generics.RetrieveUpdateDestroyAPIView):
+    
+    """
+    API view to read, edit or delete one of the current user's expenses.
+    
+    Edits take the fields of expense creation; only the participants whose share
+    changed are rewritten. Deleting removes the expense with all its splits.
+    Edits and deletes lock the expense row first and validate and write in the
+    same transaction, so concurrent changes to one expense apply one at a time.
+    """
+    
+    serializer_class = ExpenseCreateSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_cost = 3
+
+    def get_queryset(self):
+        user = self.request.user
+        if self.request.method in SAFE_METHODS:
+            return Expense.objects.using(shard_for_owner(user.id)).filter(owner=user)
+        shard = shard_for_owner(user.id, for_write=True)
+        return Expense.objects.using(shard).select_for_update().filter(owner=user)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        data = self.get_serializer(instance).data
+        add_archived_splits([self.get_queryset().filter(pk=instance.pk)], [(instance.pk, data)])
+        return Response(data)
+
+    def update(self, request, *args, **kwargs):
+        with transaction.atomic(using=self.get_queryset().db):
+            return super().update(request, *args, **kwargs)
+
+    def destroy(self, request, *args, **kwargs):
+        with transaction.atomic(using=self.get_queryset().db):
+            return super().destroy(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        self.get_serializer().validate_editable(instance)
+        delete_expense(instance)
+
+
+class StatementView(APIView):
+    
+    """
+    API view returning the current user's statement for one month: the balance
+    summary of the period and its line items.
+    
+    Statements of past months are frozen snapshots served from the cache; the
+    current month's is rebuilt only after the user's expenses or settlements change.
+    """
+    
+    permission_classes = [IsAuthenticated]
+    throttle_cost = 2
+
+    def get(self, request, year, month, *args, **kwargs):
+        if not 1 <= month <= 12 or year < 1:
+            raise ValidationError({'month': 'Expected a year and a month between 1 and 12.'})
+        period = datetime(year, month, 1, tzinfo=dt_timezone.utc)
+        if period > timezone.now():
+            raise ValidationError({'month': 'Statements are only available up to the current month.'})
+        return Response(get_statement(request.user.id, period), status=status.HTTP_200_OK)
+
+
+class SettlementView(generics.ListCreateAPIView):
+    
+    """
+    API view recording that the current user paid another user, and listing the
+    settlements the current user paid or received, newest first.
+    
+    Optional filter: ?counterparty=<user id>. POST accepts an Idempotency-Key.
+    """
+    
+    serializer_class = SettlementSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_cost = 2
+
+    def get_queryset(self):
+        user_id = self.request.user.id
+        settlements = Settlement.objects.filter(Q(payer_id=user_id) | Q(payee_id=user_id))
+        counterparty = self.request.query_params.get('counterparty')
+        if counterparty is not None:
+            if not counterparty.isdigit():
+                raise ValidationError({'counterparty': 'Expected a user id.'})
+            settlements = settlements.filter(Q(payer_id=counterparty) | Q(payee_id=counterparty))
+        return settlements.order_by('-created_at', '-id')
+
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return super().create(request, *args, **kwargs)
+        return idempotent_response(request, key, lambda: super(SettlementView, self).create(request, *args, **kwargs))
+
+
+class BalanceSheetExportMixin:
+    
+    """
+    Filters and the NDJSON mode shared by the balance sheet exports.
+    
+    Query parameters: ?start= and ?end= (dates, inclusive), ?owner=<user id>,
+    ?counterparty=<user id> and ?export_format=csv|ndjson (`format` itself is
+    taken by DRF's content negotiation). Rows older than the hot tables are read
+    from the ledger archive.
+    """
+    
+    # Restrict rows to the requesting user's own shares.
+    personal = False
+    ndjson_filename = 'balance_sheet.ndjson'
+
+    def get_export_filters(self):
+        params = self.request.query_params
+        export_format = params.get('export_format', 'csv')
+        if export_format not in ('csv', 'ndjson'):
+            raise ValidationError({'export_format': "Expected 'csv' or 'ndjson'."})
+        filters = {'format': export_format}
+        for name in ('owner', 'counterparty'):
+            value = params.get(name)
+            if value is not None and not value.isdigit():
+                raise ValidationError({name: 'Expected a user id.'})
+            filters[name] = int(value) if value is not None else None
+        filters['start'], filters['end'] = parse_date_range(params)
+        return filters
+
+    def ledger_rows(self, fields, filters):
+        
+        """
+        Yield tuples of `fields` for the matching rows: archived rows first, then the
+        hot table read through a server-side cursor, all in creation order. The hot
+        rows of an owner come from their shard; other exports merge every shard.
+        """
+        
+        user_id = self.request.user.id if self.personal else None
+        owner_id, counterparty_id = filters['owner'], filters['counterparty']
+
+        balance_sheets = BalanceSheet.objects.all()
+        if user_id is not None:
+            balance_sheets = balance_sheets.filter(user_id=user_id)
+        if owner_id is not None:
+            balance_sheets = balance_sheets.filter(owner_id=owner_id)
+        if counterparty_id is not None:
+            # On a personal export the other party is always the owner.
+            balance_sheets = balance_sheets.filter(
+                Q(owner_id=counterparty_id) if self.personal else Q(user_id=counterparty_id) | Q(owner_id=counterparty_id)
+            )
+        balance_sheets = filter_created_between(balance_sheets, filters['start'], filters['end'])
+
+        def matches(row_user_id, row_owner_id):
+            return (
+                (owner_id is None or row_owner_id == owner_id)
+                and (counterparty_id is None or row_owner_id == counterparty_id
+                     or (not self.personal and row_user_id == counterparty_id))
+            )
+
+        # Narrowed to the files of the user, owner or counterparty named.
+        equals = {column: value for column, value in (('user_id', user_id), ('owner_id', owner_id)) if value is not None}
+        archived = archived_rows(
+            'balancesheet', tuple(fields) + ('user_id', 'owner_id'), filters['start'], filters['end'],
+            involving=counterparty_id, **equals
+        )
+        yield from (row[:-2] for row in archived if matches(*row[-2:]))
+        aliases = ledger_aliases(owner_id if owner_id is not None or not self.personal else counterparty_id)
+        yield from merge_ordered(
+            [balance_sheets.using(alias) for alias in aliases], fields, ('created_at', 'id')
+        )
+
+    def ndjson_response(self, filters):
+        rows = self.ledger_rows([column for column, _ in NDJSON_COLUMNS], filters)
+        response = StreamingHttpResponse(
+            streaming_content=buffered(profile_memory(ndjson_rows(rows), type(self).__name__)),
+            content_type=NDJSON_CONTENT_TYPE,
+        )
+        response['Content-Disposition'] = f'attachment; filename="{self.ndjson_filename}"'
+        return response
+
+
+class GenerateBalanceSheetCSVView(BalanceSheetExportMixin, generics.GenericAPIView):
     
     """
     API view to generate a CSV report of BalanceSheet for the current user.
+    
+    Accepts the filters of BalanceSheetExportMixin, and ?export_format=ndjson.
     """
     
     permission_classes = [IsAuthenticated]
+    throttle_cost = 10
+    personal = True
 
     def get(self, request, *args, **kwargs):
-        user = request.user
+        filters = self.get_export_filters()
+        if filters['format'] == 'ndjson':
+            return self.ndjson_response(filters)
         
-        # Filter BalanceSheet by the current user
-        balance_sheets = BalanceSheet.objects.filter(user=user)
+        # Read plain tuples with integer cents for the current user's rows
+        rows = self.ledger_rows(
+            ('id', 'expense_id', 'split_amount_cents', 'owner_id', 'amount_cents', 'title', 'description'), filters
+        )
         
         # Create streaming response with CSV content
         response = StreamingHttpResponse(
-            streaming_content=self.generate_csv(balance_sheets),
+            streaming_content=profile_memory(self.generate_csv(rows), type(self).__name__),
             content_type='text/csv',
         )
         response['Content-Disposition'] = 'attachment; filename="balance_sheet.csv"'
         
         return response
 
-    def generate_csv(self, balance_sheets):
+    def generate_csv(self, rows):
         # Generator function to yield CSV rows progressively
         pseudo_buffer = StringIO()
         writer = csv.writer(pseudo_buffer)
@@ -81,16 +417,15 @@ class GenerateBalanceSheetCSVView(generics.GenericAPIView):
         # Write header row
         writer.writerow(['ID', 'Expense ID', 'Split Amount', 'Owner ID', 'Total Amount', 'Title', 'Description'])
         
-        for sheet in balance_sheets:
-            expense = sheet.expense
+        for sheet_id, expense_id, split_cents, owner_id, amount_cents, title, description in rows:
             writer.writerow([
-                sheet.id,
-                expense.id,
-                sheet.split_amount,
-                sheet.owner.id,
-                sheet.amount,
-                expense.title,
-                expense.description
+                sheet_id,
+                expense_id,
+                format_cents(split_cents),
+                owner_id,
+                format_cents(amount_cents),
+                title,
+                description
             ])
             
             # Yield the content of the buffer
@@ -101,26 +436,36 @@ class GenerateBalanceSheetCSVView(generics.GenericAPIView):
             pseudo_buffer.truncate(0)
 
 
-class GenerateOverallBalanceSheetCSVView(generics.GenericAPIView):
+class GenerateOverallBalanceSheetCSVView(BalanceSheetExportMixin, generics.GenericAPIView):
     """
     API view to generate a CSV report of the overall BalanceSheet for all users.
+    
+    Accepts the filters of BalanceSheetExportMixin, and ?export_format=ndjson.
     """
     permission_classes = [IsAuthenticated]
+    throttle_cost = 25
+    ndjson_filename = 'overall_balance_sheet.ndjson'
 
     def get(self, request, *args, **kwargs):
-        # Fetch all balance sheets
-        balance_sheets = BalanceSheet.objects.all()
+        filters = self.get_export_filters()
+        if filters['format'] == 'ndjson':
+            return self.ndjson_response(filters)
+        
+        # Read plain tuples with integer cents for every matching row
+        rows = self.ledger_rows(
+            ('id', 'expense_id', 'user_id', 'split_amount_cents', 'owner_id', 'amount_cents', 'title', 'description'), filters
+        )
         
         # Create streaming response with CSV content
         response = StreamingHttpResponse(
-            streaming_content=self.generate_csv(balance_sheets),
+            streaming_content=profile_memory(self.generate_csv(rows), type(self).__name__),
             content_type='text/csv',
         )
         response['Content-Disposition'] = 'attachment; filename="overall_balance_sheet.csv"'
         
         return response
 
-    def generate_csv(self, balance_sheets):
+    def generate_csv(self, rows):
         # Generator function to yield CSV rows progressively
         pseudo_buffer = StringIO()
         writer = csv.writer(pseudo_buffer)
@@ -128,17 +473,16 @@ class GenerateOverallBalanceSheetCSVView(generics.GenericAPIView):
         # Write header row
         writer.writerow(['ID', 'Expense ID', 'User ID', 'Split Amount', 'Owner ID', 'Total Amount', 'Title', 'Description'])
         
-        for sheet in balance_sheets:
-            expense = sheet.expense
+        for sheet_id, expense_id, user_id, split_cents, owner_id, amount_cents, title, description in rows:
             writer.writerow([
-                sheet.id,
-                expense.id,
-                sheet.user.id,
-                sheet.split_amount,
-                sheet.owner.id,
-                sheet.amount,
-                expense.title,
-                expense.description
+                sheet_id,
+                expense_id,
+                user_id,
+                format_cents(split_cents),
+                owner_id,
+                format_cents(amount_cents),
+                title,
+                description
             ])
             
             # Yield the content of the buffer
@@ -165,25 +509,283 @@ class GetUserByEmailView(APIView):
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
         
 
-class GetUserExpensesView(generics.ListAPIView):
+class BulkUserLookupView(APIView):
+    
+    """
+    API view resolving many emails and/or mobile numbers in a single query.
+    
+    Emails match case-insensitively through the Lower('email') index. The response
+    lists the matching users and the emails and mobiles that were not found.
+    """
+    
+    permission_classes = [AllowAny]
+    throttle_cost = 5
+
+    def post(self, request, *args, **kwargs):
+        if not isinstance(request.data, dict):
+            return Response({'error': 'Expected a JSON object with emails and mobiles'}, status=status.HTTP_400_BAD_REQUEST)
+        emails = request.data.get('emails', [])
+        mobiles = request.data.get('mobiles', [])
+        if not isinstance(emails, list) or not isinstance(mobiles, list) or not all(
+            isinstance(value, str) for value in emails + mobiles
+        ):
+            return Response({'error': 'emails and mobiles must be lists of strings'}, status=status.HTTP_400_BAD_REQUEST)
+        if not emails and not mobiles:
+            return Response({'error': 'At least one email or mobile is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(emails) + len(mobiles) > settings.USER_LOOKUP_MAX_ITEMS:
+            return Response(
+                {'error': f'At most {settings.USER_LOOKUP_MAX_ITEMS} emails and mobiles can be looked up at once'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        lowered = {email.lower() for email in emails}
+        users = CustomUser.objects.annotate(email_lower=Lower('email')).filter(
+            Q(email_lower__in=lowered) | Q(mobile__in=set(mobiles))
+        ).order_by('id')
+        found = read_plan_for(CustomUserListSerializer).rows(users)
+
+        found_emails = {user['email'].lower() for user in found}
+        found_mobiles = {user['mobile'] for user in found}
+        return Response({
+            'found': found,
+            'missing': {
+                'emails': list(dict.fromkeys(email for email in emails if email.lower() not in found_emails)),
+                'mobiles': list(dict.fromkeys(mobile for mobile in mobiles if mobile not in found_mobiles)),
+            },
+        }, status=status.HTTP_200_OK)
+        
+
+class GetUserExpensesView(FastListMixin, generics.ListAPIView):
     serializer_class = ExpenseCreateSerializer
     permission_classes = [IsAuthenticated]
+    throttle_cost = 3
+    reads_archived_splits = True
 
     def get_queryset(self):
         user = self.request.user
-        return Expense.objects.filter(owner=user)
+        return Expense.objects.using(shard_for_owner(user.id)).filter(owner=user)
     
     
-class GetAllExpensesView(generics.ListAPIView):
+class GetAllExpensesView(FastListMixin, generics.ListAPIView):
     queryset = Expense.objects.all()
     serializer_class = ExpenseCreateSerializer
     permission_classes = [AllowAny]
+    throttle_cost = 10
+    reads_archived_splits = True
+
+    def get_querysets(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        return [queryset.using(alias) for alias in ledger_shards()]
     
 
-class GetExpensesByUserView(generics.ListAPIView):
+class GetExpensesByUserView(FastListMixin, generics.ListAPIView):
     serializer_class = ExpenseCreateSerializer
     permission_classes = [AllowAny]  # Adjust permission as per your requirement
+    throttle_cost = 3
+    reads_archived_splits = True
 
     def get_queryset(self):
         user_id = self.kwargs.get('user_id')
-        return Expense.objects.filter(owner_id=user_id)
\ No newline at end of file
+        return Expense.objects.using(shard_for_owner(user_id)).filter(owner_id=user_id)
+
+
+class SearchExpensesView(FastListMixin, generics.ListAPIView):
+    
+    """
+    API view for full-text search over expense titles and descriptions.
+    
+    ?q= is required. Optional ?owner=<user id> and ?participant=<user id> narrow
+    the matches and ?limit= caps them (default 50, at most 200). Results come
+    best match first, in the same shape as the other expense lists.
+    """
+    
+    queryset = Expense.objects.none()
+    serializer_class = ExpenseCreateSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_cost = 5
+    reads_archived_splits = True
+    default_limit = 50
+    max_limit = 200
+
+    def get_querysets(self):
+        params = self.request.query_params
+        query = params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'A search query is required.'})
+        filters = {}
+        for name in ('owner', 'participant', 'limit'):
+            value = params.get(name)
+            if value is not None and not value.isdigit():
+                raise ValidationError({name: 'Expected a positive integer.'})
+            filters[name] = int(value) if value is not None else None
+        limit = min(filters['limit'] or self.default_limit, self.max_limit)
+
+        # Rank once, then list by id so the read path never nests the search SQL.
+        # Each ledger shard ranks its own matches; the best `limit` overall are kept.
+        matches = []
+        for alias in ledger_aliases(filters['owner']):
+            matches.extend(
+                (rank, created_at, expense_id, alias)
+                for rank, created_at, expense_id in search_expenses(
+                    query, owner_id=filters['owner'], participant_id=filters['participant'], using=alias
+                ).values_list('rank', 'created_at', 'id')[:limit]
+            )
+        matches.sort(reverse=True)
+        ranked = matches[:limit]
+        if not ranked:
+            return [Expense.objects.none()]
+
+        self.row_positions = {expense_id: position for position, (_, _, expense_id, _) in enumerate(ranked)}
+        ids_by_alias = {}
+        for _, _, expense_id, alias in ranked:
+            ids_by_alias.setdefault(alias, []).append(expense_id)
+        return [
+            Expense.objects.using(alias).filter(id__in=ids).order_by(
+                Case(*[When(id=expense_id, then=self.row_positions[expense_id]) for expense_id in ids])
+            )
+            for alias, ids in ids_by_alias.items()
+        ]
+
+
+class DBConnectionStatsView(APIView):
+    
+    """
+    API view exposing database connection reuse and pool saturation metrics.
+    """
+    
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(connection_stats(), status=status.HTTP_200_OK)
+
+
+class SlowQueryLogView(APIView):
+    
+    """
+    API view listing slow query shapes and recent slow queries; DELETE clears them.
+    """
+    
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(slow_query_snapshot(), status=status.HTTP_200_OK)
+
+    def delete(self, request, *args, **kwargs):
+        reset_slow_queries()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class BalanceEventStreamView(View):
+    
+    """
+    Server-Sent Events stream of balance changes for the authenticated user.
+    
+    Serve it through ASGI: every open stream is an idle coroutine rather than a
+    worker thread. Browsers' EventSource cannot send headers, so the access token
+    may also be passed as ?token=.
+    """
+    
+    async def get(self, request, *args, **kwargs):
+        user = await sync_to_async(self.authenticate)(request)
+        if user is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided or are invalid.'}, status=401)
+
+        response = StreamingHttpResponse(self.stream(user.id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def authenticate(self, request):
+        jwt_auth = JWTAuthentication()
+        try:
+            header = jwt_auth.get_header(request)
+            raw_token = jwt_auth.get_raw_token(header) if header else request.GET.get('token')
+            if not raw_token:
+                return None
+            user = jwt_auth.get_user(jwt_auth.get_validated_token(raw_token))
+        except (InvalidToken, AuthenticationFailed):
+            return None
+        return user if user.is_active else None
+
+    async def stream(self, user_id):
+        broker = get_broker()
+        subscription = broker.subscribe(user_id)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=settings.BALANCE_EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(user_id, subscription)
+
+
+def parse_date_range(query_params):
+    
+    """
+    Turn ?start=YYYY-MM-DD&end=YYYY-MM-DD into an aware [start, end) datetime range.
+    
+    Both bounds are optional and `end` is inclusive. Raises ValidationError on bad input.
+    """
+    
+    bounds = []
+    for name in ('start', 'end'):
+        value = query_params.get(name)
+        if not value:
+            bounds.append(None)
+            continue
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise ValidationError({name: 'Expected a date in YYYY-MM-DD format.'})
+        if name == 'end':
+            day += timedelta(days=1)
+        bounds.append(timezone.make_aware(datetime.combine(day, time.min)))
+    return bounds
+
+
+def filter_created_between(queryset, start, end):
+    
+    """
+    Bound a ledger queryset to created_at in [start, end) and order it by creation.
+    
+    Filtering on the partition key lets PostgreSQL skip monthly partitions outside
+    the range, and creation order is a cheap ordered scan of those partitions.
+    """
+    
+    if start is not None:
+        queryset = queryset.filter(created_at__gte=start)
+    if end is not None:
+        queryset = queryset.filter(created_at__lt=end)
+    return queryset.order_by('created_at', 'id')
+
+
+class BalanceSummaryView(APIView):
+    
+    """
+    API view returning the current user's totals paid, owed and owing, overall and
+    per counterparty, aggregated in the database.
+    
+    Optional filters: ?start=, ?end= (dates, inclusive) and ?counterparty=<user id>.
+    """
+    
+    permission_classes = [IsAuthenticated]
+    throttle_cost = 3
+
+    def get(self, request, *args, **kwargs):
+        start, end = parse_date_range(request.query_params)
+        counterparty = request.query_params.get('counterparty')
+        if counterparty is not None and not counterparty.isdigit():
+            raise ValidationError({'counterparty': 'Expected a user id.'})
+        summary = balance_summary(
+            request.user.id,
+            start=start,
+            end=end,
+            counterparty_id=int(counterparty) if counterparty is not None else None,
+        )
+        return Response(summary, status=status.HTTP_200_OK)
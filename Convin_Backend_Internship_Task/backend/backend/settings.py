@@ -40,6 +40,9 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
+    "DEFAULT_THROTTLE_CLASSES": [
+        "api.throttling.CostWeightedThrottle",
+    ],
 }
 
 SIMPLE_JWT = {
@@ -68,6 +71,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.slowqueries.SlowQueryMiddleware',
+    'api.throttling.LoadSheddingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     "corsheaders.middleware.CorsMiddleware",
@@ -105,9 +110,26 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        # Reuse connections across requests instead of reconnecting every time.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True',
     }
 }
 
+# Optional connection pooling (requires psycopg[pool]). Pooling replaces
+# persistent connections, so CONN_MAX_AGE is forced to 0 when it is enabled.
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '0'))
+
+if DB_POOL_MAX_SIZE:
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -153,4 +175,129 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 CORS_ALLOW_ALL_ORIGINS = True
-CORS_ALLOWS_CREDENTIALS = True
\ No newline at end of file
+CORS_ALLOWS_CREDENTIALS = True
+
+
+# Expenses with more participants than this are committed with a compact outbox
+# record and expanded into splits by the process_split_outbox worker.
+SPLIT_OUTBOX_THRESHOLD = int(os.getenv('SPLIT_OUTBOX_THRESHOLD', '500'))
+
+# Rows written per bulk insert when materializing splits.
+SPLIT_BATCH_SIZE = int(os.getenv('SPLIT_BATCH_SIZE', '1000'))
+
+# How long a stored Idempotency-Key response can be replayed.
+IDEMPOTENCY_KEY_TTL = timedelta(hours=int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', '24')))
+
+# Pub/sub backend behind the api/balance-events/ stream. The default only reaches
+# subscribers in the same process; point this at another class to fan out wider.
+BALANCE_EVENTS_BACKEND = os.getenv('BALANCE_EVENTS_BACKEND', 'api.events.InProcessBroker')
+
+# Seconds between keep-alive comments on idle event streams.
+BALANCE_EVENTS_HEARTBEAT = float(os.getenv('BALANCE_EVENTS_HEARTBEAT', '15'))
+
+# Build list responses from precompiled read plans instead of DRF serializers.
+FAST_READ_SERIALIZERS = os.getenv('FAST_READ_SERIALIZERS', 'True') == 'True'
+
+# Maximum number of emails plus mobile numbers accepted by one bulk user lookup.
+USER_LOOKUP_MAX_ITEMS = int(os.getenv('USER_LOOKUP_MAX_ITEMS', '5000'))
+
+# Opt-in PostgreSQL partitioning of the ExpenseSplit and BalanceSheet tables:
+# '' (off), 'month' (range on created_at) or 'user' (hash of user_id). Applied by
+# migration 0021 when set before migrating, or later by the partition_ledger command.
+LEDGER_PARTITIONING = os.getenv('LEDGER_PARTITIONING', '')
+
+# Hash partitions per table when partitioning by user.
+LEDGER_HASH_PARTITIONS = int(os.getenv('LEDGER_HASH_PARTITIONS', '16'))
+
+# Monthly partitions kept ready ahead of time by create_ledger_partitions.
+LEDGER_PARTITION_MONTHS_AHEAD = int(os.getenv('LEDGER_PARTITION_MONTHS_AHEAD', '3'))
+
+# Where archive_ledger writes compressed ledger archives, and the default age
+# (in days) of the rows it moves out of the hot tables.
+LEDGER_ARCHIVE_DIR = os.getenv('LEDGER_ARCHIVE_DIR', str(BASE_DIR / 'ledger_archive'))
+LEDGER_ARCHIVE_AFTER_DAYS = int(os.getenv('LEDGER_ARCHIVE_AFTER_DAYS', '180'))
+# Each archived month is split into this many files by user_id, so reading one
+# user's archived rows decompresses a fraction of the month.
+LEDGER_ARCHIVE_BUCKETS = int(os.getenv('LEDGER_ARCHIVE_BUCKETS', '64'))
+
+# Rows fetched per server-side cursor round trip by the balance sheet exports,
+# and the size of the chunks NDJSON exports are streamed in.
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '5000'))
+EXPORT_BUFFER_BYTES = int(os.getenv('EXPORT_BUFFER_BYTES', str(64 * 1024)))
+# Opt-in tracemalloc profile of every export, logged by api.exports when the
+# stream ends: peak memory, per-row figures and the EXPORT_MEMORY_TOP largest
+# allocation sites, sampled every EXPORT_MEMORY_SAMPLE_ROWS rows. Tracing slows
+# allocation-heavy code down noticeably; enable it to investigate, not by default.
+EXPORT_MEMORY_PROFILE = os.getenv('EXPORT_MEMORY_PROFILE', 'False') == 'True'
+EXPORT_MEMORY_TOP = int(os.getenv('EXPORT_MEMORY_TOP', '10'))
+EXPORT_MEMORY_SAMPLE_ROWS = int(os.getenv('EXPORT_MEMORY_SAMPLE_ROWS', '1000'))
+
+# Opt-in slow-query log, listed on api/slow-queries/. Statements slower than the
+# threshold are recorded per normalized shape and a sample of the slow reads is
+# explained (EXPLAIN ANALYZE on PostgreSQL, which runs the query a second time).
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', 'False') == 'True'
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '200'))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', '0.1'))
+SLOW_QUERY_MAX_SHAPES = int(os.getenv('SLOW_QUERY_MAX_SHAPES', '500'))
+SLOW_QUERY_RECENT = int(os.getenv('SLOW_QUERY_RECENT', '100'))
+
+# Opt-in token-bucket throttling. Each request takes its view's throttle_cost in
+# tokens from its client's bucket and from its view's bucket shared by all
+# clients. Rates are tokens per second, bursts the bucket sizes. Buckets live in
+# the THROTTLE_CACHE cache, which is per process unless CACHES points elsewhere.
+THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', 'False') == 'True'
+THROTTLE_CACHE = os.getenv('THROTTLE_CACHE', 'default')
+THROTTLE_USER_RATE = float(os.getenv('THROTTLE_USER_RATE', '20'))
+THROTTLE_USER_BURST = float(os.getenv('THROTTLE_USER_BURST', '200'))
+THROTTLE_ANON_RATE = float(os.getenv('THROTTLE_ANON_RATE', '5'))
+THROTTLE_ANON_BURST = float(os.getenv('THROTTLE_ANON_BURST', '50'))
+THROTTLE_ROUTE_RATE = float(os.getenv('THROTTLE_ROUTE_RATE', '200'))
+THROTTLE_ROUTE_BURST = float(os.getenv('THROTTLE_ROUTE_BURST', '1000'))
+
+# Opt-in load shedding: views with a throttle_cost of at least LOAD_SHED_MIN_COST
+# get 503 with Retry-After once LOAD_SHED_MAX_HEAVY of them run in this process,
+# or while a SELECT 1 probe (every LOAD_SHED_PROBE_INTERVAL seconds) is slower
+# than LOAD_SHED_DB_LATENCY_MS.
+LOAD_SHEDDING = os.getenv('LOAD_SHEDDING', 'False') == 'True'
+LOAD_SHED_MIN_COST = int(os.getenv('LOAD_SHED_MIN_COST', '10'))
+LOAD_SHED_MAX_HEAVY = int(os.getenv('LOAD_SHED_MAX_HEAVY', '8'))
+LOAD_SHED_DB_LATENCY_MS = float(os.getenv('LOAD_SHED_DB_LATENCY_MS', '250'))
+LOAD_SHED_PROBE_INTERVAL = float(os.getenv('LOAD_SHED_PROBE_INTERVAL', '1'))
+LOAD_SHED_RETRY_AFTER = int(os.getenv('LOAD_SHED_RETRY_AFTER', '2'))
+
+# Optional owner-hash sharding of the ledger (Expense, ExpenseSplit, BalanceSheet
+# and SplitOutbox rows) across the database aliases in LEDGER_SHARDS. Keep the
+# order fixed and only append: each shard's position selects its id range.
+# Aliases not already in DATABASES copy 'default', with NAME <DB_NAME>_<alias>
+# unless <ALIAS>_DB_NAME / <ALIAS>_DB_HOST are set. Owners hash into
+# LEDGER_SHARD_BUCKETS buckets placed by the LedgerShardBucket map, which each
+# process caches for LEDGER_SHARD_MAP_TTL seconds.
+LEDGER_SHARDS = [alias.strip() for alias in os.getenv('LEDGER_SHARDS', '').split(',') if alias.strip()]
+for _alias in LEDGER_SHARDS:
+    if _alias not in DATABASES:
+        DATABASES[_alias] = {
+            **DATABASES['default'],
+            'NAME': os.getenv(f'{_alias.upper()}_DB_NAME', f"{DATABASES['default']['NAME']}_{_alias}"),
+            'HOST': os.getenv(f'{_alias.upper()}_DB_HOST', DATABASES['default']['HOST']),
+        }
+DATABASE_ROUTERS = ['api.sharding.LedgerShardRouter']
+LEDGER_SHARD_BUCKETS = int(os.getenv('LEDGER_SHARD_BUCKETS', '1024'))
+LEDGER_SHARD_MAP_TTL = float(os.getenv('LEDGER_SHARD_MAP_TTL', '5'))
+
+# Counter rows per pair of users holding their running settlement total.
+# Different pairs never share a row; more slots mean less waiting when the
+# same two users settle concurrently. compact_settlement_counters folds them
+# back into one row per pair.
+SETTLEMENT_COUNTER_SLOTS = int(os.getenv('SETTLEMENT_COUNTER_SLOTS', '8'))
+
+# Monthly statements. A month's statements close (and are never rebuilt again)
+# STATEMENT_CLOSE_AFTER_DAYS after it ends; closed ones are kept in the
+# STATEMENT_CACHE cache. Open statements are rebuilt after writes mark them
+# stale, or once they are STATEMENT_OPEN_TTL seconds old.
+STATEMENT_CLOSE_AFTER_DAYS = int(os.getenv('STATEMENT_CLOSE_AFTER_DAYS', '1'))
+STATEMENT_CACHE = os.getenv('STATEMENT_CACHE', 'default')
+STATEMENT_OPEN_TTL = int(os.getenv('STATEMENT_OPEN_TTL', '300'))
+
+# Admin change lists count rows exactly up to this many; past it they use the
+# table's planner estimate (unfiltered) or stop counting (filtered).
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv('ADMIN_EXACT_COUNT_LIMIT', '10000'))